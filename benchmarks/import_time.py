@@ -0,0 +1,58 @@
+"""Measures cold import cost of the salkku modules with `python -X importtime`.
+
+    python benchmarks/import_time.py --repeat 5 --output import_times.json
+    python benchmarks/import_time.py salkku.storage salkku_ap
+
+Each module is imported in a fresh interpreter; the best of `repeat` runs is reported together with the
+heavy third-party packages that the import pulled in.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MODULES = ["salkku.db", "salkku.storage", "salkku.valuation", "salkku.jobs", "salkku.cli", "salkku_ap"]
+HEAVY_PACKAGES = ("streamlit", "pandas", "numpy", "yfinance", "reportlab", "pyarrow", "altair")
+
+def import_profile(module):
+    started = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=ROOT,
+                               capture_output=True, text=True, check=True)
+    wall = time.perf_counter() - started
+    cumulative = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, total, name = line[len("import time:"):].split("|")
+        if total.strip().isdigit():
+            cumulative[name.strip()] = int(total)
+    return {
+        "import_ms": cumulative.get(module, 0) / 1000.0,
+        "wall_ms": wall * 1000.0,
+        "heavy": [package for package in HEAVY_PACKAGES if package in cumulative],
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Salkkumoduulien tuontiajat kylmässä tulkissa.")
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--repeat", type=int, default=3, help="Toistoja moduulia kohden; paras tulos raportoidaan.")
+    parser.add_argument("--output", help="JSON-tulostiedosto.")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for module in args.modules:
+        runs = [import_profile(module) for _ in range(args.repeat)]
+        results[module] = min(runs, key=lambda run: run["import_ms"])
+        result = results[module]
+        print(f"{module:20} {result['import_ms']:9.1f} ms  (wall {result['wall_ms']:7.1f} ms)  {', '.join(result['heavy']) or '-'}",
+              file=sys.stderr)
+    if args.output:
+        with open(args.output, "w") as target:
+            json.dump(results, target, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
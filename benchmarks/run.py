@@ -0,0 +1,175 @@
+"""Benchmarks the storage, pricing, valuation and reporting paths against synthetic databases.
+
+    python benchmarks/run.py --tiers small medium --repeat 20 --output results.json
+    python benchmarks/run.py --baseline old.json --output new.json
+
+Prices come from benchmarks/price_stub.py, so runs need no network and are comparable across machines
+only in relative terms. Each operation is timed `repeat` times for latency percentiles and run once more
+under tracemalloc for its peak Python allocation.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import price_stub
+from salkku import analytics, columnar, db, ledger, pricing, reporting, storage, valuation
+from synthetic_db import generate
+
+TIERS = {
+    "small": {"users": 2, "portfolios": 2, "assets": 20, "days": 90},
+    "medium": {"users": 10, "portfolios": 5, "assets": 100, "days": 365},
+    "large": {"users": 50, "portfolios": 10, "assets": 200, "days": 1095},
+}
+PERCENTILES = (50, 90, 99)
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def measure(function, repeat, setup=None):
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    if setup:
+        setup()
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    timings = np.array(timings) * 1000.0
+    result = {"runs": repeat, "mean_ms": float(timings.mean()), "min_ms": float(timings.min()), "max_ms": float(timings.max())}
+    result.update({f"p{percentile}_ms": float(np.percentile(timings, percentile)) for percentile in PERCENTILES})
+    result["peak_memory_mb"] = peak / 1e6
+    return result
+
+def benchmark_tier(name, scale, repeat, workdir):
+    path = os.path.join(workdir, f"{name}.db")
+    started = time.perf_counter()
+    counts = generate(path, **scale)
+    generate_seconds = time.perf_counter() - started
+    db.DB_FILE = path
+    db.init_db()
+
+    # Every per-portfolio benchmark uses user 1's first portfolio in load_portfolios order (lowest id).
+    user_id = 1
+    cache = storage.get_portfolio_cache()
+    portfolios = storage.load_portfolios(user_id)
+    portfolio_name = next(iter(portfolios))
+    assets = portfolios[portfolio_name]
+    portfolio_id = storage.get_portfolio_id(portfolio_name, user_id)
+    portfolio_ids = list(storage.load_portfolio_ids(user_id).values())
+    tickers = sorted({asset.ticker for asset in assets if not asset.is_manual and asset.ticker})
+    prices = pricing.get_stock_data(tickers, max_age=-1)
+    df, total_row = valuation.calculate_portfolio_metrics(assets, prices)
+    transactions = ledger.load_transactions(portfolio_id, limit=-1)
+    price_index = pd.bdate_range(end=datetime.now().date(), periods=scale["days"])
+    price_matrix = pd.DataFrame(price_stub.stub_closes(tickers, price_index), index=price_index, columns=tickers)
+    columnar_dir = os.path.join(workdir, f"{name}_columnar")
+    columnar.export_history_columnar(columnar_dir, until="9999-12-31")
+    # The cached report benchmark measures cache hits only, so the report is stored once up front.
+    reporting.get_pdf_report(df, total_row, portfolio_name)
+    edits = {"count": 0}
+
+    def save_one_change():
+        edits["count"] += 1
+        changed = {name: [asset.to_dict() for asset in portfolio] for name, portfolio in portfolios.items()}
+        changed[portfolio_name][0]["shares"] = 1.0 + edits["count"]
+        storage.save_portfolios(user_id, changed)
+
+    results = {
+        "load_portfolios": measure(lambda: storage.load_portfolios(user_id), repeat, setup=cache.clear),
+        "load_portfolios_cached": measure(lambda: storage.load_portfolios(user_id), repeat),
+        "save_portfolios": measure(save_one_change, repeat),
+        "get_stock_data": measure(lambda: pricing.get_stock_data(tickers, max_age=-1), repeat),
+        "get_stock_data_cached": measure(lambda: pricing.get_stock_data(tickers), repeat),
+        "calculate_portfolio_metrics": measure(lambda: valuation.calculate_portfolio_metrics(assets, prices), repeat),
+        "create_pdf_report": measure(lambda: reporting.create_pdf_report(df, total_row, portfolio_name), max(1, repeat // 4)),
+        "get_pdf_report_cached": measure(lambda: reporting.get_pdf_report(df, total_row, portfolio_name), repeat),
+        "compute_analytics": measure(lambda: analytics.compute_analytics(assets, transactions, price_matrix), repeat),
+        "load_portfolio_history": measure(lambda: storage.load_portfolio_history(portfolio_id), repeat),
+        "read_columnar_portfolio": measure(lambda: columnar.read_columnar("portfolio_history", portfolio_ids=[portfolio_id], root=columnar_dir), repeat),
+        "read_columnar_all_history": measure(lambda: columnar.read_columnar("portfolio_history", root=columnar_dir), repeat),
+        "load_combined_history": measure(lambda: storage.load_combined_history(portfolio_ids, columnar_root=os.path.join(workdir, "no_export")), repeat),
+        "load_combined_history_columnar": measure(lambda: storage.load_combined_history(portfolio_ids, columnar_root=columnar_dir), repeat),
+    }
+    db.get_connection_pool(path).close()
+    return {
+        "scale": scale,
+        "rows": counts,
+        "portfolio_assets": len(assets),
+        "portfolio_tickers": len(tickers),
+        "generate_seconds": generate_seconds,
+        "results": results,
+    }
+
+def compare(baseline, current):
+    lines = []
+    for tier, tier_result in current["tiers"].items():
+        base_tier = baseline.get("tiers", {}).get(tier)
+        if not base_tier:
+            continue
+        for operation, result in tier_result["results"].items():
+            base = base_tier["results"].get(operation)
+            if base:
+                ratio = result["p50_ms"] / base["p50_ms"] if base["p50_ms"] else float("inf")
+                lines.append(f"{tier:8} {operation:30} {base['p50_ms']:10.2f} -> {result['p50_ms']:10.2f} ms  ({ratio:5.2f}x)")
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Salkkusovelluksen suorituskykymittaukset synteettisellä datalla.")
+    parser.add_argument("--tiers", nargs="+", choices=list(TIERS), default=["small", "medium"])
+    parser.add_argument("--repeat", type=int, default=10, help="Toistoja operaatiota kohden.")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON-tulostiedosto.")
+    parser.add_argument("--baseline", help="Aiempi JSON-tulos, johon mediaaneja verrataan.")
+    parser.add_argument("--workdir", help="Hakemisto synteettisille tietokannoille (oletus: väliaikainen).")
+    args = parser.parse_args(argv)
+
+    price_stub.install()
+    workdir = args.workdir or tempfile.mkdtemp(prefix="salkku-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    # salkku.config read SALKKU_REPORT_CACHE at import, so the reporting module's copy is redirected directly.
+    reporting.REPORT_CACHE_DIR = os.path.join(workdir, "report_cache")
+    output = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+        },
+        "tiers": {},
+    }
+    for tier in args.tiers:
+        print(f"{tier}: {TIERS[tier]}", file=sys.stderr)
+        output["tiers"][tier] = benchmark_tier(tier, TIERS[tier], args.repeat, workdir)
+        for operation, result in output["tiers"][tier]["results"].items():
+            print(f"  {operation:30} p50 {result['p50_ms']:9.2f} ms  p99 {result['p99_ms']:9.2f} ms  peak {result['peak_memory_mb']:7.2f} MB", file=sys.stderr)
+    with open(args.output, "w") as target:
+        json.dump(output, target, indent=2)
+    if args.baseline:
+        with open(args.baseline) as source:
+            print(compare(json.load(source), output))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
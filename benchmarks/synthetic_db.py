@@ -0,0 +1,81 @@
+"""Generates synthetic seuranta.db files at a configurable scale.
+
+    python benchmarks/synthetic_db.py out.db --users 10 --portfolios 5 --assets 100 --days 365
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from salkku.config import ASSET_FIELDS
+from salkku.db import SQLITE_PRAGMAS, migrate_db
+from salkku.storage import hash_password
+
+CURRENCIES = ["EUR", "EUR", "EUR", "USD", "SEK", "GBP"]
+CURRENCY_RATES = {"EUR": 1.0, "USD": 1.08, "SEK": 11.4, "GBP": 0.86}
+
+def generate(path, users=10, portfolios=5, assets=100, days=365, tickers=None, seed=0):
+    """Writes a database with users × portfolios × assets holdings and `days` of history per portfolio."""
+    rng = random.Random(seed)
+    tickers = tickers or max(50, users * portfolios * assets // 20)
+    ticker_pool = [f"SYN{number:05d}" for number in range(tickers)]
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    migrate_db(conn)
+
+    today = date.today()
+    history_dates = [(today - timedelta(days=offset)).isoformat() for offset in range(days, 0, -1)]
+    conn.execute("BEGIN")
+    conn.executemany("INSERT INTO users (id, username, password_hash) VALUES (?, ?, ?)", [
+        (user_id, f"user{user_id}", hash_password("salasana")) for user_id in range(1, users + 1)
+    ])
+    portfolio_rows, asset_rows, history_rows = [], [], []
+    for user_id in range(1, users + 1):
+        for number in range(portfolios):
+            portfolio_id = len(portfolio_rows) + 1
+            portfolio_rows.append((portfolio_id, f"Salkku {number + 1}", user_id))
+            for asset_number in range(assets):
+                currency = rng.choice(CURRENCIES)
+                is_manual = rng.random() < 0.05
+                buy_date = (today - timedelta(days=rng.randint(30, 2000))).isoformat() if rng.random() < 0.5 else None
+                asset_rows.append((
+                    f"Kohde {asset_number + 1}", rng.choice(ticker_pool), round(rng.uniform(1, 500), 2), round(rng.uniform(1, 1000), 2),
+                    round(rng.uniform(1, 500), 2) if is_manual else None, int(is_manual), currency, CURRENCY_RATES[currency],
+                    CURRENCY_RATES[currency], round(100 / assets, 2), buy_date, portfolio_id,
+                ))
+            value = rng.uniform(10_000, 1_000_000)
+            for record_date in history_dates:
+                value *= 1 + rng.gauss(0.0003, 0.01)
+                history_rows.append((portfolio_id, record_date, round(value, 2)))
+    conn.executemany("INSERT INTO portfolios (id, name, user_id) VALUES (?, ?, ?)", portfolio_rows)
+    conn.executemany(f"""
+        INSERT INTO assets ({', '.join(ASSET_FIELDS)}, portfolio_id)
+        VALUES ({', '.join('?' for _ in range(len(ASSET_FIELDS) + 1))})
+    """, asset_rows)
+    conn.executemany("INSERT INTO portfolio_history (portfolio_id, record_date, total_value) VALUES (?, ?, ?)", history_rows)
+    conn.commit()
+    conn.close()
+    return {"users": users, "portfolios": len(portfolio_rows), "assets": len(asset_rows), "history_rows": len(history_rows), "tickers": tickers}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Luo synteettinen seuranta.db-tietokanta suorituskykymittauksia varten.")
+    parser.add_argument("path", help="Luotavan tietokannan polku (korvataan, jos olemassa).")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--portfolios", type=int, default=5, help="Salkkuja käyttäjää kohden.")
+    parser.add_argument("--assets", type=int, default=100, help="Kohteita salkkua kohden.")
+    parser.add_argument("--days", type=int, default=365, help="Historiapäiviä salkkua kohden.")
+    parser.add_argument("--tickers", type=int, default=None, help="Erillisten symbolien määrä.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    print(json.dumps(generate(args.path, args.users, args.portfolios, args.assets, args.days, args.tickers, args.seed)))
+
+if __name__ == "__main__":
+    main()
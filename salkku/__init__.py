@@ -0,0 +1,4 @@
+"""Storage, pricing, valuation and reporting for the portfolio tracker, without a Streamlit dependency.
+
+Submodules are imported on demand; yfinance, reportlab and pyarrow load only when first used.
+"""
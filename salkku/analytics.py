@@ -0,0 +1,219 @@
+"""Time-weighted return, volatility, drawdown, Sharpe ratio and correlations from daily price series."""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from .config import ANALYTICS_CACHE_SIZE, RISK_FREE_RATE, TRADING_DAYS
+from .ledger import load_transactions
+from .metrics import count, timed
+from .pricing import load_price_matrix
+from .valuation import portfolio_content_hash
+
+ANALYTICS_COLUMNS = ["Tuotto (%)", "Vuosituotto (%)", "Volatiliteetti (%)", "Suurin pudotus (%)", "Sharpe"]
+PORTFOLIO_LABEL = "Koko salkku"
+
+@dataclass(frozen=True)
+class PortfolioAnalytics:
+    start: date
+    as_of: date
+    summary: pd.DataFrame
+    correlation: pd.DataFrame
+    values: pd.DataFrame
+
+def series_metrics(returns, risk_free_rate=RISK_FREE_RATE, periods=TRADING_DAYS):
+    """Metrics for each column of a day × series matrix of simple daily returns; NaN marks a day without data."""
+    returns = np.asarray(returns, dtype=float)
+    observed = np.sum(~np.isnan(returns), axis=0)
+    growth = np.nancumprod(1.0 + returns, axis=0)
+    wealth = np.vstack([np.ones((1, returns.shape[1])), growth])
+    total = wealth[-1] - 1.0
+    drawdown = np.min(wealth / np.maximum.accumulate(wealth, axis=0) - 1.0, axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        annualized = np.where(observed > 0, np.power(1.0 + total, periods / np.maximum(observed, 1)) - 1.0, np.nan)
+        mean = np.where(observed > 0, np.nansum(returns, axis=0) / np.maximum(observed, 1), np.nan)
+        deviation = np.sqrt(np.nansum((returns - mean) ** 2, axis=0) / (observed - 1))
+        deviation = np.where(observed > 1, deviation, np.nan)
+        volatility = deviation * np.sqrt(periods)
+        sharpe = np.where(volatility > 0, (mean * periods - risk_free_rate) / volatility, np.nan)
+    return pd.DataFrame({
+        "Tuotto (%)": total * 100,
+        "Vuosituotto (%)": annualized * 100,
+        "Volatiliteetti (%)": volatility * 100,
+        "Suurin pudotus (%)": drawdown * 100,
+        "Sharpe": sharpe,
+    })
+
+def correlation_matrix(returns, labels):
+    """Pairwise correlation of daily returns over the days both series have data."""
+    returns = np.asarray(returns, dtype=float)
+    present = (~np.isnan(returns)).astype(float)
+    centered = np.nan_to_num(returns - np.nanmean(returns, axis=0) if returns.size else returns)
+    overlap = present.T @ present
+    with np.errstate(divide="ignore", invalid="ignore"):
+        covariance = centered.T @ centered / overlap
+        scale = np.sqrt((centered ** 2).T @ present / overlap)
+        correlation = covariance / (scale * scale.T)
+    correlation = np.clip(np.where(overlap > 2, correlation, np.nan), -1.0, 1.0)
+    return pd.DataFrame(correlation, index=labels, columns=labels)
+
+def holding_units(days, holdings, events):
+    """Day × holding share counts and daily income (EUR) from `events`.
+
+    `events` has the columns day (row index), holding (column index), shares (signed change) and income (EUR).
+    """
+    changes = np.zeros((days, holdings))
+    income = np.zeros(days)
+    if len(events):
+        np.add.at(changes, (events["day"].to_numpy(), events["holding"].to_numpy()), events["shares"].to_numpy())
+        np.add.at(income, events["day"].to_numpy(), events["income"].to_numpy())
+    return np.cumsum(changes, axis=0), income
+
+def time_weighted_returns(values, units, income):
+    """Daily returns of the previous day's holdings at today's prices, so trades and deposits never count as return.
+
+    `values` is a day × holding matrix of EUR unit prices; holdings without a price on either day are left out of that day.
+    """
+    both = ~np.isnan(values[1:]) & ~np.isnan(values[:-1])
+    held = units[:-1]
+    current = np.where(both, held * np.nan_to_num(values[1:]), 0.0).sum(axis=1)
+    previous = np.where(both, held * np.nan_to_num(values[:-1]), 0.0).sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(previous > 0, (current + income[1:]) / previous - 1.0, np.nan)
+
+def _holding_events(assets, transactions, columns, days):
+    start = days[0]
+    rows = []
+    for asset in assets:
+        key = ("manual", id(asset)) if asset.get('is_manual') else ("market", asset.get('ticker'))
+        if key not in columns or not asset.get('shares'):
+            continue
+        # Holdings bought before the window are already held on its first day.
+        buy_date = pd.Timestamp(asset['buy_date']) if asset.get('buy_date') else start
+        rows.append((buy_date, columns[key], float(asset['shares']), 0.0))
+    for transaction in transactions.itertuples(index=False):
+        key = ("market", transaction.ticker)
+        if key not in columns:
+            continue
+        trade_date = pd.Timestamp(transaction.trade_date)
+        if transaction.kind == "dividend":
+            income = (transaction.shares * transaction.price - transaction.fees) / transaction.fx_rate
+            rows.append((trade_date, columns[key], 0.0, income if trade_date > start else 0.0))
+        else:
+            rows.append((trade_date, columns[key], transaction.shares if transaction.kind == "buy" else -transaction.shares, 0.0))
+    events = pd.DataFrame(rows, columns=["date", "holding", "shares", "income"])
+    # Trades on non-trading days land on the next trading day; anything before the window on its first day.
+    events["day"] = np.minimum(days.searchsorted(pd.to_datetime(events["date"])), len(days) - 1)
+    return events[events["date"] <= days[-1]]
+
+def compute_analytics(assets, transactions, prices, fx_rates=None, start=None, as_of=None):
+    """Analytics for `assets` plus ledger `transactions` over a day × ticker matrix of closing prices."""
+    fx_rates = fx_rates or {}
+    prices = prices.sort_index().ffill()
+    if start is not None:
+        prices = prices[prices.index >= pd.Timestamp(start)]
+    manual = [asset for asset in assets if asset.get('is_manual') and asset.get('manual_price') is not None]
+    market_columns = list(prices.columns)
+    columns = {("market", ticker): position for position, ticker in enumerate(market_columns)}
+    columns.update({("manual", id(asset)): len(market_columns) + position for position, asset in enumerate(manual)})
+    if prices.empty:
+        empty = pd.DataFrame(columns=["Kohde"] + ANALYTICS_COLUMNS)
+        return PortfolioAnalytics(start, as_of, empty, pd.DataFrame(), pd.DataFrame(columns=["Päivämäärä", "Arvo", "Tuottoindeksi"]))
+
+    days = prices.index
+    currency = {}
+    for asset in assets:
+        currency.setdefault(asset.get('ticker'), (asset.get('currency'), asset.get('current_currency_rate') or 1.0))
+    for transaction in transactions.itertuples(index=False):
+        currency.setdefault(transaction.ticker, (transaction.currency, transaction.fx_rate))
+    rates = np.array([fx_rates.get(currency.get(ticker, (None, 1.0))[0]) or currency.get(ticker, (None, 1.0))[1] for ticker in market_columns]
+                     + [fx_rates.get(asset.get('currency')) or asset.get('current_currency_rate') or 1.0 for asset in manual], dtype=float)
+    market_prices = prices.to_numpy(dtype=float)
+    all_prices = np.hstack([market_prices, np.tile([float(asset['manual_price']) for asset in manual], (len(days), 1))])
+
+    unit_values = all_prices / rates
+    units, income = holding_units(len(days), len(rates), _holding_events(assets, transactions, columns, days))
+    values = np.nansum(unit_values * units, axis=1)
+    portfolio_returns = time_weighted_returns(unit_values, units, income)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        asset_returns = market_prices[1:] / market_prices[:-1] - 1.0
+
+    names = {}
+    for asset in assets:
+        names.setdefault(asset.get('ticker'), asset.get('name'))
+    for transaction in transactions.itertuples(index=False):
+        names.setdefault(transaction.ticker, transaction.name or transaction.ticker)
+    labels = [f"{names.get(ticker) or ticker} ({ticker})" for ticker in market_columns]
+    summary = series_metrics(np.column_stack([portfolio_returns, asset_returns]))
+    summary.insert(0, "Kohde", [PORTFOLIO_LABEL] + labels)
+    summary.insert(1, "Ticker", [None] + market_columns)
+    wealth = np.r_[1.0, np.nancumprod(1.0 + portfolio_returns)]
+    history = pd.DataFrame({"Päivämäärä": days.strftime("%Y-%m-%d"), "Arvo": values, "Tuottoindeksi": wealth * 100})
+    correlation = correlation_matrix(asset_returns, market_columns)
+    return PortfolioAnalytics(days[0].date() if start is None else start, as_of or days[-1].date(), summary, correlation, history)
+
+class AnalyticsCache:
+    def __init__(self, max_entries=ANALYTICS_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            analytics = self._entries.get(key)
+            if analytics is not None:
+                self._entries.move_to_end(key)
+            return analytics
+
+    def put(self, key, analytics):
+        with self._lock:
+            self._entries[key] = analytics
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+_analytics_cache = AnalyticsCache()
+
+def get_analytics_cache():
+    return _analytics_cache
+
+def analytics_content_hash(assets, transactions):
+    digest = hashlib.sha256(portfolio_content_hash(assets).encode())
+    digest.update(json.dumps(transactions.drop(columns="id").to_numpy().tolist(), default=str).encode())
+    return digest.hexdigest()
+
+@timed()
+def portfolio_analytics(portfolio_id, assets, years=1, as_of=None, fx_rates=None):
+    """Analytics of a portfolio's editor `assets` and ledger over the `years` ending at `as_of`, cached per content and day.
+
+    Price history is read from the local price_history table; callers refresh it with update_price_history first.
+    """
+    as_of = as_of or date.today()
+    transactions = load_transactions(portfolio_id, limit=-1).sort_values(["trade_date", "id"])
+    key = (analytics_content_hash(assets, transactions), as_of.isoformat(), years, tuple(sorted((fx_rates or {}).items())))
+    cache = get_analytics_cache()
+    analytics = cache.get(key)
+    if analytics is not None:
+        count("salkku_analytics_cache_total", result="hit")
+        return analytics
+    count("salkku_analytics_cache_total", result="miss")
+    start = as_of - timedelta(days=round(365.25 * years))
+    tickers = {asset.get('ticker') for asset in assets if not asset.get('is_manual') and asset.get('ticker')} | set(transactions["ticker"])
+    # A few days before the window so the first day has a price to carry forward over weekends and holidays.
+    prices = load_price_matrix(tickers, (start - timedelta(days=10)).isoformat(), as_of.isoformat())
+    if not prices.empty:
+        prices = prices.ffill()
+        prices = prices[prices.index >= pd.Timestamp(start)].dropna(axis=1, how="all")
+    analytics = compute_analytics(assets, transactions, prices, fx_rates, start, as_of)
+    cache.put(key, analytics)
+    return analytics
@@ -0,0 +1,98 @@
+"""Command line entry point (python -m salkku)."""
+
+import argparse
+import json
+import sys
+from datetime import date
+
+from .config import COLUMNAR_DIR, METRICS_ENABLED, METRICS_FILE, PRICE_HISTORY_YEARS, SNAPSHOT_CHUNK_SIZE
+from .metrics import get_metrics
+from .db import db_connection, init_db
+from .transfer import export_assets, import_assets
+from .pricing import update_price_history
+from .jobs import export_columnar, generate_all_reports, load_all_portfolios, rebalance_all_portfolios, snapshot_all_portfolios
+from .columnar import COLUMNAR_TABLES
+from .rebalancing import export_orders
+
+def run_cli(argv):
+    parser = argparse.ArgumentParser(prog="python -m salkku", description="Sijoitussalkun seurannan komentorivityökalut.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    snapshot = commands.add_parser("snapshot", help="Tallenna kaikkien salkkujen arvo salkkuhistoriaan.")
+    snapshot.add_argument("--date", help="Kirjauspäivä muodossa YYYY-MM-DD (oletus: tänään).")
+    snapshot.add_argument("--chunk-size", type=int, default=SNAPSHOT_CHUNK_SIZE, help="Symbolien määrä yhtä hintahakua kohden.")
+    snapshot.add_argument("--max-age", type=int, default=None, help="Välimuistissa olevan hinnan enimmäisikä sekunteina.")
+    snapshot.add_argument("--overwrite", action="store_true", help="Korvaa päivälle jo tallennetut arvot.")
+    backfill = commands.add_parser("backfill", help="Päivitä kaikkien salkkujen symbolien päivähintahistoria.")
+    backfill.add_argument("--years", type=int, default=PRICE_HISTORY_YEARS, help="Historian pituus vuosina uusille symboleille.")
+    reports = commands.add_parser("reports", help="Luo PDF-raportit kaikista salkuista.")
+    reports.add_argument("--output", help="Hakemisto, johon raportit kirjoitetaan.")
+    reports.add_argument("--zip", help="Zip-tiedosto, johon raportit kirjoitetaan ('-' = vakiotuloste).")
+    reports.add_argument("--workers", type=int, default=None, help="Rinnakkaisten renderöintiprosessien määrä.")
+    reports.add_argument("--date", help="Raportin päivämäärä muodossa YYYY-MM-DD (oletus: tänään).")
+    rebalance = commands.add_parser("rebalance", help="Laske kaikille salkuille tasapainotustoimeksiannot tavoiteosuuksien mukaan.")
+    rebalance.add_argument("output", help="Toimeksiantotiedosto; muoto päätellään päätteestä (.csv tai .parquet).")
+    rebalance.add_argument("--cash", type=float, default=0.0, help="Sijoitettava käteinen salkkua kohden euroina.")
+    rebalance.add_argument("--min-trade", type=float, default=0.0, help="Pienin toimeksianto euroina.")
+    rebalance.add_argument("--fractional", action="store_true", help="Salli osakkeiden osat kokonaislukujen sijaan.")
+    rebalance.add_argument("--no-sell", action="store_true", help="Vain ostoja; ylipainoja ei myydä.")
+    rebalance.add_argument("--summary", help="Salkkukohtainen yhteenveto tähän tiedostoon.")
+    columnar = commands.add_parser("columnar", help="Vie salkkuhistoria, omistukset ja arvostukset kuukausittain osioituina Arrow-tiedostoina.")
+    columnar.add_argument("--dir", default=COLUMNAR_DIR, help="Kohdehakemisto.")
+    columnar.add_argument("--tables", nargs="+", choices=COLUMNAR_TABLES, default=list(COLUMNAR_TABLES), help="Vietävät taulut.")
+    columnar.add_argument("--date", help="Viennin päivä muodossa YYYY-MM-DD (oletus: tänään); historiasta viedään sitä edeltävät päivät.")
+    columnar.add_argument("--chunk-size", type=int, default=SNAPSHOT_CHUNK_SIZE, help="Symbolien määrä yhtä hintahakua kohden.")
+    columnar.add_argument("--max-age", type=int, default=None, help="Välimuistissa olevan hinnan enimmäisikä sekunteina.")
+    for name, help_text in (("import", "Tuo omistukset CSV- tai Parquet-tiedostosta salkkuun."), ("export", "Vie salkun omistukset CSV- tai Parquet-tiedostoon.")):
+        transfer = commands.add_parser(name, help=help_text)
+        transfer.add_argument("--user", required=True, help="Käyttäjätunnus.")
+        transfer.add_argument("--portfolio", required=True, help="Salkun nimi.")
+        transfer.add_argument("file", help="Tiedoston polku; muoto päätellään päätteestä (.csv tai .parquet).")
+    args = parser.parse_args(argv)
+
+    if args.command == "snapshot":
+        record_date = date.fromisoformat(args.date).isoformat() if args.date else None
+        result = snapshot_all_portfolios(record_date, args.chunk_size, args.max_age, args.overwrite)
+    elif args.command == "backfill":
+        tickers = {asset.ticker for assets in load_all_portfolios().values() for asset in assets if not asset.is_manual and asset.ticker}
+        result = {"tickers": len(tickers), "rows": update_price_history(tickers, args.years)}
+    elif args.command == "reports":
+        if not args.output and not args.zip:
+            parser.error("anna --output tai --zip")
+        report_date = date.fromisoformat(args.date) if args.date else None
+        zip_target = sys.stdout.buffer if args.zip == "-" else args.zip
+        result = generate_all_reports(args.output, zip_target, args.workers, report_date)
+        if args.zip == "-":
+            print(json.dumps(result), file=sys.stderr)
+            return 0
+    elif args.command == "rebalance":
+        plan, prices = rebalance_all_portfolios(args.cash, not args.fractional, args.min_trade, not args.no_sell)
+        with open(args.output, "wb") as target:
+            target.write(export_orders(plan.orders, "parquet" if args.output.lower().endswith(".parquet") else "csv"))
+        if args.summary:
+            with open(args.summary, "wb") as target:
+                target.write(export_orders(plan.summary, "parquet" if args.summary.lower().endswith(".parquet") else "csv"))
+        result = {"portfolios": len(plan.summary), "orders": len(plan.orders), "failed_tickers": prices.failed, "file": args.output}
+    elif args.command == "columnar":
+        snapshot_date = date.fromisoformat(args.date).isoformat() if args.date else None
+        result = export_columnar(args.tables, args.dir, snapshot_date, args.chunk_size, args.max_age)
+    elif args.command in ("import", "export"):
+        with db_connection() as conn:
+            row = conn.execute("SELECT id FROM users WHERE username = ?", (args.user,)).fetchone()
+        if row is None:
+            parser.error(f"tuntematon käyttäjä: {args.user}")
+        file_format = "parquet" if args.file.lower().endswith(".parquet") else "csv"
+        if args.command == "import":
+            with open(args.file, "rb") as source:
+                result = import_assets(row[0], args.portfolio, source, file_format)
+        else:
+            with open(args.file, "wb") as target:
+                target.write(export_assets(row[0], args.portfolio, file_format))
+            result = {"file": args.file}
+    print(json.dumps(result))
+    if METRICS_ENABLED and METRICS_FILE:
+        get_metrics().write(METRICS_FILE)
+    return 0
+
+def main(argv=None):
+    init_db()
+    return run_cli(sys.argv[1:] if argv is None else argv)
@@ -0,0 +1,218 @@
+"""Month-partitioned Arrow IPC copies of portfolio_history, assets and valuation snapshots.
+
+Files live under COLUMNAR_DIR as <table>/month=YYYY-MM/part-<first date>_<last date>.arrow. They are written
+uncompressed so readers can memory-map them instead of reading SQLite. The newest last date in the file names is
+the table's watermark: an export only adds dates after it. Appending to a month rewrites the month into one new
+part before the old parts are removed; a part whose dates another part covers is ignored, so an interrupted
+export never shows up as duplicate rows.
+
+Each part is one record batch sorted by portfolio_id and date, so a read of some portfolios binary-searches the
+mapped portfolio_id column and slices out their rows without touching the rest of the file.
+
+storage.load_combined_history, behind the all-portfolios history chart, reads exported portfolio_history dates
+from here instead of SQLite. The files belong to the database they were exported from, and a value saved later
+for a date at or before the watermark is not picked up; remove the table's directory to export it again.
+"""
+
+import os
+import re
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from .config import ASSET_COLUMN_TYPES, ASSET_FIELDS, COLUMNAR_BATCH_SIZE, COLUMNAR_DIR
+from .metrics import count, timed
+from .db import db_connection
+
+COLUMNAR_TABLES = ("portfolio_history", "assets", "valuations")
+VALUATION_COLUMNS = ("portfolio_id", "ticker", "name", "currency", "shares", "cost_eur", "value_eur", "profit_eur", "weight_pct")
+_PART_PATTERN = re.compile(r"part-(\d{4}-\d{2}-\d{2})_(\d{4}-\d{2}-\d{2})\.arrow$")
+
+def _date_column(table):
+    return "record_date" if table == "portfolio_history" else "snapshot_date"
+
+def columnar_schema(table):
+    import pyarrow as pa
+    if table == "portfolio_history":
+        return pa.schema([("record_date", pa.date32()), ("portfolio_id", pa.int64()), ("total_value", pa.float64())])
+    if table == "assets":
+        types = {'TEXT': pa.string(), 'REAL': pa.float64(), 'BOOLEAN': pa.bool_()}
+        return pa.schema([("snapshot_date", pa.date32()), ("portfolio_id", pa.int64()), ("asset_id", pa.int64())]
+                         + [(field, types[ASSET_COLUMN_TYPES[field]]) for field in ASSET_FIELDS])
+    if table == "valuations":
+        return pa.schema([("snapshot_date", pa.date32()), ("portfolio_id", pa.int64()), ("ticker", pa.string()),
+                          ("name", pa.string()), ("currency", pa.string())]
+                         + [(column, pa.float64()) for column in VALUATION_COLUMNS[4:]])
+    raise ValueError(f"Tuntematon taulu: {table}")
+
+def _parts(table, root):
+    """Readable parts of `table` as sorted (first date, last date, path) tuples, without superseded ones."""
+    table_dir = os.path.join(root, table)
+    if not os.path.isdir(table_dir):
+        return []
+    parts = []
+    for month in os.listdir(table_dir):
+        month_dir = os.path.join(table_dir, month)
+        if not month.startswith("month=") or not os.path.isdir(month_dir):
+            continue
+        for name in os.listdir(month_dir):
+            match = _PART_PATTERN.match(name)
+            if match:
+                parts.append((match.group(1), match.group(2), os.path.join(month_dir, name)))
+    # Parts of one month never overlap unless an append was interrupted, so only a month's own parts are compared.
+    by_month = {}
+    for part in parts:
+        by_month.setdefault(os.path.dirname(part[2]), []).append(part)
+    return sorted(part for month_parts in by_month.values() for part in month_parts
+                  if not any(other[0] <= part[0] and part[1] <= other[1] and other != part for other in month_parts))
+
+def columnar_watermark(table, root=None):
+    """Last exported date of `table` as YYYY-MM-DD, or None when nothing has been exported."""
+    parts = _parts(table, root or COLUMNAR_DIR)
+    return max(last for _, last, _ in parts) if parts else None
+
+def _read_part(path):
+    import pyarrow as pa
+    # The table's buffers point into the mapping, which stays open as long as they are referenced.
+    return pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+
+def _append_month(table, root, data, first, last):
+    import pyarrow as pa
+    month = first[:7]
+    month_dir = os.path.join(root, table, f"month={month}")
+    os.makedirs(month_dir, exist_ok=True)
+    existing = [part for part in _parts(table, root) if part[0][:7] == month]
+    if existing:
+        data = pa.concat_tables([_read_part(path) for _, _, path in existing] + [data])
+        first = min(first, existing[0][0])
+    data = data.sort_by([("portfolio_id", "ascending"), (_date_column(table), "ascending")]).combine_chunks()
+    path = os.path.join(month_dir, f"part-{first}_{last}.arrow")
+    temporary = path + ".tmp"
+    with pa.OSFile(temporary, "wb") as sink, pa.ipc.new_file(sink, data.schema) as writer:
+        writer.write_table(data)
+    os.replace(temporary, path)
+    for name in os.listdir(month_dir):
+        if name.endswith(".arrow") and os.path.join(month_dir, name) != path:
+            os.remove(os.path.join(month_dir, name))
+    count("salkku_columnar_rows_written_total", data.num_rows, table=table)
+
+def _next_month(day):
+    year, month = int(day[:4]), int(day[5:7])
+    return f"{year + month // 12:04d}-{month % 12 + 1:02d}-01"
+
+@timed()
+def export_history_columnar(root=None, until=None):
+    """Appends portfolio_history dates after the watermark and before `until` (default today) month by month.
+
+    The current day is left out by default because snapshots of it may still be written.
+    """
+    import pyarrow as pa
+    root = root or COLUMNAR_DIR
+    until = until or date.today().isoformat()
+    after = columnar_watermark("portfolio_history", root) or "0000-00-00"
+    schema = columnar_schema("portfolio_history")
+    exported = 0
+    while True:
+        # One short read per month, so the export never keeps a read transaction open while it writes files.
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            first = cursor.execute("SELECT MIN(record_date) FROM portfolio_history WHERE record_date > ? AND record_date < ?",
+                                   (after, until)).fetchone()[0]
+            if first is None:
+                break
+            cursor.execute("""
+                SELECT record_date, portfolio_id, total_value FROM portfolio_history
+                WHERE record_date > ? AND record_date < ?
+                ORDER BY record_date, portfolio_id
+            """, (after, min(_next_month(first), until)))
+            rows = cursor.fetchall()
+        count("salkku_db_rows_read_total", len(rows), function="export_history_columnar")
+        record_dates, portfolio_ids, values = zip(*rows)
+        data = pa.table([pa.array(record_dates).cast(pa.date32()), pa.array(portfolio_ids, pa.int64()), pa.array(values, pa.float64())],
+                        schema=schema)
+        _append_month("portfolio_history", root, data, rows[0][0], rows[-1][0])
+        exported += len(rows)
+        after = rows[-1][0]
+    return exported
+
+def columnar_snapshot_exported(table, snapshot_date, root=None):
+    watermark = columnar_watermark(table, root)
+    return watermark is not None and watermark >= snapshot_date
+
+def append_snapshot_columnar(table, frame, snapshot_date, root=None):
+    """Stores `frame` as the `table` snapshot of `snapshot_date`; returns 0 when that date is already exported."""
+    import pyarrow as pa
+    root = root or COLUMNAR_DIR
+    if columnar_snapshot_exported(table, snapshot_date, root):
+        return 0
+    schema = columnar_schema(table)
+    frame = frame.assign(snapshot_date=date.fromisoformat(snapshot_date))
+    data = pa.Table.from_pandas(frame[schema.names], schema=schema, preserve_index=False)
+    _append_month(table, root, data, snapshot_date, snapshot_date)
+    return data.num_rows
+
+@timed()
+def export_assets_columnar(snapshot_date=None, root=None):
+    snapshot_date = snapshot_date or date.today().isoformat()
+    if columnar_snapshot_exported("assets", snapshot_date, root):
+        return 0
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT portfolio_id, id, {', '.join(ASSET_FIELDS)} FROM assets ORDER BY portfolio_id, id")
+        chunks = []
+        while rows := cursor.fetchmany(COLUMNAR_BATCH_SIZE):
+            chunks.append(pd.DataFrame(rows, columns=["portfolio_id", "asset_id", *ASSET_FIELDS]))
+    frame = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=["portfolio_id", "asset_id", *ASSET_FIELDS])
+    count("salkku_db_rows_read_total", len(frame), function="export_assets_columnar")
+    frame["is_manual"] = frame["is_manual"].astype("boolean")
+    return append_snapshot_columnar("assets", frame, snapshot_date, root)
+
+@timed()
+def read_columnar(table, start=None, end=None, portfolio_ids=None, columns=None, root=None):
+    """Rows of an exported table between `start` and `end` (inclusive, YYYY-MM-DD) as a DataFrame.
+
+    Only the month partitions overlapping the range are opened, each memory-mapped, and of those only the rows of
+    `portfolio_ids` when given; dates come back as datetime64.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    date_column = _date_column(table)
+    if portfolio_ids is not None:
+        wanted = np.unique(np.asarray(list(portfolio_ids), dtype=np.int64))
+    tables = []
+    clipped = False
+    for first, last, path in _parts(table, root or COLUMNAR_DIR):
+        if (start is not None and last < start) or (end is not None and first > end):
+            continue
+        clipped = clipped or (start is not None and first < start) or (end is not None and last > end)
+        part = _read_part(path)
+        if portfolio_ids is not None:
+            # A view of the mapped column; only the pages the search lands on are read.
+            ids = part["portfolio_id"].combine_chunks().to_numpy()
+            lower, upper = np.searchsorted(ids, wanted, side="left"), np.searchsorted(ids, wanted, side="right")
+            # Portfolios stored next to each other come out as one slice.
+            runs = []
+            for low, high in zip(lower.tolist(), upper.tolist()):
+                if runs and runs[-1][1] == low:
+                    runs[-1][1] = high
+                elif high > low:
+                    runs.append([low, high])
+            part = pa.concat_tables([part.slice(low, high - low) for low, high in runs]) if runs else part.slice(0, 0)
+        tables.append(part)
+    data = pa.concat_tables(tables) if tables else columnar_schema(table).empty_table()
+    conditions = []
+    # Parts lying wholly inside the range need no row filter.
+    if start is not None and clipped:
+        conditions.append(pc.greater_equal(data[date_column], pa.scalar(date.fromisoformat(start), pa.date32())))
+    if end is not None and clipped:
+        conditions.append(pc.less_equal(data[date_column], pa.scalar(date.fromisoformat(end), pa.date32())))
+    if conditions:
+        mask = conditions[0]
+        for condition in conditions[1:]:
+            mask = pc.and_(mask, condition)
+        data = data.filter(mask)
+    if columns is not None:
+        data = data.select(list(columns))
+    count("salkku_columnar_rows_read_total", data.num_rows, table=table)
+    return data.to_pandas(date_as_object=False)
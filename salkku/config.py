@@ -0,0 +1,50 @@
+"""Settings read from the environment and constants shared across the package."""
+
+import os
+
+QUOTE_CACHE_TTL = int(os.environ.get("SALKKU_QUOTE_TTL", "900"))
+FX_RATE_TTL = int(os.environ.get("SALKKU_FX_TTL", "3600"))
+BASE_CURRENCY = "EUR"
+FALLBACK_WORKERS = 8
+FALLBACK_TICKER_TIMEOUT = 5.0
+FALLBACK_DEADLINE = 15.0
+FALLBACK_RETRIES = 2
+FALLBACK_BACKOFF = 0.5
+FALLBACK_FAILURE_THRESHOLD = 3
+FALLBACK_COOLDOWN = 600
+SNAPSHOT_CHUNK_SIZE = 100
+PRICE_HISTORY_YEARS = 5
+HISTORY_RANGES = {"1 kk": 31, "3 kk": 92, "6 kk": 183, "1 v": 365, "3 v": 1096, "5 v": 1826, "Kaikki": None}
+HISTORY_AGGREGATIONS = {"Päivä": None, "Viikko": "W", "Kuukausi": "MS"}
+HISTORY_POINT_BUDGET = 500
+VALUATION_SNAPSHOT_LIMIT = 8
+LIVE_REFRESH_INTERVALS = {"15 s": 15, "30 s": 30, "1 min": 60, "5 min": 300}
+# A poller pauses after this many intervals without a heartbeat and stops after LIVE_IDLE_TIMEOUT seconds.
+LIVE_PAUSE_INTERVALS = 2
+LIVE_IDLE_TIMEOUT = 600
+COLUMNAR_DIR = os.environ.get("SALKKU_COLUMNAR_DIR", "columnar")
+COLUMNAR_BATCH_SIZE = 50000
+REPORT_CACHE_DIR = os.environ.get("SALKKU_REPORT_CACHE", ".report_cache")
+REPORT_CACHE_DAYS = 35
+DB_POOL_SIZE = int(os.environ.get("SALKKU_DB_POOL_SIZE", "4"))
+METRICS_ENABLED = os.environ.get("SALKKU_METRICS", "").lower() not in ("", "0", "false", "no")
+METRICS_FILE = os.environ.get("SALKKU_METRICS_FILE")
+METRICS_FLUSH_INTERVAL = 15
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+IMPORT_CHUNK_SIZE = 5000
+IMPORT_REQUIRED_COLUMNS = ('name', 'buy_price', 'shares')
+IMPORT_ERROR_LIMIT = 100
+TRANSACTION_KINDS = ('buy', 'sell', 'dividend')
+COST_METHODS = {"FIFO": "fifo", "Keskihinta": "average"}
+ANALYTICS_RANGES = {"1 v": 1, "3 v": 3, "5 v": 5}
+ANALYTICS_CACHE_SIZE = 64
+TRADING_DAYS = 252
+RISK_FREE_RATE = float(os.environ.get("SALKKU_RISK_FREE_RATE", "0.0"))
+SHARE_EPSILON = 1e-9
+ASSET_FIELDS = ('name', 'ticker', 'buy_price', 'shares', 'manual_price', 'is_manual', 'currency', 'buy_currency_rate', 'current_currency_rate', 'target_percentage', 'buy_date')
+ASSET_NEW_ROW = {"name": "", "ticker": "", "buy_price": 0.01, "shares": 1.0, "manual_price": None, "is_manual": False, "currency": "EUR", "buy_currency_rate": 1.0, "current_currency_rate": 1.0, "target_percentage": 0.0, "buy_date": None}
+ASSET_COLUMN_TYPES = {
+    'name': 'TEXT', 'ticker': 'TEXT', 'buy_price': 'REAL', 'shares': 'REAL', 'manual_price': 'REAL',
+    'is_manual': 'BOOLEAN', 'currency': 'TEXT', 'buy_currency_rate': 'REAL', 'current_currency_rate': 'REAL',
+    'target_percentage': 'REAL', 'buy_date': 'TEXT',
+}
@@ -0,0 +1,80 @@
+"""One valuation across all of a user's portfolios: per-portfolio and combined totals and exposure by ticker and currency."""
+
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from .ledger import load_positions
+from .metrics import timed
+from .storage import load_portfolio_ids, load_portfolios
+from .valuation import apply_fx_rates, holdings_frame, value_holdings
+
+EXPOSURE_COLUMNS = ["Alkuperäinen arvo", "Nykyinen arvo", "Tuotto (€)"]
+
+@dataclass(frozen=True)
+class ConsolidatedValuation:
+    holdings: pd.DataFrame
+    portfolios: pd.DataFrame
+    total_row: pd.DataFrame
+    by_ticker: pd.DataFrame
+    by_currency: pd.DataFrame
+
+def user_holdings(user_id, cost_method="fifo"):
+    """Every portfolio of the user keyed by name, with its transaction positions, and the portfolio ids by name."""
+    portfolio_ids = load_portfolio_ids(user_id)
+    positions = load_positions(portfolio_ids.values(), cost_method)
+    holdings = {name: assets + positions.get(portfolio_ids.get(name), []) for name, assets in load_portfolios(user_id).items()}
+    return holdings, portfolio_ids
+
+def priced_tickers(portfolios):
+    return sorted({asset['ticker'] for assets in portfolios.values() for asset in assets if not asset.get('is_manual') and asset.get('ticker')})
+
+def _profit_percent(profit, cost):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(cost != 0, profit / cost * 100, 0.0)
+
+def _exposure(valued, key, total_value):
+    grouped = valued.groupby(key, sort=False)
+    exposure = grouped[EXPOSURE_COLUMNS].sum()
+    exposure["Tuotto (%)"] = _profit_percent(exposure["Tuotto (€)"].to_numpy(), exposure["Alkuperäinen arvo"].to_numpy())
+    exposure["Osuus (%)"] = exposure["Nykyinen arvo"] / total_value * 100 if total_value else 0.0
+    return exposure, grouped
+
+@timed()
+def value_consolidated(portfolios, current_prices, fx_rates=None, buy_fx_rates=None):
+    """Values `portfolios` ({name: assets}) in one pass over the merged holdings."""
+    holdings = holdings_frame(portfolios)
+    if fx_rates or buy_fx_rates:
+        holdings = apply_fx_rates(holdings, fx_rates, buy_fx_rates)
+    valued, totals = value_holdings(holdings, current_prices)
+    valued = valued.rename(columns={"portfolio_id": "Salkku"})
+
+    per_portfolio = totals.reindex(list(portfolios), fill_value=0.0)
+    total_cost = float(per_portfolio["Alkuperäinen arvo"].sum())
+    total_value = float(per_portfolio["Nykyinen arvo"].sum())
+    total_profit = total_value - total_cost
+    per_portfolio["Osuus (%)"] = per_portfolio["Nykyinen arvo"] / total_value * 100 if total_value else 0.0
+    per_portfolio["Kohteita"] = valued.groupby("Salkku").size().reindex(per_portfolio.index, fill_value=0)
+    per_portfolio = per_portfolio.rename_axis("Salkku").reset_index()
+    total_row = pd.DataFrame({
+        "Kohde": ["Kaikki salkut"],
+        "Tuotto (€)": [total_profit],
+        "Tuotto (%)": [total_profit / total_cost * 100 if total_cost else 0.0],
+        "Alkuperäinen arvo": [total_cost],
+        "Nykyinen arvo": [total_value],
+    })
+
+    # Manual holdings without a ticker are kept apart under their own name.
+    ticker = valued["Ticker"].where(valued["Ticker"].notna() & (valued["Ticker"] != ""), valued["Alkuperäinen Nimi"])
+    by_ticker, grouped = _exposure(valued.assign(Ticker=ticker), "Ticker", total_value)
+    by_ticker.insert(0, "Nimi", grouped["Alkuperäinen Nimi"].first())
+    by_ticker.insert(1, "Osuudet", grouped["Osuudet"].sum())
+    by_ticker.insert(2, "Salkkuja", grouped["Salkku"].nunique())
+    by_ticker = by_ticker.sort_values("Nykyinen arvo", ascending=False).reset_index()
+
+    by_currency, grouped = _exposure(valued, "currency", total_value)
+    by_currency.insert(0, "Kohteita", grouped.size())
+    by_currency = by_currency.sort_values("Nykyinen arvo", ascending=False).rename_axis("Valuutta").reset_index()
+
+    return ConsolidatedValuation(valued, per_portfolio, total_row, by_ticker, by_currency)
@@ -0,0 +1,343 @@
+"""SQLite connection pool and schema migrations."""
+
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+from .config import ASSET_COLUMN_TYPES, ASSET_FIELDS, DB_POOL_SIZE
+
+DB_FILE = os.environ.get("SALKKU_DB", "seuranta.db")
+
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA foreign_keys=ON",
+)
+
+class ConnectionPool:
+    def __init__(self, path, size=DB_POOL_SIZE):
+        self.path = path
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self):
+        # Connections are handed between Streamlit script threads, but only one thread uses a connection at a time.
+        conn = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False)
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+            if conn.in_transaction:
+                conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_connection_pool(path):
+    with _pools_lock:
+        pool = _pools.get(path)
+        if pool is None:
+            pool = ConnectionPool(path)
+            # Creating the pool is a once-per-process event, so pending migrations run here rather than on every rerun.
+            with pool.connection() as conn:
+                migrate_db(conn)
+            _pools[path] = pool
+        return pool
+
+def db_connection():
+    return get_connection_pool(DB_FILE).connection()
+
+def _migrate_base_schema(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            username TEXT NOT NULL UNIQUE,
+            password_hash TEXT NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS portfolios (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            user_id INTEGER,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS assets (
+            id INTEGER PRIMARY KEY,
+            name TEXT,
+            ticker TEXT,
+            buy_price REAL,
+            shares REAL,
+            manual_price REAL,
+            is_manual BOOLEAN,
+            currency TEXT,
+            buy_currency_rate REAL,
+            current_currency_rate REAL,
+            target_percentage REAL,
+            portfolio_id INTEGER,
+            FOREIGN KEY (portfolio_id) REFERENCES portfolios (id)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS portfolio_history (
+            id INTEGER PRIMARY KEY,
+            portfolio_id INTEGER,
+            record_date TEXT NOT NULL,
+            total_value REAL NOT NULL,
+            FOREIGN KEY (portfolio_id) REFERENCES portfolios (id),
+            UNIQUE(portfolio_id, record_date)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS price_history (
+            ticker TEXT NOT NULL,
+            price_date TEXT NOT NULL,
+            open REAL,
+            high REAL,
+            low REAL,
+            close REAL NOT NULL,
+            PRIMARY KEY (ticker, price_date)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS price_history_sync (
+            ticker TEXT PRIMARY KEY,
+            synced_on TEXT NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS quote_cache (
+            ticker TEXT PRIMARY KEY,
+            price REAL NOT NULL,
+            fetched_at REAL NOT NULL
+        )
+    """)
+
+def _migrate_asset_buy_date(cursor):
+    cursor.execute("PRAGMA table_info(assets)")
+    if 'buy_date' not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute("ALTER TABLE assets ADD COLUMN buy_date TEXT")
+
+def _migrate_cascade_foreign_keys(cursor):
+    # SQLite cannot alter a foreign key in place, so each table is rebuilt and swapped in. Rows that already
+    # point at a missing parent are dropped, as the cascade would have removed them.
+    cursor.execute("""
+        CREATE TABLE portfolios_new (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            user_id INTEGER,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    """)
+    cursor.execute("""
+        INSERT INTO portfolios_new (id, name, user_id)
+        SELECT id, name, user_id FROM portfolios
+        WHERE user_id IS NULL OR user_id IN (SELECT id FROM users)
+    """)
+    cursor.execute(f"""
+        CREATE TABLE assets_new (
+            id INTEGER PRIMARY KEY,
+            {', '.join(field + ' ' + ASSET_COLUMN_TYPES[field] for field in ASSET_FIELDS)},
+            portfolio_id INTEGER,
+            FOREIGN KEY (portfolio_id) REFERENCES portfolios (id) ON DELETE CASCADE
+        )
+    """)
+    cursor.execute(f"""
+        INSERT INTO assets_new (id, {', '.join(ASSET_FIELDS)}, portfolio_id)
+        SELECT id, {', '.join(ASSET_FIELDS)}, portfolio_id FROM assets
+        WHERE portfolio_id IN (SELECT id FROM portfolios_new)
+    """)
+    cursor.execute("""
+        CREATE TABLE portfolio_history_new (
+            id INTEGER PRIMARY KEY,
+            portfolio_id INTEGER,
+            record_date TEXT NOT NULL,
+            total_value REAL NOT NULL,
+            FOREIGN KEY (portfolio_id) REFERENCES portfolios (id) ON DELETE CASCADE,
+            UNIQUE(portfolio_id, record_date)
+        )
+    """)
+    cursor.execute("""
+        INSERT INTO portfolio_history_new (id, portfolio_id, record_date, total_value)
+        SELECT id, portfolio_id, record_date, total_value FROM portfolio_history
+        WHERE portfolio_id IN (SELECT id FROM portfolios_new)
+    """)
+    for table in ("assets", "portfolio_history", "portfolios"):
+        cursor.execute(f"DROP TABLE {table}")
+    for table in ("portfolios", "assets", "portfolio_history"):
+        cursor.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+
+def _migrate_access_path_indexes(cursor):
+    # load_portfolios joins and orders on (portfolio_id, id); the cascade from portfolios deletes by portfolio_id.
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_assets_portfolio ON assets (portfolio_id, id)")
+    # Name->id lookups and the per-user portfolio listing are answered from the index alone.
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_portfolios_user_name ON portfolios (user_id, name, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_portfolio_history_range ON portfolio_history (portfolio_id, record_date, total_value)")
+
+def _migrate_transaction_ledger(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY,
+            portfolio_id INTEGER NOT NULL,
+            ticker TEXT NOT NULL,
+            name TEXT,
+            kind TEXT NOT NULL CHECK (kind IN ('buy', 'sell', 'dividend')),
+            trade_date TEXT NOT NULL,
+            shares REAL NOT NULL,
+            price REAL NOT NULL,
+            fees REAL NOT NULL DEFAULT 0,
+            currency TEXT NOT NULL,
+            fx_rate REAL NOT NULL,
+            FOREIGN KEY (portfolio_id) REFERENCES portfolios (id) ON DELETE CASCADE
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_position ON transactions (portfolio_id, ticker, trade_date, id)")
+    # unit_cost is in the trade currency and includes the purchase fees.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS lots (
+            id INTEGER PRIMARY KEY,
+            transaction_id INTEGER NOT NULL,
+            portfolio_id INTEGER NOT NULL,
+            ticker TEXT NOT NULL,
+            acquired_on TEXT NOT NULL,
+            shares_open REAL NOT NULL,
+            unit_cost REAL NOT NULL,
+            fx_rate REAL NOT NULL,
+            FOREIGN KEY (transaction_id) REFERENCES transactions (id) ON DELETE CASCADE,
+            FOREIGN KEY (portfolio_id) REFERENCES portfolios (id) ON DELETE CASCADE
+        )
+    """)
+    # Sells walk only the open lots; fully consumed lots drop out of the partial index.
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_lots_open ON lots (portfolio_id, ticker, acquired_on, id) WHERE shares_open > 0")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_lots_transaction ON lots (transaction_id)")
+    # Running aggregates per (portfolio, ticker). Costs are kept in the trade currency and in euros under both
+    # methods; realized results and dividends are in euros.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS positions (
+            portfolio_id INTEGER NOT NULL,
+            ticker TEXT NOT NULL,
+            name TEXT,
+            currency TEXT NOT NULL,
+            shares REAL NOT NULL DEFAULT 0,
+            fifo_cost REAL NOT NULL DEFAULT 0,
+            fifo_cost_eur REAL NOT NULL DEFAULT 0,
+            average_cost REAL NOT NULL DEFAULT 0,
+            average_cost_eur REAL NOT NULL DEFAULT 0,
+            realized_fifo REAL NOT NULL DEFAULT 0,
+            realized_average REAL NOT NULL DEFAULT 0,
+            dividends REAL NOT NULL DEFAULT 0,
+            fx_rate REAL NOT NULL DEFAULT 1,
+            last_trade_date TEXT NOT NULL,
+            PRIMARY KEY (portfolio_id, ticker),
+            FOREIGN KEY (portfolio_id) REFERENCES portfolios (id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    """)
+
+def _migrate_history_date_index(cursor):
+    # Columnar exports read all portfolios one month at a time; this keeps that a range scan answered from the index.
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_portfolio_history_date ON portfolio_history (record_date, portfolio_id, total_value)")
+
+def _migrate_unique_portfolio_names(cursor):
+    # Earlier save paths could leave a user with several portfolios of one name, which name lookups cannot tell apart.
+    # The newest keeps the name, as the name-keyed loader always showed it; older ones get their id appended, so no
+    # assets or history are merged or lost.
+    duplicates = cursor.execute("""
+        SELECT id, user_id, name FROM portfolios p
+        WHERE EXISTS (SELECT 1 FROM portfolios q WHERE q.user_id = p.user_id AND q.name = p.name AND q.id > p.id)
+        ORDER BY id
+    """).fetchall()
+    for portfolio_id, user_id, name in duplicates:
+        candidate, attempt = f"{name} ({portfolio_id})".strip(), 1
+        while cursor.execute("SELECT 1 FROM portfolios WHERE user_id = ? AND name = ?", (user_id, candidate)).fetchone():
+            attempt += 1
+            candidate = f"{name} ({portfolio_id}-{attempt})".strip()
+        cursor.execute("UPDATE portfolios SET name = ? WHERE id = ?", (candidate, portfolio_id))
+    # The rowid is part of every index entry, so name->id lookups stay answered from the index alone.
+    cursor.execute("DROP INDEX IF EXISTS idx_portfolios_user_name")
+    cursor.execute("CREATE UNIQUE INDEX idx_portfolios_user_name ON portfolios (user_id, name)")
+
+# Ordered (version, description, step). Versions are never renumbered; new schema changes are appended.
+MIGRATIONS = (
+    (1, "base schema", _migrate_base_schema),
+    (2, "assets.buy_date", _migrate_asset_buy_date),
+    (3, "ON DELETE CASCADE foreign keys", _migrate_cascade_foreign_keys),
+    (4, "access path indexes", _migrate_access_path_indexes),
+    (5, "transaction ledger", _migrate_transaction_ledger),
+    (6, "portfolio_history date index", _migrate_history_date_index),
+    (7, "unique portfolio names per user", _migrate_unique_portfolio_names),
+)
+
+def migrate_db(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+    """)
+    current = conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+    pending = [migration for migration in MIGRATIONS if migration[0] > current]
+    if not pending:
+        return []
+    # Table rebuilds need foreign key enforcement off, and the pragma only takes effect outside a transaction.
+    conn.execute("PRAGMA foreign_keys=OFF")
+    try:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        # Another process may have migrated while this one waited for the write lock.
+        current = cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+        applied = []
+        for version, description, step in MIGRATIONS:
+            if version <= current:
+                continue
+            step(cursor)
+            cursor.execute(
+                "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                (version, description, datetime.now().isoformat(timespec="seconds"))
+            )
+            applied.append(version)
+        violations = cursor.execute("PRAGMA foreign_key_check").fetchall()
+        if violations:
+            raise sqlite3.IntegrityError(f"Migraatio jätti viiteavainrikkeitä: {violations[:5]}")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute("PRAGMA foreign_keys=ON")
+    return applied
+
+def init_db():
+    # The schema is brought up to date when the connection pool is first created, once per process.
+    get_connection_pool(DB_FILE)
@@ -0,0 +1,81 @@
+"""Reconstructed value history and chart downsampling."""
+
+import numpy as np
+import pandas as pd
+
+from .config import BASE_CURRENCY, HISTORY_POINT_BUDGET
+from .pricing import fx_symbol, load_price_matrix
+from .valuation import apply_fx_rates, holdings_frame
+
+def reconstruct_portfolio_history(assets, start=None, end=None, fx_rates=None):
+    """Value of today's holdings at past closes, each day converted at that day's EUR rate from price_history.
+
+    Days before a currency's stored rate history, and manual holdings, use `fx_rates` like the current valuation
+    does; the typed-in current_currency_rate remains the fallback when a rate is missing there too.
+    """
+    holdings = holdings_frame({0: assets})
+    if fx_rates:
+        holdings = apply_fx_rates(holdings, fx_rates)
+    is_manual = holdings["is_manual"].fillna(0).astype(bool)
+    market = holdings[~is_manual & holdings["ticker"].notna() & (holdings["ticker"] != "")]
+    manual = holdings[is_manual & holdings["manual_price"].notna()]
+
+    by_ticker = market.groupby("ticker")
+    shares = by_ticker["shares"].sum()
+    matrix = load_price_matrix(shares.index, start, end).ffill().dropna()
+    if matrix.empty:
+        return pd.DataFrame(columns=['Päivämäärä', 'Arvo'])
+    currencies = by_ticker["currency"].first().reindex(matrix.columns)
+    fallback = by_ticker["current_currency_rate"].first().reindex(matrix.columns).to_numpy(dtype=float)
+    rates = np.tile(fallback, (len(matrix), 1))
+    foreign = sorted(set(currencies.dropna()) - {BASE_CURRENCY})
+    if foreign:
+        # Rates from a few days before the window so weekends and holidays at its start carry a close forward.
+        fx_start = (matrix.index[0] - pd.Timedelta(days=10)).strftime("%Y-%m-%d")
+        fx_history = load_price_matrix([fx_symbol(currency) for currency in foreign], fx_start, end)
+        if not fx_history.empty:
+            fx_history = fx_history.reindex(fx_history.index.union(matrix.index)).ffill().reindex(matrix.index)
+            for column, currency in enumerate(currencies.tolist()):
+                if currency in foreign:
+                    daily = fx_history[fx_symbol(currency)].to_numpy(dtype=float)
+                    rates[:, column] = np.where(np.isfinite(daily) & (daily > 0), daily, rates[:, column])
+    manual_value = float((manual["manual_price"] * manual["shares"] / manual["current_currency_rate"]).sum())
+    values = (matrix.to_numpy() / rates) @ shares.reindex(matrix.columns).to_numpy() + manual_value
+    return pd.DataFrame({'Päivämäärä': matrix.index.strftime("%Y-%m-%d"), 'Arvo': values})
+
+def lttb_indices(x, y, threshold):
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else n
+        next_x = x[end:next_end].mean() if next_end > end else x[-1]
+        next_y = y[end:next_end].mean() if next_end > end else y[-1]
+        # Keep the point that spans the largest triangle with the previous pick and the next bucket's average.
+        areas = np.abs((x[selected] - next_x) * (y[start:end] - y[selected]) - (x[selected] - x[start:end]) * (next_y - y[selected]))
+        selected = start + int(np.argmax(areas))
+        indices[bucket + 1] = selected
+    return indices
+
+def downsample_history(history_df, rule=None, budget=HISTORY_POINT_BUDGET):
+    series = pd.Series(history_df['Arvo'].to_numpy(dtype=float), index=pd.to_datetime(history_df['Päivämäärä']))
+    if rule:
+        ohlc = series.resample(rule).agg(['first', 'max', 'min', 'last']).dropna()
+        frame = pd.DataFrame({
+            'Päivämäärä': ohlc.index,
+            'Arvo': ohlc['last'].to_numpy(),
+            'Avaus': ohlc['first'].to_numpy(),
+            'Korkein': ohlc['max'].to_numpy(),
+            'Matalin': ohlc['min'].to_numpy(),
+        })
+    else:
+        frame = pd.DataFrame({'Päivämäärä': series.index, 'Arvo': series.to_numpy()})
+    if len(frame) > budget:
+        x = frame['Päivämäärä'].to_numpy(dtype="datetime64[s]").astype(np.float64)
+        frame = frame.iloc[lttb_indices(x, frame['Arvo'].to_numpy(), budget)].reset_index(drop=True)
+    return frame
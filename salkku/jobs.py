@@ -0,0 +1,228 @@
+"""Headless jobs over all portfolios: value snapshots, batch reports, rebalancing and columnar exports."""
+
+import os
+import re
+import zipfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+import pandas as pd
+
+from .config import ANALYTICS_RANGES, ASSET_FIELDS, BASE_CURRENCY, COLUMNAR_DIR, SNAPSHOT_CHUNK_SIZE
+from .metrics import count, timed
+from .db import db_connection
+from .storage import Asset, load_portfolio_owners
+from .ledger import load_positions
+from .pricing import PriceQuotes, get_fx_rates, get_portfolio_fx, get_stock_data
+from .valuation import apply_fx_rates, calculate_portfolio_metrics_batch, holdings_frame, value_holdings
+from .analytics import portfolio_analytics
+from .rebalancing import RebalancePlan, rebalance_batch
+from .columnar import (COLUMNAR_TABLES, append_snapshot_columnar, columnar_snapshot_exported, columnar_watermark,
+                       export_assets_columnar, export_history_columnar)
+from .reporting import create_pdf_report, load_cached_report, prune_report_cache, report_cache_key, store_cached_report
+
+def load_all_portfolios(cost_method="fifo"):
+    portfolios = {}
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT p.id, a.id, {', '.join('a.' + field for field in ASSET_FIELDS)}
+            FROM portfolios p LEFT JOIN assets a ON a.portfolio_id = p.id
+            ORDER BY p.id, a.id
+        """)
+        for row in cursor.fetchall():
+            assets = portfolios.setdefault(row[0], [])
+            if row[1] is not None:
+                assets.append(Asset(*row[1:]))
+    for portfolio_id, positions in load_positions(cost_method=cost_method).items():
+        portfolios.setdefault(portfolio_id, []).extend(positions)
+    return portfolios
+
+def get_stock_data_chunked(tickers, chunk_size=SNAPSHOT_CHUNK_SIZE, max_age=None):
+    prices = PriceQuotes()
+    for start in range(0, len(tickers), chunk_size):
+        chunk = get_stock_data(tickers[start:start + chunk_size], max_age=max_age)
+        prices.update(chunk)
+        prices.failed.extend(chunk.failed)
+        prices.stale.extend(chunk.stale)
+        prices.as_of = min(prices.as_of, chunk.as_of)
+    return prices
+
+@timed()
+def snapshot_all_portfolios(record_date=None, chunk_size=SNAPSHOT_CHUNK_SIZE, max_age=None, overwrite=False):
+    record_date = record_date or date.today().isoformat()
+    portfolios = load_all_portfolios()
+    tickers = sorted({asset.ticker for assets in portfolios.values() for asset in assets if not asset.is_manual and asset.ticker})
+    prices = get_stock_data_chunked(tickers, chunk_size, max_age)
+    fx_rates = get_fx_rates({asset.currency for assets in portfolios.values() for asset in assets})
+
+    _, totals = value_holdings(apply_fx_rates(holdings_frame(portfolios), fx_rates), prices)
+    # A total missing some of its prices would be too low and, once written, blocks a correct rerun that day.
+    unpriced = set(prices.failed) | set(prices.stale)
+    incomplete = sorted(portfolio_id for portfolio_id, assets in portfolios.items()
+                        if any(not asset.is_manual and asset.ticker in unpriced for asset in assets))
+    values = totals["Nykyinen arvo"].dropna().drop(incomplete, errors="ignore")
+    rows = [(int(portfolio_id), record_date, float(value)) for portfolio_id, value in values.items()]
+    conflict = "DO UPDATE SET total_value = excluded.total_value" if overwrite else "DO NOTHING"
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany(f"""
+            INSERT INTO portfolio_history (portfolio_id, record_date, total_value)
+            VALUES (?, ?, ?)
+            ON CONFLICT(portfolio_id, record_date) {conflict}
+        """, rows)
+        written = cursor.rowcount
+        conn.commit()
+    count("salkku_db_rows_written_total", written, function="snapshot_all_portfolios")
+    return {
+        "record_date": record_date,
+        "portfolios": len(portfolios),
+        "tickers": len(tickers),
+        "priced_tickers": len(prices),
+        "failed_tickers": prices.failed,
+        "stale_tickers": prices.stale,
+        "valued": len(rows),
+        "incomplete_portfolios": incomplete,
+        "written": written,
+    }
+
+@timed()
+def rebalance_all_portfolios(cash=0.0, whole_shares=True, min_trade=0.0, allow_sell=True, chunk_size=SNAPSHOT_CHUNK_SIZE, max_age=None):
+    portfolios = load_all_portfolios()
+    tickers = sorted({asset.ticker for assets in portfolios.values() for asset in assets if not asset.is_manual and asset.ticker})
+    prices = get_stock_data_chunked(tickers, chunk_size, max_age)
+    fx_rates = get_fx_rates({asset.currency for assets in portfolios.values() for asset in assets})
+    plan = rebalance_batch(portfolios, prices, fx_rates, cash, whole_shares, min_trade, allow_sell)
+    owners = load_portfolio_owners()
+    labelled = []
+    for frame in (plan.orders, plan.summary):
+        frame = frame.copy()
+        frame.insert(1, "Käyttäjä", frame["portfolio_id"].map(lambda portfolio_id: owners.get(portfolio_id, (None, None))[0]))
+        frame.insert(2, "Salkku", frame["portfolio_id"].map(lambda portfolio_id: owners.get(portfolio_id, (None, None))[1]))
+        labelled.append(frame)
+    return RebalancePlan(*labelled), prices
+
+@timed()
+def export_columnar(tables=COLUMNAR_TABLES, root=None, snapshot_date=None, chunk_size=SNAPSHOT_CHUNK_SIZE, max_age=None):
+    """Brings the Arrow copies of `tables` up to `snapshot_date` (default today).
+
+    portfolio_history gets every saved date before snapshot_date; assets and valuations get one snapshot of
+    snapshot_date, valued at current prices.
+    """
+    root = root or COLUMNAR_DIR
+    snapshot_date = snapshot_date or date.today().isoformat()
+    result = {"dir": root, "snapshot_date": snapshot_date}
+    if "portfolio_history" in tables:
+        result["portfolio_history"] = export_history_columnar(root, until=snapshot_date)
+    if "assets" in tables:
+        result["assets"] = export_assets_columnar(snapshot_date, root)
+    if "valuations" in tables:
+        result["valuations"] = 0
+        if not columnar_snapshot_exported("valuations", snapshot_date, root):
+            portfolios = load_all_portfolios()
+            tickers = sorted({asset.ticker for assets in portfolios.values() for asset in assets if not asset.is_manual and asset.ticker})
+            prices = get_stock_data_chunked(tickers, chunk_size, max_age)
+            fx_rates = get_fx_rates({asset.currency for assets in portfolios.values() for asset in assets})
+            valued, _ = value_holdings(apply_fx_rates(holdings_frame(portfolios), fx_rates), prices)
+            frame = pd.DataFrame({
+                "portfolio_id": valued["portfolio_id"],
+                "ticker": valued["Ticker"],
+                "name": valued["Alkuperäinen Nimi"],
+                "currency": valued["currency"],
+                "shares": valued["Osuudet"],
+                "cost_eur": valued["Alkuperäinen arvo"],
+                "value_eur": valued["Nykyinen arvo"],
+                "profit_eur": valued["Tuotto (€)"],
+                "weight_pct": valued["Osuus salkusta (%)"],
+            })
+            result["valuations"] = append_snapshot_columnar("valuations", frame, snapshot_date, root)
+            result["failed_tickers"] = prices.failed
+    result["watermarks"] = {table: columnar_watermark(table, root) for table in tables}
+    return result
+
+def _safe_filename(name):
+    return re.sub(r"[^\w.-]+", "_", name).strip("_") or "salkku"
+
+def _render_report_job(job):
+    key, df, total_row, portfolio_name, report_date, analytics = job
+    return key, create_pdf_report(df, total_row, portfolio_name, report_date, analytics).getvalue()
+
+def _report_paths(owners, portfolio_ids, report_date):
+    """Relative output path per portfolio; names that sanitize to the same path get the portfolio id appended."""
+    paths = {portfolio_id: (_safe_filename(owners[portfolio_id][0]), _safe_filename(owners[portfolio_id][1])) for portfolio_id in portfolio_ids}
+    # Compared case-insensitively, since the output may land on a case-insensitive file system.
+    clashes = Counter(os.path.join(user_dir, name).lower() for user_dir, name in paths.values())
+    return {
+        portfolio_id: os.path.join(user_dir, f"{name}_{portfolio_id}_{report_date.isoformat()}.pdf"
+                                   if clashes[os.path.join(user_dir, name).lower()] > 1 else f"{name}_{report_date.isoformat()}.pdf")
+        for portfolio_id, (user_dir, name) in paths.items()
+    }
+
+def generate_all_reports(output_dir=None, zip_target=None, workers=None, report_date=None, chunk_size=SNAPSHOT_CHUNK_SIZE):
+    """PDF reports of every non-empty portfolio that has an owner.
+
+    Reports carry the same default-period analytics section as the UI's, computed from the stored price history
+    (refresh it with the backfill command), so a report built here is the one the UI download finds in the cache.
+    """
+    report_date = report_date or date.today()
+    owners = load_portfolio_owners()
+    portfolios, skipped = {}, []
+    for portfolio_id, assets in load_all_portfolios().items():
+        if not assets:
+            continue
+        # Portfolios left without a user by the foreign key migration have nowhere to be filed.
+        if portfolio_id in owners:
+            portfolios[portfolio_id] = assets
+        else:
+            skipped.append(portfolio_id)
+    tickers = sorted({asset.ticker for assets in portfolios.values() for asset in assets if not asset.is_manual and asset.ticker})
+    prices = get_stock_data_chunked(tickers, chunk_size)
+    all_assets = [asset for assets in portfolios.values() for asset in assets]
+    fx_rates, buy_fx_rates = get_portfolio_fx(all_assets)
+    metrics = calculate_portfolio_metrics_batch(portfolios, prices, fx_rates, buy_fx_rates)
+    analytics_years = next(iter(ANALYTICS_RANGES.values()))
+    prune_report_cache()
+
+    reports, jobs = {}, []
+    for portfolio_id, (df, total_row) in metrics.items():
+        username, portfolio_name = owners[portfolio_id]
+        assets = portfolios[portfolio_id]
+        # Editor rows have an id; ledger positions are loaded again by portfolio_analytics from the transactions.
+        editor_assets = [asset for asset in assets if asset.id is not None]
+        currencies = {asset.currency for asset in assets} | {BASE_CURRENCY}
+        analytics = portfolio_analytics(portfolio_id, editor_assets, analytics_years,
+                                        fx_rates={currency: rate for currency, rate in fx_rates.items() if currency in currencies})
+        key = report_cache_key(df, total_row, portfolio_name, report_date, analytics)
+        reports[portfolio_id] = key
+        if load_cached_report(key) is None:
+            jobs.append((key, df, total_row, portfolio_name, report_date, analytics))
+
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for key, pdf_bytes in executor.map(_render_report_job, jobs, chunksize=max(1, len(jobs) // 32)):
+                store_cached_report(key, pdf_bytes)
+
+    archive = zipfile.ZipFile(zip_target, "w", zipfile.ZIP_DEFLATED) if zip_target is not None else None
+    try:
+        for portfolio_id, relative_path in _report_paths(owners, reports, report_date).items():
+            key = reports[portfolio_id]
+            pdf_bytes = load_cached_report(key)
+            if archive is not None:
+                archive.writestr(relative_path, pdf_bytes)
+            if output_dir is not None:
+                path = os.path.join(output_dir, relative_path)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "wb") as report_file:
+                    report_file.write(pdf_bytes)
+    finally:
+        if archive is not None:
+            archive.close()
+    return {
+        "report_date": report_date.isoformat(),
+        "reports": len(reports),
+        "rendered": len(jobs),
+        "cached": len(reports) - len(jobs),
+        "failed_tickers": prices.failed,
+        "skipped_portfolios": skipped,
+    }
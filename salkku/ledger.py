@@ -0,0 +1,192 @@
+"""Transaction ledger and the incrementally maintained FIFO / average-cost positions."""
+
+from datetime import date
+
+import pandas as pd
+
+from .config import BASE_CURRENCY, SHARE_EPSILON, TRANSACTION_KINDS
+from .metrics import timed
+from .db import db_connection
+from .storage import Asset
+from .pricing import get_historical_fx_rates
+
+TRANSACTION_COLUMNS = ('portfolio_id', 'ticker', 'name', 'kind', 'trade_date', 'shares', 'price', 'fees', 'currency', 'fx_rate')
+
+def _apply_transaction(cursor, transaction_id, portfolio_id, ticker, name, kind, trade_date, shares, price, fees, currency, fx_rate):
+    """Folds one transaction into its position; touches only that position row and, for sells, its open lots."""
+    cursor.execute("""
+        SELECT currency, shares, fifo_cost, fifo_cost_eur, average_cost, average_cost_eur
+        FROM positions WHERE portfolio_id = ? AND ticker = ?
+    """, (portfolio_id, ticker))
+    position = cursor.fetchone() or (currency, 0.0, 0.0, 0.0, 0.0, 0.0)
+    if position[0] != currency:
+        raise ValueError(f"{ticker} on kirjattu valuutassa {position[0]}, ei {currency}.")
+    held, fifo_cost, fifo_cost_eur, average_cost, average_cost_eur = position[1:]
+    realized_fifo = realized_average = dividends = 0.0
+
+    if kind == "buy":
+        cost = shares * price + fees
+        cursor.execute("""
+            INSERT INTO lots (transaction_id, portfolio_id, ticker, acquired_on, shares_open, unit_cost, fx_rate)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (transaction_id, portfolio_id, ticker, trade_date, shares, cost / shares, fx_rate))
+        held += shares
+        fifo_cost += cost
+        fifo_cost_eur += cost / fx_rate
+        average_cost += cost
+        average_cost_eur += cost / fx_rate
+    elif kind == "sell":
+        if shares > held + SHARE_EPSILON:
+            raise ValueError(f"Myytävä määrä {shares:g} ylittää omistuksen {held:g} ({ticker}).")
+        proceeds_eur = (shares * price - fees) / fx_rate
+        sold_fraction = shares / held
+        realized_average = proceeds_eur - average_cost_eur * sold_fraction
+        average_cost -= average_cost * sold_fraction
+        average_cost_eur -= average_cost_eur * sold_fraction
+
+        cursor.execute("""
+            SELECT id, shares_open, unit_cost, fx_rate FROM lots
+            WHERE portfolio_id = ? AND ticker = ? AND shares_open > 0
+            ORDER BY acquired_on, id
+        """, (portfolio_id, ticker))
+        remaining, consumed, consumed_eur, lot_updates = shares, 0.0, 0.0, []
+        for lot_id, shares_open, unit_cost, lot_fx_rate in cursor.fetchall():
+            taken = min(shares_open, remaining)
+            consumed += taken * unit_cost
+            consumed_eur += taken * unit_cost / lot_fx_rate
+            remaining -= taken
+            lot_updates.append((shares_open - taken if shares_open - taken > SHARE_EPSILON else 0.0, lot_id))
+            if remaining <= SHARE_EPSILON:
+                break
+        cursor.executemany("UPDATE lots SET shares_open = ? WHERE id = ?", lot_updates)
+        realized_fifo = proceeds_eur - consumed_eur
+        fifo_cost -= consumed
+        fifo_cost_eur -= consumed_eur
+        held -= shares
+        if held <= SHARE_EPSILON:
+            # Clear rounding residue so a closed position carries no phantom cost.
+            held = fifo_cost = fifo_cost_eur = average_cost = average_cost_eur = 0.0
+    else:
+        dividends = (shares * price - fees) / fx_rate
+
+    cursor.execute("""
+        INSERT INTO positions (portfolio_id, ticker, name, currency, shares, fifo_cost, fifo_cost_eur, average_cost, average_cost_eur,
+                               realized_fifo, realized_average, dividends, fx_rate, last_trade_date)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(portfolio_id, ticker) DO UPDATE SET
+            name = COALESCE(excluded.name, name),
+            shares = excluded.shares,
+            fifo_cost = excluded.fifo_cost,
+            fifo_cost_eur = excluded.fifo_cost_eur,
+            average_cost = excluded.average_cost,
+            average_cost_eur = excluded.average_cost_eur,
+            realized_fifo = realized_fifo + excluded.realized_fifo,
+            realized_average = realized_average + excluded.realized_average,
+            dividends = dividends + excluded.dividends,
+            fx_rate = excluded.fx_rate,
+            last_trade_date = MAX(last_trade_date, excluded.last_trade_date)
+    """, (portfolio_id, ticker, name, currency, held, fifo_cost, fifo_cost_eur, average_cost, average_cost_eur,
+          realized_fifo, realized_average, dividends, fx_rate, trade_date))
+
+def _rebuild_position(cursor, portfolio_id, ticker):
+    # Only needed when the ledger changes out of date order; replays a single position, not the whole ledger.
+    cursor.execute("DELETE FROM lots WHERE portfolio_id = ? AND ticker = ?", (portfolio_id, ticker))
+    cursor.execute("DELETE FROM positions WHERE portfolio_id = ? AND ticker = ?", (portfolio_id, ticker))
+    cursor.execute(f"""
+        SELECT id, {', '.join(TRANSACTION_COLUMNS)} FROM transactions
+        WHERE portfolio_id = ? AND ticker = ?
+        ORDER BY trade_date, id
+    """, (portfolio_id, ticker))
+    for transaction in cursor.fetchall():
+        _apply_transaction(cursor, *transaction)
+
+@timed()
+def record_transaction(portfolio_id, ticker, kind, shares, price, trade_date=None, fees=0.0, currency=BASE_CURRENCY, fx_rate=None, name=None):
+    ticker = (ticker or "").strip().upper()
+    trade_date = trade_date or date.today().isoformat()
+    if not ticker:
+        raise ValueError("Symboli puuttuu.")
+    if kind not in TRANSACTION_KINDS:
+        raise ValueError(f"Tuntematon tapahtumatyyppi: {kind}")
+    if not shares > 0 or price < 0 or fees < 0:
+        raise ValueError("Määrän on oltava positiivinen eikä hinta tai kulut voi olla negatiivisia.")
+    if currency == BASE_CURRENCY:
+        fx_rate = 1.0
+    elif not fx_rate:
+        fx_rate = get_historical_fx_rates([(currency, trade_date)]).get((currency, trade_date))
+        if not fx_rate:
+            raise ValueError(f"Valuuttakurssia {currency} päivälle {trade_date} ei löytynyt; syötä kurssi.")
+    values = (portfolio_id, ticker, name or None, kind, trade_date, float(shares), float(price), float(fees), currency, float(fx_rate))
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute(f"INSERT INTO transactions ({', '.join(TRANSACTION_COLUMNS)}) VALUES ({', '.join('?' for _ in TRANSACTION_COLUMNS)})", values)
+        transaction_id = cursor.lastrowid
+        cursor.execute("SELECT last_trade_date FROM positions WHERE portfolio_id = ? AND ticker = ?", (portfolio_id, ticker))
+        row = cursor.fetchone()
+        if row is not None and trade_date < row[0]:
+            _rebuild_position(cursor, portfolio_id, ticker)
+        else:
+            _apply_transaction(cursor, transaction_id, *values)
+        conn.commit()
+    return transaction_id
+
+def delete_transaction(transaction_id, user_id):
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("""
+            SELECT t.portfolio_id, t.ticker FROM transactions t JOIN portfolios p ON p.id = t.portfolio_id
+            WHERE t.id = ? AND p.user_id = ?
+        """, (transaction_id, user_id))
+        row = cursor.fetchone()
+        if row is None:
+            conn.rollback()
+            return False
+        cursor.execute("DELETE FROM transactions WHERE id = ?", (transaction_id,))
+        _rebuild_position(cursor, *row)
+        conn.commit()
+        return True
+
+def load_transactions(portfolio_id, limit=100):
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT id, {', '.join(TRANSACTION_COLUMNS[1:])} FROM transactions
+            WHERE portfolio_id = ?
+            ORDER BY trade_date DESC, id DESC
+            LIMIT ?
+        """, (portfolio_id, limit))
+        return pd.DataFrame(cursor.fetchall(), columns=('id',) + TRANSACTION_COLUMNS[1:])
+
+@timed()
+def load_positions(portfolio_ids=None, cost_method="fifo"):
+    """Open positions as Asset rows keyed by portfolio id, priced at the chosen method's cost basis."""
+    cost, cost_eur = ("fifo_cost", "fifo_cost_eur") if cost_method == "fifo" else ("average_cost", "average_cost_eur")
+    query = f"""
+        SELECT portfolio_id, COALESCE(name, ticker), ticker, {cost} / shares, shares, currency, COALESCE({cost} / NULLIF({cost_eur}, 0), fx_rate), fx_rate
+        FROM positions WHERE shares > 0
+    """
+    params = ()
+    if portfolio_ids is not None:
+        portfolio_ids = list(portfolio_ids)
+        query += f" AND portfolio_id IN ({', '.join('?' for _ in portfolio_ids)})"
+        params = tuple(portfolio_ids)
+    positions = {}
+    with db_connection() as conn:
+        for portfolio_id, name, ticker, buy_price, shares, currency, buy_rate, current_rate in conn.execute(query + " ORDER BY portfolio_id, ticker", params):
+            # buy_date stays empty: the euro cost already reflects each lot's own rate.
+            positions.setdefault(portfolio_id, []).append(Asset(None, name, ticker, buy_price, shares, None, False, currency, buy_rate, current_rate, 0.0, None))
+    return positions
+
+def load_position_summary(portfolio_id):
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT ticker, COALESCE(name, ticker), currency, shares, fifo_cost_eur, average_cost_eur, realized_fifo, realized_average, dividends
+            FROM positions WHERE portfolio_id = ? ORDER BY ticker
+        """, (portfolio_id,))
+        return pd.DataFrame(cursor.fetchall(), columns=["Symboli", "Nimi", "Valuutta", "Osuudet", "Hankintameno FIFO (€)", "Hankintameno keskihinta (€)", "Toteutunut FIFO (€)", "Toteutunut keskihinta (€)", "Osingot (€)"])
+
+def portfolio_holdings(portfolio_id, assets, cost_method="fifo"):
+    return list(assets) + load_positions([portfolio_id], cost_method).get(portfolio_id, [])
@@ -0,0 +1,99 @@
+"""Background price polling for the live valuation view."""
+
+import threading
+import time
+
+from .config import LIVE_IDLE_TIMEOUT, LIVE_PAUSE_INTERVALS
+from .metrics import count
+from .pricing import get_fx_rates, get_stock_data
+
+class PricePoller:
+    """Refreshes quotes for a fixed set of tickers every `interval` seconds on a daemon thread.
+
+    Readers call heartbeat() whenever they render. Without heartbeats the poller stops fetching after
+    LIVE_PAUSE_INTERVALS intervals, resumes on the next heartbeat, and exits after LIVE_IDLE_TIMEOUT seconds.
+    """
+
+    def __init__(self, tickers, currencies, interval):
+        self.tickers = tuple(sorted(set(tickers)))
+        self.currencies = tuple(sorted(set(currencies)))
+        self.interval = interval
+        self.prices = None
+        self.fx_rates = {}
+        self.version = 0
+        self.updated_at = None
+        self.error = None
+        self.paused = False
+        self._last_heartbeat = time.monotonic()
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name=f"price-poller-{interval}s")
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+    @property
+    def alive(self):
+        return self._thread.is_alive() and not self._stopped.is_set()
+
+    def heartbeat(self):
+        self._last_heartbeat = time.monotonic()
+        if self.paused:
+            self._wake.set()
+
+    def wait_ready(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def latest(self):
+        with self._lock:
+            return self.prices, self.fx_rates, self.version, self.updated_at
+
+    def poll(self):
+        try:
+            prices = get_stock_data(list(self.tickers), max_age=self.interval)
+            fx_rates = get_fx_rates(self.currencies)
+        except Exception as error:
+            self.error = error
+            count("salkku_live_polls_total", result="error")
+            return False
+        with self._lock:
+            self.prices, self.fx_rates = prices, fx_rates
+            self.version += 1
+            self.updated_at = time.time()
+        self.error = None
+        self._ready.set()
+        count("salkku_live_polls_total", result="ok")
+        return True
+
+    def _run(self):
+        while not self._stopped.is_set():
+            idle = time.monotonic() - self._last_heartbeat
+            if idle > LIVE_IDLE_TIMEOUT:
+                break
+            self.paused = idle > self.interval * LIVE_PAUSE_INTERVALS
+            if not self.paused:
+                self.poll()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+        self._stopped.set()
+
+_pollers = {}
+_pollers_lock = threading.Lock()
+
+def get_price_poller(tickers, currencies, interval):
+    """The running poller for these tickers and interval; sessions watching the same holdings share one."""
+    key = (tuple(sorted(set(tickers))), tuple(sorted(set(currencies))), interval)
+    with _pollers_lock:
+        for stale_key in [other for other, poller in _pollers.items() if not poller.alive]:
+            del _pollers[stale_key]
+        poller = _pollers.get(key)
+        if poller is None:
+            poller = _pollers[key] = PricePoller(*key).start()
+        return poller
@@ -0,0 +1,150 @@
+"""Opt-in hot-path instrumentation: latency histograms, counters and their export."""
+
+import bisect
+import json
+import multiprocessing
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from itertools import accumulate
+
+from .config import LATENCY_BUCKETS, METRICS_ENABLED, METRICS_FILE, METRICS_FLUSH_INTERVAL
+
+class MetricsRegistry:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, labels=()):
+        key = (name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, labels=()):
+        key = (name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {"buckets": [0] * (len(self.buckets) + 1), "count": 0, "sum": 0.0, "max": 0.0}
+            # Buckets are stored per interval and made cumulative only on export.
+            histogram["buckets"][bisect.bisect_left(self.buckets, seconds)] += 1
+            histogram["count"] += 1
+            histogram["sum"] += seconds
+            histogram["max"] = max(histogram["max"], seconds)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def snapshot(self):
+        with self._lock:
+            counters = [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in sorted(self.counters.items())]
+            histograms = []
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                cumulative = list(accumulate(histogram["buckets"]))
+                histograms.append({
+                    "name": name, "labels": dict(labels), "count": histogram["count"], "sum": histogram["sum"], "max": histogram["max"],
+                    "buckets": dict(zip([str(bound) for bound in self.buckets] + ["+Inf"], cumulative)),
+                })
+        return {"generated_at": time.time(), "counters": counters, "histograms": histograms}
+
+    def to_prometheus(self):
+        def label_text(labels, **extra):
+            pairs = [f'{key}="{value}"' for key, value in list(labels.items()) + list(extra.items())]
+            return "{" + ",".join(pairs) + "}" if pairs else ""
+
+        snapshot = self.snapshot()
+        lines, typed = [], set()
+        for counter in snapshot["counters"]:
+            if counter["name"] not in typed:
+                lines.append(f"# TYPE {counter['name']} counter")
+                typed.add(counter["name"])
+            lines.append(f"{counter['name']}{label_text(counter['labels'])} {counter['value']}")
+        for histogram in snapshot["histograms"]:
+            name = histogram["name"]
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            for bound, total in histogram["buckets"].items():
+                lines.append(f"{name}_bucket{label_text(histogram['labels'], le=bound)} {total}")
+            lines.append(f"{name}_sum{label_text(histogram['labels'])} {histogram['sum']}")
+            lines.append(f"{name}_count{label_text(histogram['labels'])} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        # A .json path gets the JSON snapshot, anything else Prometheus text (e.g. for a node_exporter textfile collector).
+        content = json.dumps(self.snapshot()) if path.endswith(".json") else self.to_prometheus()
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as target:
+            target.write(content)
+        os.replace(temporary, path)
+
+def _flush_metrics(registry, path):
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            registry.write(path)
+        except OSError:
+            pass
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_metrics():
+    # One registry per process; package modules outlive Streamlit reruns, so every session shares it.
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = MetricsRegistry()
+            # Report worker processes keep their own registry and must not overwrite the parent's export file.
+            if METRICS_ENABLED and METRICS_FILE and multiprocessing.parent_process() is None:
+                threading.Thread(target=_flush_metrics, args=(_registry, METRICS_FILE), daemon=True, name="metrics-flush").start()
+        return _registry
+
+# Resolved once at import so hot paths skip the lock.
+_METRICS = get_metrics() if METRICS_ENABLED else None
+
+def timed(name=None):
+    """Records call latency and errors of the decorated function; returns it untouched when metrics are off."""
+    def decorate(function):
+        if not METRICS_ENABLED:
+            return function
+        labels = (("function", name or function.__name__),)
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            except Exception:
+                _METRICS.inc("salkku_errors_total", 1, labels)
+                raise
+            finally:
+                _METRICS.observe("salkku_call_seconds", time.perf_counter() - started, labels)
+        return wrapper
+    return decorate
+
+def _count(name, value=1, **labels):
+    _METRICS.inc(name, value, tuple(sorted(labels.items())))
+
+@contextmanager
+def _timer(name, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _METRICS.observe(name, time.perf_counter() - started, tuple(sorted(labels.items())))
+
+def _skip_count(name, value=1, **labels):
+    pass
+
+_NO_TIMER = nullcontext()
+
+# Chosen once at import so disabled instrumentation costs a plain function call at most.
+count = _count if METRICS_ENABLED else _skip_count
+timer = _timer if METRICS_ENABLED else (lambda name, **labels: _NO_TIMER)
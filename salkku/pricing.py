@@ -0,0 +1,348 @@
+"""Quotes, FX rates and daily price history, backed by SQLite caches and yfinance."""
+
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError, as_completed
+from datetime import date, timedelta
+
+import pandas as pd
+
+from .config import BASE_CURRENCY, FALLBACK_BACKOFF, FALLBACK_COOLDOWN, FALLBACK_DEADLINE, FALLBACK_FAILURE_THRESHOLD, FALLBACK_RETRIES, FALLBACK_TICKER_TIMEOUT, FALLBACK_WORKERS, FX_RATE_TTL, PRICE_HISTORY_YEARS, QUOTE_CACHE_TTL
+from .metrics import count, timed, timer
+from .db import db_connection
+
+class QuoteCacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hits, misses):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def snapshot(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "ttl_seconds": QUOTE_CACHE_TTL,
+            }
+
+# Module-level, so the counters survive Streamlit reruns and are shared by all sessions.
+_quote_cache_stats = QuoteCacheStats()
+
+def get_quote_cache_stats():
+    return _quote_cache_stats
+
+@timed()
+def load_cached_quotes(tickers):
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        placeholders = ','.join('?' for _ in tickers)
+        cursor.execute(f"SELECT ticker, price, fetched_at FROM quote_cache WHERE ticker IN ({placeholders})", list(tickers))
+        rows = cursor.fetchall()
+    count("salkku_db_rows_read_total", len(rows), function="load_cached_quotes")
+    return {ticker: (price, fetched_at) for ticker, price, fetched_at in rows}
+
+@timed()
+def store_cached_quotes(prices, fetched_at):
+    rows = [(ticker, float(price), fetched_at) for ticker, price in prices.items() if price is not None and not math.isnan(price)]
+    if not rows:
+        return
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany("""
+            INSERT INTO quote_cache (ticker, price, fetched_at) VALUES (?, ?, ?)
+            ON CONFLICT(ticker) DO UPDATE SET price = excluded.price, fetched_at = excluded.fetched_at
+        """, rows)
+        conn.commit()
+    count("salkku_db_rows_written_total", len(rows), function="store_cached_quotes")
+
+class PriceQuotes(dict):
+    def __init__(self, *args, failed=(), stale=(), as_of=None):
+        super().__init__(*args)
+        # Tickers without any price, and tickers served from an expired cache entry because the refresh failed.
+        self.failed = list(failed)
+        self.stale = list(stale)
+        # Fetch time of the oldest quote included.
+        self.as_of = time.time() if as_of is None else as_of
+
+class CircuitBreaker:
+    def __init__(self, threshold=FALLBACK_FAILURE_THRESHOLD, cooldown=FALLBACK_COOLDOWN):
+        self._lock = threading.Lock()
+        self._failures = {}
+        self._open_until = {}
+        self.threshold = threshold
+        self.cooldown = cooldown
+
+    def allow(self, ticker):
+        with self._lock:
+            return self._open_until.get(ticker, 0) <= time.monotonic()
+
+    def record_success(self, ticker):
+        with self._lock:
+            self._failures.pop(ticker, None)
+            self._open_until.pop(ticker, None)
+
+    def record_failure(self, ticker):
+        with self._lock:
+            failures = self._failures.get(ticker, 0) + 1
+            self._failures[ticker] = failures
+            if failures >= self.threshold:
+                self._open_until[ticker] = time.monotonic() + self.cooldown
+
+_circuit_breaker = CircuitBreaker()
+
+def get_circuit_breaker():
+    return _circuit_breaker
+
+def _fetch_ticker_price(ticker, deadline):
+    import yfinance as yf
+    for attempt in range(FALLBACK_RETRIES + 1):
+        try:
+            count("salkku_external_calls_total", service="yfinance", call="history")
+            with timer("salkku_external_call_seconds", service="yfinance", call="history"):
+                hist = yf.Ticker(ticker).history(period="1d", timeout=FALLBACK_TICKER_TIMEOUT)
+            if hist.empty:
+                return None
+            if 'Adj Close' in hist.columns:
+                return hist['Adj Close'].iloc[0]
+            if 'Close' in hist.columns:
+                return hist['Close'].iloc[0]
+            return None
+        except Exception:
+            backoff = FALLBACK_BACKOFF * 2 ** attempt
+            if attempt == FALLBACK_RETRIES or time.monotonic() + backoff >= deadline:
+                raise
+            time.sleep(backoff)
+
+def _fetch_prices_concurrently(tickers):
+    breaker = get_circuit_breaker()
+    data, failed = {}, []
+    allowed = []
+    for ticker in tickers:
+        (allowed if breaker.allow(ticker) else failed).append(ticker)
+    if not allowed:
+        return data, failed
+
+    deadline = time.monotonic() + FALLBACK_DEADLINE
+    executor = ThreadPoolExecutor(max_workers=min(FALLBACK_WORKERS, len(allowed)))
+    futures = {executor.submit(_fetch_ticker_price, ticker, deadline): ticker for ticker in allowed}
+    pending = set(futures)
+
+    def collect(future):
+        pending.discard(future)
+        ticker = futures[future]
+        try:
+            price = future.result()
+        except Exception:
+            price = None
+        if price is None or math.isnan(price):
+            breaker.record_failure(ticker)
+            failed.append(ticker)
+        else:
+            breaker.record_success(ticker)
+            data[ticker] = price
+
+    try:
+        for future in as_completed(futures, timeout=max(0.0, deadline - time.monotonic())):
+            collect(future)
+    except FuturesTimeoutError:
+        # Futures that finished after the deadline but before as_completed yielded them still count.
+        for future in list(pending):
+            if future.done():
+                collect(future)
+            else:
+                breaker.record_failure(futures[future])
+                failed.append(futures[future])
+    finally:
+        # Requests still in flight finish on their own; the caller does not wait for them.
+        executor.shutdown(wait=False, cancel_futures=True)
+    return data, failed
+
+def _download_prices(tickers):
+    import yfinance as yf
+    data = {}
+    try:
+        count("salkku_external_calls_total", service="yfinance", call="download")
+        with timer("salkku_external_call_seconds", service="yfinance", call="download"):
+            downloaded_data = yf.download(tickers, period="1d")
+        if 'Adj Close' in downloaded_data.columns:
+            if isinstance(downloaded_data['Adj Close'], pd.DataFrame):
+                data = downloaded_data['Adj Close'].iloc[-1].to_dict()
+            else:
+                data = downloaded_data['Adj Close'].to_dict()
+        elif 'Close' in downloaded_data.columns:
+            if isinstance(downloaded_data['Close'], pd.DataFrame):
+                data = downloaded_data['Close'].iloc[-1].to_dict()
+            else:
+                data = downloaded_data['Close'].to_dict()
+        data = {ticker: price for ticker, price in data.items() if price is not None and not math.isnan(price)}
+    except Exception:
+        data = {}
+    missing = [ticker for ticker in tickers if ticker not in data]
+    if not missing:
+        return data, []
+    fallback_data, failed = _fetch_prices_concurrently(missing)
+    data.update(fallback_data)
+    return data, failed
+
+@timed()
+def get_stock_data(tickers, max_age=None):
+    if not tickers:
+        return PriceQuotes()
+    data = {}
+    tickers = list(dict.fromkeys(tickers))
+    max_age = QUOTE_CACHE_TTL if max_age is None else max_age
+    now = time.time()
+
+    cached = load_cached_quotes(tickers)
+    stale_tickers = []
+    as_of = now
+    for ticker in tickers:
+        entry = cached.get(ticker)
+        if entry is not None and now - entry[1] <= max_age:
+            data[ticker] = entry[0]
+            as_of = min(as_of, entry[1])
+        else:
+            stale_tickers.append(ticker)
+    get_quote_cache_stats().record(len(data), len(stale_tickers))
+
+    failed, stale = [], []
+    if stale_tickers:
+        fetched, fetch_failed = _download_prices(stale_tickers)
+        store_cached_quotes(fetched, now)
+        data.update(fetched)
+        for ticker in fetch_failed:
+            if ticker in cached:
+                # Serve the last known quote rather than dropping the asset from the valuation.
+                data[ticker] = cached[ticker][0]
+                stale.append(ticker)
+                as_of = min(as_of, cached[ticker][1])
+            else:
+                failed.append(ticker)
+    return PriceQuotes(data, failed=failed, stale=stale, as_of=as_of)
+
+def _download_price_history(tickers, start):
+    import yfinance as yf
+    count("salkku_external_calls_total", service="yfinance", call="download_history")
+    with timer("salkku_external_call_seconds", service="yfinance", call="download_history"):
+        downloaded = yf.download(tickers, start=start, auto_adjust=True, group_by="column", progress=False)
+    if downloaded is None or downloaded.empty:
+        return []
+    if not isinstance(downloaded.columns, pd.MultiIndex):
+        downloaded.columns = pd.MultiIndex.from_product([downloaded.columns, tickers])
+    fields = [field for field in ("Open", "High", "Low", "Close") if field in downloaded.columns.get_level_values(0)]
+    frame = downloaded[fields].stack(level=-1, future_stack=True).reindex(columns=["Open", "High", "Low", "Close"])
+    frame = frame.dropna(subset=["Close"])
+    dates = frame.index.get_level_values(0).strftime("%Y-%m-%d")
+    symbols = frame.index.get_level_values(-1)
+    values = frame.astype(object).where(frame.notna(), None).to_numpy().tolist()
+    return [(symbol, day, *ohlc) for symbol, day, ohlc in zip(symbols, dates, values)]
+
+@timed()
+def update_price_history(tickers, years=PRICE_HISTORY_YEARS):
+    tickers = sorted(set(tickers))
+    if not tickers:
+        return 0
+    today = date.today()
+    placeholders = ','.join('?' for _ in tickers)
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT ticker FROM price_history_sync WHERE ticker IN ({placeholders}) AND synced_on >= ?", tickers + [today.isoformat()])
+        synced = {row[0] for row in cursor.fetchall()}
+        cursor.execute(f"SELECT ticker, MAX(price_date) FROM price_history WHERE ticker IN ({placeholders}) GROUP BY ticker", tickers)
+        last_dates = dict(cursor.fetchall())
+
+    # Tickers with the same last stored date are fetched together, so a routine daily update is one download.
+    by_start = {}
+    default_start = (today - timedelta(days=365 * years)).isoformat()
+    for ticker in tickers:
+        if ticker in synced:
+            continue
+        last_date = last_dates.get(ticker)
+        # The last stored day is fetched again because it may have been stored from an unfinished trading session.
+        by_start.setdefault(last_date or default_start, []).append(ticker)
+
+    rows = []
+    fetched = []
+    for start, group in by_start.items():
+        try:
+            rows.extend(_download_price_history(group, start))
+            fetched.extend(group)
+        except Exception:
+            continue
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany("""
+            INSERT INTO price_history (ticker, price_date, open, high, low, close) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(ticker, price_date) DO UPDATE SET open = excluded.open, high = excluded.high, low = excluded.low, close = excluded.close
+        """, rows)
+        cursor.executemany("""
+            INSERT INTO price_history_sync (ticker, synced_on) VALUES (?, ?)
+            ON CONFLICT(ticker) DO UPDATE SET synced_on = excluded.synced_on
+        """, [(ticker, today.isoformat()) for ticker in fetched])
+        conn.commit()
+    count("salkku_db_rows_written_total", len(rows), function="update_price_history")
+    return len(rows)
+
+@timed()
+def load_price_matrix(tickers, start=None, end=None):
+    tickers = sorted(set(tickers))
+    if not tickers:
+        return pd.DataFrame()
+    placeholders = ','.join('?' for _ in tickers)
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT price_date, ticker, close FROM price_history
+            WHERE ticker IN ({placeholders}) AND price_date >= ? AND price_date <= ?
+            ORDER BY price_date
+        """, tickers + [start or "0000-00-00", end or "9999-99-99"])
+        rows = cursor.fetchall()
+    count("salkku_db_rows_read_total", len(rows), function="load_price_matrix")
+    prices = pd.DataFrame(rows, columns=["price_date", "ticker", "close"])
+    matrix = prices.pivot(index="price_date", columns="ticker", values="close")
+    matrix.index = pd.to_datetime(matrix.index)
+    return matrix.reindex(columns=tickers)
+
+def fx_symbol(currency):
+    return f"{BASE_CURRENCY}{currency}=X"
+
+def get_fx_rates(currencies, max_age=FX_RATE_TTL):
+    currencies = sorted({currency for currency in currencies if currency and currency != BASE_CURRENCY})
+    quotes = get_stock_data([fx_symbol(currency) for currency in currencies], max_age=max_age)
+    rates = {BASE_CURRENCY: 1.0}
+    for currency in currencies:
+        rate = quotes.get(fx_symbol(currency))
+        if rate is not None and rate > 0:
+            rates[currency] = float(rate)
+    return rates
+
+def get_historical_fx_rates(currency_dates):
+    currency_dates = {(currency, buy_date) for currency, buy_date in currency_dates if currency and currency != BASE_CURRENCY and buy_date}
+    currencies = sorted({currency for currency, _ in currency_dates})
+    update_price_history([fx_symbol(currency) for currency in currencies])
+    rates = {}
+    for currency in currencies:
+        series = load_price_matrix([fx_symbol(currency)])[fx_symbol(currency)].dropna()
+        if series.empty:
+            continue
+        dates = sorted(buy_date for code, buy_date in currency_dates if code == currency)
+        # Closing rate of the purchase date, or of the last trading day before it.
+        positions = series.index.searchsorted(pd.to_datetime(dates), side="right") - 1
+        for buy_date, position in zip(dates, positions):
+            if position >= 0:
+                rates[(currency, buy_date)] = float(series.iloc[position])
+    return rates
+
+def get_portfolio_fx(assets):
+    currencies = {asset.get('currency') for asset in assets}
+    fx_rates = get_fx_rates(currencies)
+    buy_fx_rates = get_historical_fx_rates((asset.get('currency'), asset.get('buy_date')) for asset in assets)
+    return fx_rates, buy_fx_rates
@@ -0,0 +1,139 @@
+"""Buy and sell orders that move holdings towards their target_percentage."""
+
+from dataclasses import dataclass
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+from .metrics import timed
+from .valuation import apply_fx_rates, holdings_frame
+
+ORDER_COLUMNS = ["portfolio_id", "Kohde", "Ticker", "Toimeksianto", "Kpl", "Hinta", "Valuutta", "Arvo (€)", "Osuus ennen (%)", "Osuus jälkeen (%)", "Tavoite (%)"]
+SUMMARY_COLUMNS = ["portfolio_id", "Arvo ennen (€)", "Ostot (€)", "Myynnit (€)", "Käteinen (€)", "Käteistä jäljellä (€)", "Poikkeama ennen (%)", "Poikkeama jälkeen (%)"]
+
+@dataclass(frozen=True)
+class RebalancePlan:
+    orders: pd.DataFrame
+    summary: pd.DataFrame
+
+def _group_sum(values, codes, groups):
+    return np.bincount(codes, weights=values, minlength=groups)
+
+def _fill_leftover(codes, groups, price, deficit, leftover, eligible):
+    # One more share for the most underweight holdings of each portfolio while the leftover cash covers it.
+    candidates = np.flatnonzero(eligible)
+    order = candidates[np.lexsort((-deficit[candidates], codes[candidates]))]
+    cost = np.cumsum(price[order])
+    group_codes = codes[order]
+    first = np.r_[True, group_codes[1:] != group_codes[:-1]]
+    offset = np.maximum.accumulate(np.where(first, np.r_[0.0, cost[:-1]], 0.0))
+    extra = np.zeros(len(codes))
+    extra[order] = (cost - offset <= leftover[group_codes] + 1e-9).astype(float)
+    return extra
+
+@timed()
+def rebalance_batch(portfolios, current_prices, fx_rates=None, cash=0.0, whole_shares=True, min_trade=0.0, allow_sell=True):
+    """Orders for every portfolio in `portfolios` ({portfolio_id: assets}) in one vectorized pass.
+
+    Holdings with a target are moved towards target_percentage of the portfolio value plus `cash`, which is one
+    amount for all portfolios or a mapping by portfolio id. Sales fund purchases; when the money does not cover
+    every purchase they are scaled down evenly. Manual holdings and holdings without a target are never traded
+    but count towards the portfolio value. Trades worth less than `min_trade` euros are dropped.
+    """
+    holdings = holdings_frame(portfolios)
+    if fx_rates:
+        holdings = apply_fx_rates(holdings, fx_rates)
+    prices = pd.Series(current_prices, dtype=float)
+    is_manual = holdings["is_manual"].fillna(0).astype(bool).to_numpy()
+    native_price = np.where(is_manual, pd.to_numeric(holdings["manual_price"], errors="coerce").to_numpy(dtype=float),
+                            holdings["ticker"].map(prices).to_numpy(dtype=float))
+    rate = holdings["current_currency_rate"].to_numpy(dtype=float)
+    price = native_price / rate
+    shares = holdings["shares"].to_numpy(dtype=float)
+    priced = np.isfinite(price) & (price > 0)
+    value = np.where(priced, price * shares, 0.0)
+    target = holdings["target_percentage"].fillna(0).to_numpy(dtype=float)
+    tradable = priced & ~is_manual & (target > 0)
+
+    codes, portfolio_ids = pd.factorize(holdings["portfolio_id"])
+    groups = len(portfolio_ids)
+    if isinstance(cash, dict):
+        cash_by_group = np.array([float(cash.get(portfolio_id, 0.0)) for portfolio_id in portfolio_ids])
+    else:
+        cash_by_group = np.full(groups, float(cash))
+    total_before = _group_sum(value, codes, groups)
+    investable = total_before + cash_by_group
+    desired = np.where(tradable, target / 100 * investable[codes] - value, 0.0)
+
+    safe_price = np.where(priced, price, 1.0)
+    sell_shares = np.where(desired < 0, desired / safe_price, 0.0) if allow_sell else np.zeros(len(desired))
+    sell_shares = np.maximum(np.trunc(sell_shares) if whole_shares else sell_shares, -shares)
+    sell_shares = np.where(-sell_shares * price >= max(min_trade, 1e-9), sell_shares, 0.0)
+    proceeds = _group_sum(-sell_shares * price, codes, groups)
+
+    wanted = np.maximum(desired, 0.0)
+    budget = np.maximum(cash_by_group + proceeds, 0.0)
+    wanted_total = _group_sum(wanted, codes, groups)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scale = np.where(wanted_total > budget, budget / wanted_total, 1.0)
+    buy_shares = wanted * scale[codes] / safe_price
+    if whole_shares:
+        buy_shares = np.floor(buy_shares + 1e-9)
+    buy_shares = np.where(buy_shares * price >= max(min_trade, 1e-9), buy_shares, 0.0)
+    if whole_shares:
+        leftover = budget - _group_sum(buy_shares * price, codes, groups)
+        deficit = wanted - buy_shares * price
+        eligible = tradable & (deficit >= price) & ((buy_shares + 1) * price >= min_trade)
+        buy_shares += _fill_leftover(codes, groups, price, deficit, leftover, eligible)
+
+    change = buy_shares + sell_shares
+    trade_value = change * price
+    bought = _group_sum(buy_shares * price, codes, groups)
+    remaining_cash = cash_by_group + proceeds - bought
+    total_after = total_before + bought - proceeds + remaining_cash
+    value_after = value + trade_value
+    with np.errstate(divide="ignore", invalid="ignore"):
+        weight_before = np.where(total_before[codes] > 0, value / total_before[codes] * 100, 0.0)
+        weight_after = np.where(total_after[codes] > 0, value_after / total_after[codes] * 100, 0.0)
+    deviation_before = _group_sum(np.where(tradable, np.abs(weight_before - target), 0.0), codes, groups)
+    deviation_after = _group_sum(np.where(tradable, np.abs(weight_after - target), 0.0), codes, groups)
+
+    traded = change != 0
+    orders = pd.DataFrame({
+        "portfolio_id": holdings["portfolio_id"].to_numpy()[traded],
+        "Kohde": holdings["name"].to_numpy()[traded],
+        "Ticker": holdings["ticker"].to_numpy()[traded],
+        "Toimeksianto": np.where(change[traded] > 0, "Osto", "Myynti"),
+        "Kpl": np.abs(change[traded]),
+        "Hinta": native_price[traded],
+        "Valuutta": holdings["currency"].to_numpy()[traded],
+        "Arvo (€)": trade_value[traded],
+        "Osuus ennen (%)": weight_before[traded],
+        "Osuus jälkeen (%)": weight_after[traded],
+        "Tavoite (%)": target[traded],
+    }, columns=ORDER_COLUMNS)
+    summary = pd.DataFrame({
+        "portfolio_id": portfolio_ids,
+        "Arvo ennen (€)": total_before,
+        "Ostot (€)": bought,
+        "Myynnit (€)": proceeds,
+        "Käteinen (€)": cash_by_group,
+        "Käteistä jäljellä (€)": remaining_cash,
+        # Sum of absolute deviations from target over the traded holdings, in percentage points.
+        "Poikkeama ennen (%)": deviation_before,
+        "Poikkeama jälkeen (%)": deviation_after,
+    }, columns=SUMMARY_COLUMNS)
+    return RebalancePlan(orders, summary)
+
+def rebalance_portfolio(assets, current_prices, fx_rates=None, cash=0.0, whole_shares=True, min_trade=0.0, allow_sell=True):
+    plan = rebalance_batch({0: assets}, current_prices, fx_rates, cash, whole_shares, min_trade, allow_sell)
+    return RebalancePlan(plan.orders.drop(columns="portfolio_id"), plan.summary.drop(columns="portfolio_id"))
+
+def export_orders(orders, file_format="csv"):
+    buffer = BytesIO()
+    if file_format == "parquet":
+        orders.to_parquet(buffer, index=False)
+    else:
+        orders.to_csv(buffer, index=False, encoding="utf-8")
+    return buffer.getvalue()
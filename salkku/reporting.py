@@ -0,0 +1,285 @@
+"""PDF reports and the on-disk report cache."""
+
+import hashlib
+import json
+import os
+import time
+from datetime import date
+from functools import lru_cache
+from io import BytesIO
+from xml.sax.saxutils import escape
+
+import numpy as np
+import pandas as pd
+
+from .config import REPORT_CACHE_DAYS, REPORT_CACHE_DIR
+from .metrics import timed
+
+REPORT_COLUMNS = ["Nimi", "Alkuperäinen arvo", "Nykyinen arvo", "Tuotto (€)", "Tuotto (%)", "Osuus salkusta (%)", "Tavoite (%)", "Poikkeama (%)", "Poikkeama (€)"]
+# reportlab.lib.units.inch, spelled out so that importing this module does not load reportlab.
+INCH = 72.0
+REPORT_COLUMN_WIDTHS = [1.1 * INCH] + [0.675 * INCH] * 8
+REPORT_HEADER_HEIGHT = 28
+REPORT_ROW_HEIGHT = 14
+REPORT_FONT_SIZE = 8
+ANALYTICS_REPORT_COLUMNS = ["Kohde", "Tuotto (%)", "Vuosituotto (%)", "Volatiliteetti (%)", "Suurin pudotus (%)", "Sharpe"]
+ANALYTICS_COLUMN_WIDTHS = [2.4 * INCH] + [0.9 * INCH] * 5
+REBALANCE_REPORT_COLUMNS = ["Kohde", "Toimeksianto", "Kpl", "Hinta", "Arvo (€)", "Osuus ennen (%)", "Osuus jälkeen (%)", "Tavoite (%)"]
+REBALANCE_COLUMN_WIDTHS = [1.9 * INCH] + [0.75 * INCH] * 7
+
+@lru_cache(maxsize=1)
+def _report_styles():
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    styles = getSampleStyleSheet()
+    return {
+        "title": ParagraphStyle('TitleStyle', parent=styles['Title'], fontSize=16, leading=20),
+        "heading2": ParagraphStyle('Heading2Style', parent=styles['h2'], fontSize=12, leading=15),
+        "header": ParagraphStyle('HeaderStyle', parent=styles['Normal'], fontSize=7, leading=8.5, alignment=1),
+        "normal": styles['Normal'],
+    }
+
+def _fit_text(text, width, font="Helvetica", size=REPORT_FONT_SIZE):
+    from reportlab.pdfbase.pdfmetrics import stringWidth
+    # Rows have a fixed height so that splitting the table across pages never re-measures the remaining rows.
+    if len(text) * size * 0.45 <= width or stringWidth(text, font, size) <= width:
+        return text
+    while text and stringWidth(text + "…", font, size) > width:
+        text = text[:-1]
+    return text + "…"
+
+def _format_numbers(values, template):
+    return np.char.mod(template, np.asarray(values, dtype=float)).tolist()
+
+def _color_runs(column, colors_by_row, first_row):
+    from reportlab.lib import colors
+    # One TEXTCOLOR command per run of equally coloured rows instead of one per cell.
+    commands = []
+    if len(colors_by_row) == 0:
+        return commands
+    change = np.flatnonzero(colors_by_row[1:] != colors_by_row[:-1]) + 1
+    starts = np.r_[0, change]
+    ends = np.r_[change, len(colors_by_row)] - 1
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        color = colors_by_row[start]
+        if color != "black":
+            commands.append(('TEXTCOLOR', (column, first_row + start), (column, first_row + end), getattr(colors, color)))
+    return commands
+
+def _report_table(raportti_df, total_row):
+    from reportlab.lib import colors
+    from reportlab.platypus import LongTable, Paragraph, TableStyle
+    header_style = _report_styles()["header"]
+    profit = raportti_df["Tuotto (€)"].to_numpy(dtype=float)
+    profit_percent = raportti_df["Tuotto (%)"].to_numpy(dtype=float)
+    target = raportti_df["Tavoite (%)"].to_numpy(dtype=float)
+    deviation = raportti_df["Poikkeama (%)"].to_numpy(dtype=float)
+
+    names = [_fit_text(name, REPORT_COLUMN_WIDTHS[0] - 4) for name in raportti_df["Nimi"].astype(str).tolist()]
+    targets = np.where(np.isnan(target), "-", np.char.mod("%.2f %%", target)).tolist()
+    columns = [
+        names,
+        _format_numbers(raportti_df["Alkuperäinen arvo"], "%.2f"),
+        _format_numbers(raportti_df["Nykyinen arvo"], "%.2f"),
+        _format_numbers(profit, "%.2f"),
+        _format_numbers(profit_percent, "%.2f %%"),
+        _format_numbers(raportti_df["Osuus salkusta (%)"], "%.2f %%"),
+        targets,
+        _format_numbers(deviation, "%.2f %%"),
+        _format_numbers(raportti_df["Poikkeama (€)"], "%.2f"),
+    ]
+
+    total_original_cost = total_row["Alkuperäinen arvo"].iloc[0]
+    total_current_value = total_row["Nykyinen arvo"].iloc[0]
+    total_profit = total_row["Tuotto (€)"].iloc[0]
+    total_profit_percent = total_row["Tuotto (%)"].iloc[0]
+
+    table_data = [[Paragraph(col, header_style) for col in REPORT_COLUMNS]]
+    table_data.extend(map(list, zip(*columns)))
+    table_data.append([
+        "Kokonaisalkku",
+        f"{total_original_cost:.2f}",
+        f"{total_current_value:.2f}",
+        f"{total_profit:.2f}",
+        f"{total_profit_percent:.2f} %",
+        "100.00 %",
+        "-",
+        "-",
+        "-",
+    ])
+
+    profit_colors = np.where(profit >= 0, "green", "red")
+    commands = [
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ('BOX', (0, 0), (-1, -1), 1, colors.black),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTSIZE', (0, 1), (-1, -1), REPORT_FONT_SIZE),
+        ('LEFTPADDING', (0, 0), (-1, -1), 2),
+        ('RIGHTPADDING', (0, 0), (-1, -1), 2),
+        ('BACKGROUND', (0, -1), (-1, -1), colors.lightgrey),
+        ('FONT', (0, -1), (-1, -1), 'Helvetica-Bold', REPORT_FONT_SIZE),
+        ('TEXTCOLOR', (3, -1), (3, -1), colors.green if total_profit >= 0 else colors.red),
+        ('TEXTCOLOR', (4, -1), (4, -1), colors.green if total_profit_percent >= 0 else colors.red),
+    ]
+    commands += _color_runs(3, profit_colors, 1)
+    commands += _color_runs(4, np.where(profit_percent >= 0, "green", "red"), 1)
+    commands += _color_runs(7, np.where(np.abs(deviation) > 5.0, "red", "black"), 1)
+
+    row_heights = [REPORT_HEADER_HEIGHT] + [REPORT_ROW_HEIGHT] * (len(table_data) - 1)
+    table = LongTable(table_data, colWidths=REPORT_COLUMN_WIDTHS, rowHeights=row_heights, repeatRows=1)
+    table.setStyle(TableStyle(commands))
+    return table
+
+def _analytics_table(summary):
+    from reportlab.lib import colors
+    from reportlab.platypus import LongTable, Paragraph, TableStyle
+    header_style = _report_styles()["header"]
+    names = [_fit_text(name, ANALYTICS_COLUMN_WIDTHS[0] - 4) for name in summary["Kohde"].astype(str).tolist()]
+    columns = [names] + [
+        np.where(np.isnan(values), "-", np.char.mod(template, np.nan_to_num(values))).tolist()
+        for values, template in (
+            (summary[column].to_numpy(dtype=float), "%.2f" if column == "Sharpe" else "%.2f %%")
+            for column in ANALYTICS_REPORT_COLUMNS[1:]
+        )
+    ]
+    table_data = [[Paragraph(col, header_style) for col in ANALYTICS_REPORT_COLUMNS]]
+    table_data.extend(map(list, zip(*columns)))
+    total_return = summary["Tuotto (%)"].to_numpy(dtype=float)
+    commands = [
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTSIZE', (0, 1), (-1, -1), REPORT_FONT_SIZE),
+        ('LEFTPADDING', (0, 0), (-1, -1), 2),
+        ('RIGHTPADDING', (0, 0), (-1, -1), 2),
+        # The first row is the whole portfolio.
+        ('BACKGROUND', (0, 1), (-1, 1), colors.lightgrey),
+        ('FONT', (0, 1), (-1, 1), 'Helvetica-Bold', REPORT_FONT_SIZE),
+    ]
+    commands += _color_runs(1, np.where(np.nan_to_num(total_return) >= 0, "green", "red"), 1)
+    row_heights = [REPORT_HEADER_HEIGHT] + [REPORT_ROW_HEIGHT] * (len(table_data) - 1)
+    table = LongTable(table_data, colWidths=ANALYTICS_COLUMN_WIDTHS, rowHeights=row_heights, repeatRows=1)
+    table.setStyle(TableStyle(commands))
+    return table
+
+def _rebalance_table(orders):
+    from reportlab.lib import colors
+    from reportlab.platypus import LongTable, Paragraph, TableStyle
+    header_style = _report_styles()["header"]
+    labels = [f"{name} ({ticker})" if ticker else str(name) for name, ticker in zip(orders["Kohde"].tolist(), orders["Ticker"].tolist())]
+    columns = [
+        [_fit_text(label, REBALANCE_COLUMN_WIDTHS[0] - 4) for label in labels],
+        orders["Toimeksianto"].tolist(),
+        _format_numbers(orders["Kpl"], "%.2f"),
+        [f"{price:.2f} {currency}" for price, currency in zip(orders["Hinta"].tolist(), orders["Valuutta"].tolist())],
+        _format_numbers(orders["Arvo (€)"], "%.2f"),
+        _format_numbers(orders["Osuus ennen (%)"], "%.2f %%"),
+        _format_numbers(orders["Osuus jälkeen (%)"], "%.2f %%"),
+        _format_numbers(orders["Tavoite (%)"], "%.2f %%"),
+    ]
+    table_data = [[Paragraph(col, header_style) for col in REBALANCE_REPORT_COLUMNS]]
+    table_data.extend(map(list, zip(*columns)))
+    commands = [
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTSIZE', (0, 1), (-1, -1), REPORT_FONT_SIZE),
+        ('LEFTPADDING', (0, 0), (-1, -1), 2),
+        ('RIGHTPADDING', (0, 0), (-1, -1), 2),
+    ]
+    commands += _color_runs(1, np.where(orders["Toimeksianto"].to_numpy() == "Osto", "green", "red"), 1)
+    row_heights = [REPORT_HEADER_HEIGHT] + [REPORT_ROW_HEIGHT] * (len(table_data) - 1)
+    table = LongTable(table_data, colWidths=REBALANCE_COLUMN_WIDTHS, rowHeights=row_heights, repeatRows=1)
+    table.setStyle(TableStyle(commands))
+    return table
+
+@timed()
+def create_pdf_report(df, total_row, portfolio_name, report_date=None, analytics=None, rebalance=None):
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter)
+    styles = _report_styles()
+    today = (report_date or date.today()).strftime("%d.%m.%Y")
+
+    raportti_df = df.rename(columns={"Alkuperäinen Nimi": "Nimi"}).reindex(columns=REPORT_COLUMNS)
+    elements = [
+        Paragraph(f"Salkun '{escape(portfolio_name)}' raportti - {today}", styles["title"]),
+        Spacer(1, 0.2 * INCH),
+        Paragraph("Sijoituskohteiden erittely", styles["heading2"]),
+        _report_table(raportti_df, total_row),
+        Spacer(1, 0.2 * INCH),
+    ]
+    if analytics is not None and not analytics.summary.empty:
+        period = f"{analytics.start.strftime('%d.%m.%Y')} – {analytics.as_of.strftime('%d.%m.%Y')}"
+        elements += [
+            Paragraph(f"Tuotto- ja riskiluvut {period}", styles["heading2"]),
+            _analytics_table(analytics.summary),
+            Spacer(1, 0.2 * INCH),
+        ]
+    if rebalance is not None:
+        totals = rebalance.summary.iloc[0]
+        elements += [
+            Paragraph("Tasapainotusehdotus", styles["heading2"]),
+            Paragraph(f"Ostot {totals['Ostot (€)']:.2f} €, myynnit {totals['Myynnit (€)']:.2f} €, käteistä jäljellä {totals['Käteistä jäljellä (€)']:.2f} €. "
+                      f"Poikkeama tavoitteista ennen {totals['Poikkeama ennen (%)']:.2f} ja jälkeen {totals['Poikkeama jälkeen (%)']:.2f} prosenttiyksikköä.", styles["normal"]),
+            Spacer(1, 0.1 * INCH),
+        ]
+        if not rebalance.orders.empty:
+            elements += [_rebalance_table(rebalance.orders), Spacer(1, 0.2 * INCH)]
+    doc.build(elements)
+    buffer.seek(0)
+    return buffer
+
+def report_cache_key(df, total_row, portfolio_name, report_date, analytics=None, rebalance=None):
+    # The frames are derived from holdings, prices and FX rates, so hashing them covers all three.
+    digest = hashlib.sha256()
+    digest.update(json.dumps([portfolio_name, report_date.isoformat(), list(df.columns)]).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    digest.update(pd.util.hash_pandas_object(total_row, index=False).to_numpy().tobytes())
+    if analytics is not None:
+        digest.update(json.dumps([analytics.start.isoformat(), analytics.as_of.isoformat()]).encode())
+        digest.update(pd.util.hash_pandas_object(analytics.summary, index=False).to_numpy().tobytes())
+    if rebalance is not None:
+        digest.update(b"rebalance")
+        digest.update(pd.util.hash_pandas_object(rebalance.orders, index=False).to_numpy().tobytes())
+        digest.update(pd.util.hash_pandas_object(rebalance.summary, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+def load_cached_report(key):
+    try:
+        with open(os.path.join(REPORT_CACHE_DIR, f"{key}.pdf"), "rb") as cached:
+            return cached.read()
+    except FileNotFoundError:
+        return None
+
+def store_cached_report(key, pdf_bytes):
+    os.makedirs(REPORT_CACHE_DIR, exist_ok=True)
+    path = os.path.join(REPORT_CACHE_DIR, f"{key}.pdf")
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as cached:
+        cached.write(pdf_bytes)
+    os.replace(temp_path, path)
+
+def prune_report_cache(max_age_days=REPORT_CACHE_DAYS):
+    if not os.path.isdir(REPORT_CACHE_DIR):
+        return 0
+    cutoff = time.time() - max_age_days * 86400
+    removed = 0
+    for entry in os.scandir(REPORT_CACHE_DIR):
+        if entry.is_file() and entry.stat().st_mtime < cutoff:
+            os.remove(entry.path)
+            removed += 1
+    return removed
+
+def get_pdf_report(df, total_row, portfolio_name, report_date=None, analytics=None, rebalance=None):
+    report_date = report_date or date.today()
+    key = report_cache_key(df, total_row, portfolio_name, report_date, analytics, rebalance)
+    pdf_bytes = load_cached_report(key)
+    if pdf_bytes is None:
+        pdf_bytes = create_pdf_report(df, total_row, portfolio_name, report_date, analytics, rebalance).getvalue()
+        store_cached_report(key, pdf_bytes)
+    return pdf_bytes
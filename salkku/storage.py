@@ -0,0 +1,355 @@
+"""Users, portfolios and assets, and the saved portfolio value history."""
+
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import date
+
+import pandas as pd
+
+from .columnar import columnar_watermark, read_columnar
+from .config import ASSET_FIELDS
+from .metrics import count, timed
+from .db import db_connection
+
+def hash_password(password):
+    return hashlib.sha256(password.encode()).hexdigest()
+
+def register_user(username, password):
+    hashed_password = hash_password(password)
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("INSERT INTO users (username, password_hash) VALUES (?, ?)", (username, hashed_password))
+            conn.commit()
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+def login_user(username, password):
+    hashed_password = hash_password(password)
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM users WHERE username = ? AND password_hash = ?", (username, hashed_password))
+        user = cursor.fetchone()
+        if user:
+            return user[0]
+        return None
+
+class Asset:
+    __slots__ = ('id',) + ASSET_FIELDS
+
+    def __init__(self, *values):
+        for field, value in zip(self.__slots__, values):
+            setattr(self, field, value)
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    def __repr__(self):
+        return f"Asset({self.to_dict()!r})"
+
+class PortfolioCache:
+    def __init__(self, max_users=256):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._epoch = 0
+        self.max_users = max_users
+
+    def generation(self, user_id):
+        with self._lock:
+            return (self._epoch, self._generations.get(user_id, 0))
+
+    def get(self, user_id):
+        with self._lock:
+            portfolios = self._entries.get(user_id)
+            if portfolios is not None:
+                self._entries.move_to_end(user_id)
+            return portfolios
+
+    def put(self, user_id, portfolios, generation):
+        with self._lock:
+            # A write that happened while the rows were being read makes them stale, so drop them.
+            if (self._epoch, self._generations.get(user_id, 0)) != generation:
+                return
+            self._entries[user_id] = portfolios
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+
+_portfolio_cache = PortfolioCache()
+
+def get_portfolio_cache():
+    return _portfolio_cache
+
+@timed()
+def load_portfolios(user_id):
+    cache = get_portfolio_cache()
+    portfolios = cache.get(user_id)
+    if portfolios is None:
+        generation = cache.generation(user_id)
+        portfolios = {}
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT p.id, p.name, a.id, {', '.join('a.' + field for field in ASSET_FIELDS)}
+                FROM portfolios p LEFT JOIN assets a ON a.portfolio_id = p.id
+                WHERE p.user_id = ?
+                ORDER BY p.id, a.id
+            """, (user_id,))
+            rows = cursor.fetchall()
+            count("salkku_db_rows_read_total", len(rows), function="load_portfolios")
+            loaded_ids = {}
+            for row in rows:
+                # Names are unique since migration 7; should two rows still share one, the newest wins as it always
+                # did, rather than the holdings of both being added together.
+                if loaded_ids.get(row[1]) != row[0]:
+                    loaded_ids[row[1]] = row[0]
+                    portfolios[row[1]] = []
+                if row[2] is not None:
+                    portfolios[row[1]].append(Asset(*row[2:]))
+        cache.put(user_id, portfolios, generation)
+    # Callers add and replace portfolios in the returned mapping, so they never see the cached containers.
+    return {name: list(assets) for name, assets in portfolios.items()}
+
+def _asset_row(asset):
+    return (asset['name'], asset['ticker'], asset['buy_price'], asset['shares'], asset['manual_price'], 1 if asset.get('is_manual') else 0, asset['currency'], asset['buy_currency_rate'], asset['current_currency_rate'], asset['target_percentage'], asset.get('buy_date'))
+
+@timed()
+def save_portfolios(user_id, portfolios):
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+
+        # Same order as load_portfolios, so a name maps to the portfolio the caller was shown.
+        cursor.execute("SELECT id, name FROM portfolios WHERE user_id = ? ORDER BY id", (user_id,))
+        portfolio_ids = {name: portfolio_id for portfolio_id, name in cursor.fetchall()}
+        cursor.execute(f"""
+            SELECT a.id, a.portfolio_id, {', '.join('a.' + field for field in ASSET_FIELDS)}
+            FROM assets a JOIN portfolios p ON p.id = a.portfolio_id
+            WHERE p.user_id = ?
+        """, (user_id,))
+        # Assets of a portfolio no name maps to were never shown to the caller, so they are neither kept nor deleted.
+        shown_ids = set(portfolio_ids.values())
+        stored_assets = {row[0]: (row[1], row[2:]) for row in cursor.fetchall() if row[1] in shown_ids}
+
+        removed_portfolio_ids = [(portfolio_id,) for name, portfolio_id in portfolio_ids.items() if name not in portfolios]
+        new_portfolio_names = [(name, user_id) for name in portfolios if name not in portfolio_ids]
+        if new_portfolio_names:
+            cursor.executemany("INSERT INTO portfolios (name, user_id) VALUES (?, ?)", new_portfolio_names)
+            cursor.execute("SELECT id, name FROM portfolios WHERE user_id = ? ORDER BY id", (user_id,))
+            portfolio_ids = {name: portfolio_id for portfolio_id, name in cursor.fetchall()}
+
+        inserted, updated, kept_ids = [], [], set()
+        for portfolio_name, assets in portfolios.items():
+            portfolio_id = portfolio_ids[portfolio_name]
+            for asset in assets:
+                row = _asset_row(asset)
+                asset_id = asset.get('id')
+                stored = stored_assets.get(asset_id)
+                if stored is None or asset_id in kept_ids:
+                    inserted.append(row + (portfolio_id,))
+                else:
+                    kept_ids.add(asset_id)
+                    if stored != (portfolio_id, row):
+                        updated.append(row + (portfolio_id, asset_id))
+        deleted = [(asset_id,) for asset_id in stored_assets if asset_id not in kept_ids]
+
+        if inserted:
+            cursor.executemany(f"""
+                INSERT INTO assets ({', '.join(ASSET_FIELDS)}, portfolio_id)
+                VALUES ({', '.join('?' for _ in range(len(ASSET_FIELDS) + 1))})
+            """, inserted)
+        if deleted:
+            cursor.executemany("DELETE FROM assets WHERE id = ?", deleted)
+        if updated:
+            cursor.executemany(f"""
+                UPDATE assets SET {', '.join(field + ' = ?' for field in ASSET_FIELDS)}, portfolio_id = ?
+                WHERE id = ?
+            """, updated)
+        if removed_portfolio_ids:
+            cursor.executemany("DELETE FROM portfolios WHERE id = ?", removed_portfolio_ids)
+        conn.commit()
+    count("salkku_db_rows_written_total", len(inserted) + len(updated) + len(deleted) + len(new_portfolio_names) + len(removed_portfolio_ids), function="save_portfolios")
+    get_portfolio_cache().invalidate(user_id)
+
+@timed()
+def save_asset_changes(user_id, portfolio_id, changed_assets, deleted_ids=()):
+    """Writes only the given rows of the editor's portfolio: assets without an id are inserted, the rest updated if
+    they differ from storage."""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("SELECT 1 FROM portfolios WHERE id = ? AND user_id = ?", (portfolio_id, user_id))
+        if cursor.fetchone() is None:
+            conn.rollback()
+            return False
+        # Ids coming from the editor are only trusted if they belong to this portfolio; an id of any other
+        # portfolio is inserted as a new row here, never updated there.
+        cursor.execute(f"SELECT id, {', '.join(ASSET_FIELDS)} FROM assets WHERE portfolio_id = ?", (portfolio_id,))
+        stored_assets = {row[0]: row[1:] for row in cursor.fetchall()}
+
+        inserted, updated = [], []
+        for asset in changed_assets:
+            row = _asset_row(asset)
+            asset_id = asset.get('id')
+            if asset_id not in stored_assets:
+                inserted.append(row + (portfolio_id,))
+            elif stored_assets[asset_id] != row:
+                updated.append(row + (asset_id,))
+        deleted = [(asset_id,) for asset_id in deleted_ids if asset_id in stored_assets]
+
+        if inserted:
+            cursor.executemany(f"""
+                INSERT INTO assets ({', '.join(ASSET_FIELDS)}, portfolio_id)
+                VALUES ({', '.join('?' for _ in range(len(ASSET_FIELDS) + 1))})
+            """, inserted)
+        if updated:
+            cursor.executemany(f"UPDATE assets SET {', '.join(field + ' = ?' for field in ASSET_FIELDS)} WHERE id = ?", updated)
+        if deleted:
+            cursor.executemany("DELETE FROM assets WHERE id = ?", deleted)
+        conn.commit()
+    count("salkku_db_rows_written_total", len(inserted) + len(updated) + len(deleted), function="save_asset_changes")
+    get_portfolio_cache().invalidate(user_id)
+    return True
+
+def get_portfolio_id(portfolio_name, user_id):
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM portfolios WHERE name = ? AND user_id = ?", (portfolio_name, user_id))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+def load_portfolio_ids(user_id):
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT name, id FROM portfolios WHERE user_id = ? ORDER BY id", (user_id,))
+        return dict(cursor.fetchall())
+
+def delete_portfolio(portfolio_name, user_id):
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        # Assets and saved history go with the portfolio through ON DELETE CASCADE.
+        cursor.execute("DELETE FROM portfolios WHERE name = ? AND user_id = ?", (portfolio_name, user_id))
+        if cursor.rowcount:
+            conn.commit()
+            get_portfolio_cache().invalidate(user_id)
+            return True
+        return False
+
+@timed()
+def save_portfolio_value(portfolio_id, total_value):
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        today = date.today().isoformat()
+        try:
+            cursor.execute("""
+                INSERT INTO portfolio_history (portfolio_id, record_date, total_value)
+                VALUES (?, ?, ?)
+            """, (portfolio_id, today, total_value))
+            cursor.execute("SELECT user_id FROM portfolios WHERE id = ?", (portfolio_id,))
+            owner = cursor.fetchone()
+            conn.commit()
+        except sqlite3.IntegrityError:
+            return False
+    if owner:
+        get_portfolio_cache().invalidate(owner[0])
+    return True
+
+@timed()
+def load_portfolio_history(portfolio_id, start=None, end=None):
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        # Both bounds are always given so the lookup is a range scan on the (portfolio_id, record_date) index.
+        cursor.execute("""
+            SELECT record_date, total_value FROM portfolio_history
+            WHERE portfolio_id = ? AND record_date >= ? AND record_date <= ?
+            ORDER BY record_date ASC
+        """, (portfolio_id, start or "0000-00-00", end or "9999-99-99"))
+        history = cursor.fetchall()
+    count("salkku_db_rows_read_total", len(history), function="load_portfolio_history")
+    return pd.DataFrame(history, columns=['Päivämäärä', 'Arvo'])
+
+@timed()
+def load_combined_history(portfolio_ids, start=None, end=None, columnar_root=None):
+    """Summed saved value of several portfolios per date; each carries its latest saved value forward between snapshots.
+
+    When portfolio_history has been exported (see salkku.columnar), dates up to the export's watermark are read from
+    the Arrow files and only later dates from SQLite.
+    """
+    portfolio_ids = list(portfolio_ids)
+    if not portfolio_ids:
+        return pd.DataFrame([], columns=['Päivämäärä', 'Arvo'])
+    exported_until = columnar_watermark("portfolio_history", columnar_root)
+    if exported_until is not None and start is not None and start > exported_until:
+        exported_until = None
+    exported_from = start
+    start = start or "0000-00-00"
+    placeholders = ', '.join('?' for _ in portfolio_ids)
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT portfolio_id, record_date, total_value FROM portfolio_history
+            WHERE portfolio_id IN ({placeholders}) AND record_date {'>' if exported_until else '>='} ? AND record_date <= ?
+        """, (*portfolio_ids, exported_until or start, end or "9999-99-99"))
+        history = cursor.fetchall()
+        # The last value before the window opens the window, so portfolios saved on different days add up from its first date.
+        # A MIN or MAX per portfolio in a correlated subquery is one index seek; under GROUP BY it scans every row.
+        cursor.execute(f"""
+            SELECT h.portfolio_id, h.record_date, h.total_value
+            FROM portfolios p JOIN portfolio_history h ON h.portfolio_id = p.id AND h.record_date = (
+                SELECT MAX(record_date) FROM portfolio_history WHERE portfolio_id = p.id AND record_date < ?
+            )
+            WHERE p.id IN ({placeholders})
+        """, (start, *portfolio_ids))
+        carried = cursor.fetchall()
+        if exported_until:
+            # An id freed by a deleted portfolio can be reused, so exported rows older than the portfolio's own
+            # history in SQLite belong to the deleted one.
+            cursor.execute(f"""
+                SELECT p.id, (SELECT MIN(record_date) FROM portfolio_history WHERE portfolio_id = p.id)
+                FROM portfolios p WHERE p.id IN ({placeholders})
+            """, portfolio_ids)
+            first_saved = dict(cursor.fetchall())
+    count("salkku_db_rows_read_total", len(history) + len(carried), function="load_combined_history")
+    frame = pd.DataFrame(history, columns=['portfolio_id', 'Päivämäärä', 'Arvo']).astype({'portfolio_id': 'int64', 'Arvo': 'float64'})
+    frame['Päivämäärä'] = pd.to_datetime(frame['Päivämäärä'], format='%Y-%m-%d')
+    if exported_until:
+        exported = read_columnar("portfolio_history", exported_from, min(end or exported_until, exported_until), portfolio_ids,
+                                 root=columnar_root)
+        first_dates = pd.to_datetime(pd.Series(first_saved, dtype=object), format='%Y-%m-%d')
+        exported = exported[(exported['record_date'] >= exported['portfolio_id'].map(first_dates)).to_numpy()]
+        exported = exported.rename(columns={'record_date': 'Päivämäärä', 'total_value': 'Arvo'})[frame.columns]
+        frame = pd.concat([exported, frame], ignore_index=True)
+    if frame.empty:
+        return pd.DataFrame([], columns=['Päivämäärä', 'Arvo'])
+    first_date = frame['Päivämäärä'].min()
+    frame = pd.concat([pd.DataFrame({'portfolio_id': [row[0] for row in carried], 'Päivämäärä': first_date, 'Arvo': [row[2] for row in carried]}),
+                       frame], ignore_index=True)
+    values = (frame.drop_duplicates(['Päivämäärä', 'portfolio_id'], keep='last')
+              .pivot(index='Päivämäärä', columns='portfolio_id', values='Arvo').sort_index().ffill())
+    return pd.DataFrame({'Päivämäärä': values.index, 'Arvo': values.sum(axis=1).to_numpy()})
+
+def load_portfolio_owners():
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT p.id, u.username, p.name FROM portfolios p JOIN users u ON u.id = p.user_id")
+        return {portfolio_id: (username, name) for portfolio_id, username, name in cursor.fetchall()}
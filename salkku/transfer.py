@@ -0,0 +1,170 @@
+"""Streaming CSV and Parquet import and export of holdings."""
+
+import csv
+from io import BytesIO, TextIOWrapper
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+
+from .config import ASSET_COLUMN_TYPES, ASSET_FIELDS, ASSET_NEW_ROW, IMPORT_CHUNK_SIZE, IMPORT_ERROR_LIMIT, IMPORT_REQUIRED_COLUMNS
+from .metrics import count, timed
+from .db import db_connection
+from .storage import get_portfolio_cache
+
+def read_asset_chunks(source, file_format, chunk_size=IMPORT_CHUNK_SIZE):
+    if file_format == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        # Arrow errors surface as ValueError like the CSV parser's, so callers handle one exception type.
+        try:
+            parquet = pq.ParquetFile(source)
+            columns = [column for column in parquet.schema_arrow.names if column.strip().lower() in ASSET_FIELDS]
+            batches = parquet.iter_batches(batch_size=chunk_size, columns=columns)
+            for batch in batches:
+                yield batch.to_pandas()
+        except pa.ArrowException as error:
+            raise ValueError(f"Virheellinen Parquet-tiedosto: {error}") from error
+    else:
+        # Broker exports use both ',' and ';', so the delimiter is sniffed from the start of the file.
+        sample = source.read(8192)
+        source.seek(0)
+        if isinstance(sample, bytes):
+            sample = sample.decode("utf-8-sig", errors="ignore")
+        try:
+            delimiter = csv.Sniffer().sniff(sample, delimiters=",;\t").delimiter
+        except csv.Error:
+            delimiter = ","
+        yield from pd.read_csv(source, sep=delimiter, dtype=str, keep_default_na=False, encoding="utf-8-sig", chunksize=chunk_size)
+
+def _import_numbers(values):
+    if values.dtype == object or pd.api.types.is_string_dtype(values):
+        values = values.astype(str).str.strip().str.replace(" ", "").str.replace(",", ".")
+    return pd.to_numeric(values, errors="coerce")
+
+def validate_asset_chunk(chunk, first_row=0):
+    """Returns (rows ready for INSERT without portfolio_id, list of (row number, reason)) for one chunk."""
+    frame = chunk.rename(columns=lambda column: str(column).strip().lower())
+    missing = [column for column in IMPORT_REQUIRED_COLUMNS if column not in frame]
+    if missing:
+        raise ValueError(f"Tiedostosta puuttuu sarakkeita: {', '.join(missing)}")
+    frame = frame.reset_index(drop=True)
+
+    def column(field):
+        if field in frame:
+            return frame[field]
+        return pd.Series([ASSET_NEW_ROW[field]] * len(frame), dtype=object)
+
+    name = column('name').astype("string").str.strip()
+    ticker = column('ticker').fillna("").astype("string").str.strip().str.upper()
+    currency = column('currency').fillna("").astype("string").str.strip().str.upper().replace("", ASSET_NEW_ROW['currency'])
+    is_manual = column('is_manual').astype("string").str.strip().str.lower().isin(["1", "1.0", "true", "kyllä", "k", "yes", "x"])
+    numbers = {field: _import_numbers(column(field)) for field in ('buy_price', 'shares', 'manual_price', 'buy_currency_rate', 'current_currency_rate', 'target_percentage')}
+    for field in ('buy_currency_rate', 'current_currency_rate', 'target_percentage'):
+        numbers[field] = numbers[field].fillna(ASSET_NEW_ROW[field])
+    raw_dates = column('buy_date').fillna("").astype("string").str.strip()
+    raw_dates = raw_dates.replace("", None)
+    # ISO dates first; dayfirst parsing would read 2024-05-02 as 5 February.
+    buy_date = pd.to_datetime(raw_dates.str.slice(0, 10), errors="coerce", format="%Y-%m-%d")
+    buy_date = buy_date.fillna(pd.to_datetime(raw_dates.where(buy_date.isna()), errors="coerce", format="%d.%m.%Y"))
+
+    checks = [
+        (name.isna() | (name == ""), "nimi puuttuu"),
+        (~(numbers['buy_price'] > 0), "ostohinta puuttuu tai ei ole positiivinen"),
+        (~(numbers['shares'] > 0), "osuuksien määrä puuttuu tai ei ole positiivinen"),
+        (~is_manual & (ticker == ""), "symboli puuttuu"),
+        (is_manual & ~(numbers['manual_price'] > 0), "manuaaliselta kohteelta puuttuu hinta"),
+        (~currency.str.fullmatch(r"[A-Z]{3}").fillna(False), "tuntematon valuutta"),
+        (~((numbers['buy_currency_rate'] > 0) & (numbers['current_currency_rate'] > 0)), "valuuttakurssi ei ole positiivinen"),
+        (~numbers['target_percentage'].between(0, 100), "tavoiteosuus ei ole välillä 0–100"),
+        (raw_dates.notna() & buy_date.isna(), "virheellinen ostopäivä"),
+    ]
+    reasons = np.select([mask.to_numpy(dtype=bool) for mask, _ in checks], [reason for _, reason in checks], default="")
+    valid = reasons == ""
+    errors = [(first_row + int(position) + 1, str(reasons[position])) for position in np.flatnonzero(~valid)]
+
+    manual_price = numbers['manual_price'].where(is_manual)
+    columns = {
+        'name': name, 'ticker': ticker, 'buy_price': numbers['buy_price'], 'shares': numbers['shares'],
+        'manual_price': manual_price, 'is_manual': is_manual.astype(int), 'currency': currency,
+        'buy_currency_rate': numbers['buy_currency_rate'], 'current_currency_rate': numbers['current_currency_rate'],
+        'target_percentage': numbers['target_percentage'], 'buy_date': buy_date.dt.strftime("%Y-%m-%d"),
+    }
+    # NaN and pd.NA become NULL; sqlite3 only accepts plain Python values.
+    values = [columns[field][valid].astype(object).where(columns[field][valid].notna(), None).tolist() for field in ASSET_FIELDS]
+    return list(zip(*values)), errors
+
+def _validated_chunks(chunks):
+    first_row = 0
+    for chunk in chunks:
+        yield validate_asset_chunk(chunk, first_row)
+        first_row += len(chunk)
+
+@timed()
+def import_assets(user_id, portfolio_name, source, file_format="csv", chunk_size=IMPORT_CHUNK_SIZE):
+    """Appends the holdings in a CSV or Parquet file to a portfolio, creating the portfolio if needed."""
+    result = {"imported": 0, "rejected": 0, "errors": []}
+    validated = _validated_chunks(read_asset_chunks(source, file_format, chunk_size))
+    # The first chunk is read and checked before anything is written, so a file with a bad format or missing
+    # columns does not leave an empty portfolio behind.
+    first = next(validated, None)
+    if first is None:
+        return result
+    try:
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id FROM portfolios WHERE name = ? AND user_id = ?", (portfolio_name, user_id))
+            row = cursor.fetchone()
+            if row is None:
+                cursor.execute("INSERT INTO portfolios (name, user_id) VALUES (?, ?)", (portfolio_name, user_id))
+                conn.commit()
+                portfolio_id = cursor.lastrowid
+            else:
+                portfolio_id = row[0]
+            # Each chunk is validated and committed on its own, so memory use does not grow with the file.
+            for rows, errors in chain([first], validated):
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.executemany(f"""
+                    INSERT INTO assets ({', '.join(ASSET_FIELDS)}, portfolio_id)
+                    VALUES ({', '.join('?' for _ in range(len(ASSET_FIELDS) + 1))})
+                """, [row + (portfolio_id,) for row in rows])
+                conn.commit()
+                count("salkku_db_rows_written_total", len(rows), function="import_assets")
+                result["imported"] += len(rows)
+                result["rejected"] += len(errors)
+                result["errors"].extend(errors[:IMPORT_ERROR_LIMIT - len(result["errors"])])
+    finally:
+        # Chunks committed before a failure stay in the database, so the cache is dropped either way.
+        get_portfolio_cache().invalidate(user_id)
+    return result
+
+@timed()
+def export_assets(user_id, portfolio_name, file_format="csv", chunk_size=IMPORT_CHUNK_SIZE):
+    """Streams a portfolio's holdings from the cursor into CSV or Parquet bytes in chunks."""
+    buffer = BytesIO()
+    with db_connection() as conn:
+        cursor = conn.execute(f"""
+            SELECT {', '.join('a.' + field for field in ASSET_FIELDS)}
+            FROM assets a JOIN portfolios p ON p.id = a.portfolio_id
+            WHERE p.user_id = ? AND p.name = ?
+            ORDER BY a.id
+        """, (user_id, portfolio_name))
+        if file_format == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            schema = pa.schema([(field, pa.bool_() if field == 'is_manual' else pa.float64() if ASSET_COLUMN_TYPES[field] == 'REAL' else pa.string()) for field in ASSET_FIELDS])
+            is_manual = ASSET_FIELDS.index('is_manual')
+            with pq.ParquetWriter(buffer, schema) as writer:
+                while rows := cursor.fetchmany(chunk_size):
+                    columns = [list(values) for values in zip(*rows)]
+                    columns[is_manual] = [bool(value) for value in columns[is_manual]]
+                    writer.write_batch(pa.RecordBatch.from_arrays([pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema))
+        else:
+            text = TextIOWrapper(buffer, encoding="utf-8", newline="")
+            writer = csv.writer(text)
+            writer.writerow(ASSET_FIELDS)
+            while rows := cursor.fetchmany(chunk_size):
+                writer.writerows(rows)
+            text.flush()
+            text.detach()
+    return buffer.getvalue()
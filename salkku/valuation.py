@@ -0,0 +1,150 @@
+"""Vectorized portfolio valuation."""
+
+import hashlib
+import json
+
+import numpy as np
+import pandas as pd
+
+from .config import ASSET_FIELDS
+from .metrics import timed
+
+ASSET_DEFAULTS = {"name": "Nimetön", "ticker": "Tuntematon", "currency": "EUR", "buy_currency_rate": 1.0, "current_currency_rate": 1.0, "target_percentage": 0.0}
+WEIGHT_COLUMNS = ["Osuus salkusta (%)", "Poikkeama (%)", "Poikkeama (€)"]
+TOTAL_COLUMNS = ["Alkuperäinen arvo", "Nykyinen arvo", "Tuotto (€)", "Tuotto (%)"]
+
+def apply_fx_rates(holdings, fx_rates=None, buy_fx_rates=None):
+    holdings = holdings.copy()
+    if fx_rates:
+        current_rate = holdings["currency"].map(fx_rates)
+        holdings["current_currency_rate"] = current_rate.where(current_rate.notna(), holdings["current_currency_rate"])
+    if buy_fx_rates:
+        buy_rate = pd.Series([buy_fx_rates.get(key) for key in zip(holdings["currency"], holdings["buy_date"])], index=holdings.index, dtype=float)
+        holdings["buy_currency_rate"] = buy_rate.where(buy_rate.notna(), holdings["buy_currency_rate"])
+    return holdings
+
+def holdings_frame(portfolios):
+    portfolio_ids = []
+    columns = {field: [] for field in ASSET_FIELDS}
+    for portfolio_id, assets in portfolios.items():
+        portfolio_ids.extend([portfolio_id] * len(assets))
+        for field, values in columns.items():
+            default = ASSET_DEFAULTS.get(field)
+            values.extend([asset.get(field, default) for asset in assets])
+    frame = pd.DataFrame(columns)
+    frame.insert(0, "portfolio_id", portfolio_ids)
+    return frame
+
+def _sequential_sums(values, boundaries):
+    # Running sums per group, so totals match the scalar implementation to the last bit.
+    return np.array([np.cumsum(segment)[-1] if len(segment) else 0.0 for segment in np.split(values, boundaries)])
+
+def value_holdings(holdings, current_prices):
+    prices = pd.Series(current_prices, dtype=float)
+    tickers = holdings["ticker"]
+    is_manual = holdings["is_manual"].fillna(0).astype(bool).to_numpy()
+    manual_price = pd.to_numeric(holdings["manual_price"], errors="coerce").to_numpy(dtype=float)
+    market_price = tickers.map(prices).to_numpy(dtype=float)
+    priced = np.where(is_manual, holdings["manual_price"].notna().to_numpy(), tickers.isin(prices.index).to_numpy())
+
+    rows = holdings[priced]
+    codes, portfolio_ids = pd.factorize(rows["portfolio_id"])
+    order = np.argsort(codes, kind="stable")
+    rows = rows.iloc[order].reset_index(drop=True)
+    codes = codes[order]
+    current_price = np.where(is_manual, manual_price, market_price)[priced][order]
+
+    buy_price = rows["buy_price"].to_numpy(dtype=float)
+    shares = rows["shares"].to_numpy(dtype=float)
+    original_cost = (buy_price * shares) / rows["buy_currency_rate"].to_numpy(dtype=float)
+    current_value = (current_price * shares) / rows["current_currency_rate"].to_numpy(dtype=float)
+    profit = current_value - original_cost
+    with np.errstate(divide="ignore", invalid="ignore"):
+        profit_percent = np.where(original_cost != 0, (profit / original_cost) * 100, 0)
+
+    boundaries = np.flatnonzero(np.diff(codes)) + 1
+    total_cost = _sequential_sums(original_cost, boundaries)
+    total_value = _sequential_sums(current_value, boundaries)
+    total_profit = total_value - total_cost
+    with np.errstate(divide="ignore", invalid="ignore"):
+        total_profit_percent = np.where(total_cost != 0, (total_profit / total_cost) * 100, 0)
+    totals = pd.DataFrame({
+        "Alkuperäinen arvo": total_cost,
+        "Nykyinen arvo": total_value,
+        "Tuotto (€)": total_profit,
+        "Tuotto (%)": total_profit_percent,
+    }, index=pd.Index(portfolio_ids, name="portfolio_id"))
+
+    currency = rows["currency"].tolist()
+    target = rows["target_percentage"].to_numpy(dtype=float)
+    portfolio_value = np.repeat(total_value, np.diff(np.r_[0, boundaries, len(codes)]))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        weight = (current_value / portfolio_value) * 100
+    valued = pd.DataFrame({
+        "portfolio_id": rows["portfolio_id"],
+        "currency": rows["currency"],
+        "Kohde": [f"{name} ({ticker})" for name, ticker in zip(rows["name"].tolist(), rows["ticker"].tolist())],
+        "Alkuperäinen Nimi": rows["name"],
+        "Ticker": rows["ticker"],
+        "Ostohinta": [f"{price:.2f} {code}" for price, code in zip(buy_price.tolist(), currency)],
+        "Nykyinen hinta": [f"{price:.2f} {code}" for price, code in zip(current_price.tolist(), currency)],
+        "Osuudet": rows["shares"],
+        "Alkuperäinen arvo": original_cost,
+        "Nykyinen arvo": current_value,
+        "Tuotto (€)": profit,
+        "Tuotto (%)": profit_percent,
+        "Tavoite (%)": rows["target_percentage"],
+        "Osuus salkusta (%)": weight,
+        "Poikkeama (%)": np.where(target > 0, weight - target, 0.0),
+        "Poikkeama (€)": np.where(target > 0, current_value - (target / 100 * portfolio_value), 0.0),
+    })
+    return valued, totals
+
+def _portfolio_frames(df, totals):
+    if totals is None:
+        df = pd.DataFrame([])
+        total_original_cost = total_current_value = total_profit = total_profit_percent = 0
+    else:
+        total_original_cost, total_current_value, total_profit, total_profit_percent = totals
+    total_row = pd.DataFrame({
+        "Kohde": ["Kokonaisalkku"],
+        "Tuotto (€)": [total_profit],
+        "Tuotto (%)": [total_profit_percent],
+        "Alkuperäinen arvo": [total_original_cost],
+        "Nykyinen arvo": [total_current_value],
+        "Tavoite (%)": [100.0]
+    })
+    if not total_current_value > 0:
+        for column in WEIGHT_COLUMNS:
+            df[column] = 0
+    return df, total_row
+
+@timed()
+def calculate_portfolio_metrics_batch(portfolios, current_prices, fx_rates=None, buy_fx_rates=None):
+    holdings = holdings_frame(portfolios)
+    if fx_rates or buy_fx_rates:
+        holdings = apply_fx_rates(holdings, fx_rates, buy_fx_rates)
+    valued, totals = value_holdings(holdings, current_prices)
+    # value_holdings returns the rows grouped in the same order as the totals index.
+    group_sizes = valued.groupby("portfolio_id", sort=False).size().reindex(totals.index).to_numpy()
+    bounds = np.r_[0, np.cumsum(group_sizes)]
+    metrics = valued.drop(columns=["portfolio_id", "currency"])
+    total_values = totals[TOTAL_COLUMNS].to_numpy().tolist()
+    positions = {portfolio_id: position for position, portfolio_id in enumerate(totals.index)}
+    results = {}
+    for portfolio_id in portfolios:
+        position = positions.get(portfolio_id)
+        if position is None:
+            results[portfolio_id] = _portfolio_frames(None, None)
+        else:
+            group = metrics.iloc[bounds[position]:bounds[position + 1]].reset_index(drop=True)
+            results[portfolio_id] = _portfolio_frames(group, total_values[position])
+    return results
+
+@timed()
+def calculate_portfolio_metrics(assets, current_prices, fx_rates=None, buy_fx_rates=None):
+    return calculate_portfolio_metrics_batch({0: assets}, current_prices, fx_rates, buy_fx_rates)[0]
+
+def portfolio_content_hash(assets):
+    rows = [[asset.get(field) for field in ASSET_FIELDS] for asset in assets]
+    return hashlib.sha256(json.dumps(rows, default=str).encode()).hexdigest()
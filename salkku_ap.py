@@ -1,257 +1,87 @@
 import streamlit as st
-import yfinance as yf
 import pandas as pd
-import altair as alt
 import json
-import os
-import sqlite3
-import hashlib
-from datetime import date
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib import colors
-from reportlab.lib.units import inch
-from io import BytesIO
-
-DB_FILE = "seuranta.db"
-
-def init_db():
-    with sqlite3.connect(DB_FILE) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY,
-                username TEXT NOT NULL UNIQUE,
-                password_hash TEXT NOT NULL
-            )
-        """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS portfolios (
-                id INTEGER PRIMARY KEY,
-                name TEXT NOT NULL,
-                user_id INTEGER,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS assets (
-                id INTEGER PRIMARY KEY,
-                name TEXT,
-                ticker TEXT,
-                buy_price REAL,
-                shares REAL,
-                manual_price REAL,
-                is_manual BOOLEAN,
-                currency TEXT,
-                buy_currency_rate REAL,
-                current_currency_rate REAL,
-                target_percentage REAL,
-                portfolio_id INTEGER,
-                FOREIGN KEY (portfolio_id) REFERENCES portfolios (id)
-            )
-        """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS portfolio_history (
-                id INTEGER PRIMARY KEY,
-                portfolio_id INTEGER,
-                record_date TEXT NOT NULL,
-                total_value REAL NOT NULL,
-                FOREIGN KEY (portfolio_id) REFERENCES portfolios (id),
-                UNIQUE(portfolio_id, record_date)
-            )
-        """)
-        conn.commit()
-
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
+import math
+import sys
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+
+from salkku.config import ANALYTICS_RANGES, ASSET_FIELDS, ASSET_NEW_ROW, BASE_CURRENCY, COST_METHODS, HISTORY_AGGREGATIONS, HISTORY_RANGES, IMPORT_REQUIRED_COLUMNS, LIVE_REFRESH_INTERVALS, METRICS_ENABLED, PRICE_HISTORY_YEARS, TRANSACTION_KINDS, VALUATION_SNAPSHOT_LIMIT
+from salkku.metrics import get_metrics, timed
+from salkku.db import init_db
+from salkku.storage import delete_portfolio, get_portfolio_id, load_combined_history, load_portfolio_history, load_portfolios, login_user, register_user, save_asset_changes, save_portfolio_value, save_portfolios
+from salkku.transfer import export_assets, import_assets
+from salkku.ledger import delete_transaction, load_position_summary, load_transactions, portfolio_holdings, record_transaction
+from salkku.pricing import PriceQuotes, fx_symbol, get_fx_rates, get_portfolio_fx, get_quote_cache_stats, get_stock_data, update_price_history
+from salkku.valuation import calculate_portfolio_metrics, portfolio_content_hash
+from salkku.analytics import ANALYTICS_COLUMNS, portfolio_analytics
+from salkku.live import get_price_poller
+from salkku.rebalancing import export_orders, rebalance_portfolio
+from salkku.consolidation import ConsolidatedValuation, priced_tickers, user_holdings, value_consolidated
+from salkku.history import downsample_history, reconstruct_portfolio_history
+from salkku.reporting import get_pdf_report
+from salkku.cli import run_cli
 
 def logout():
     st.session_state.logged_in = False
     st.session_state.user_id = None
     st.session_state.selected_portfolio = "Uusi salkku"
+    st.session_state.pop("viewed_portfolio", None)
+    st.session_state.pop("valuation_snapshots", None)
+    st.session_state.pop("consolidated_snapshot", None)
     st.rerun()
 
-def register_user(username, password):
-    hashed_password = hash_password(password)
-    with sqlite3.connect(DB_FILE) as conn:
-        cursor = conn.cursor()
-        try:
-            cursor.execute("INSERT INTO users (username, password_hash) VALUES (?, ?)", (username, hashed_password))
-            conn.commit()
-            return True
-        except sqlite3.IntegrityError:
-            return False
-
-def login_user(username, password):
-    hashed_password = hash_password(password)
-    with sqlite3.connect(DB_FILE) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM users WHERE username = ? AND password_hash = ?", (username, hashed_password))
-        user = cursor.fetchone()
-        if user:
-            return user[0]
-        return None
-
-def load_portfolios(user_id):
-    portfolios = {}
-    with sqlite3.connect(DB_FILE) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, name FROM portfolios WHERE user_id = ?", (user_id,))
-        for portfolio_id, portfolio_name in cursor.fetchall():
-            cursor.execute("SELECT name, ticker, buy_price, shares, manual_price, is_manual, currency, buy_currency_rate, current_currency_rate, target_percentage FROM assets WHERE portfolio_id = ?", (portfolio_id,))
-            assets = [dict(zip(['name', 'ticker', 'buy_price', 'shares', 'manual_price', 'is_manual', 'currency', 'buy_currency_rate', 'current_currency_rate', 'target_percentage'], row)) for row in cursor.fetchall()]
-            portfolios[portfolio_name] = assets
-    return portfolios
-
-def save_portfolios(user_id, portfolios):
-    with sqlite3.connect(DB_FILE) as conn:
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT id FROM portfolios WHERE user_id = ?", (user_id,))
-        old_portfolio_ids = [row[0] for row in cursor.fetchall()]
-        if old_portfolio_ids:
-            placeholders = ','.join('?' for _ in old_portfolio_ids)
-            cursor.execute(f"DELETE FROM assets WHERE portfolio_id IN ({placeholders})", old_portfolio_ids)
-        cursor.execute("DELETE FROM portfolios WHERE user_id = ?", (user_id,))
-
-        for portfolio_name, assets in portfolios.items():
-            cursor.execute("INSERT INTO portfolios (name, user_id) VALUES (?, ?)", (portfolio_name, user_id))
-            portfolio_id = cursor.lastrowid
-            
-            for asset in assets:
-                is_manual_val = 1 if asset.get('is_manual') else 0
-                cursor.execute("""
-                    INSERT INTO assets (name, ticker, buy_price, shares, manual_price, is_manual, currency, buy_currency_rate, current_currency_rate, target_percentage, portfolio_id)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (asset['name'], asset['ticker'], asset['buy_price'], asset['shares'], asset['manual_price'], is_manual_val, asset['currency'], asset['buy_currency_rate'], asset['current_currency_rate'], asset['target_percentage'], portfolio_id))
-        conn.commit()
-
-def delete_portfolio(portfolio_name, user_id):
-    with sqlite3.connect(DB_FILE) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM portfolios WHERE name = ? AND user_id = ?", (portfolio_name, user_id))
-        portfolio_id = cursor.fetchone()
-        if portfolio_id:
-            cursor.execute("DELETE FROM assets WHERE portfolio_id = ?", (portfolio_id[0],))
-            cursor.execute("DELETE FROM portfolio_history WHERE portfolio_id = ?", (portfolio_id[0],))
-            cursor.execute("DELETE FROM portfolios WHERE id = ?", (portfolio_id[0],))
-            conn.commit()
-            return True
-        return False
-
-def get_stock_data(tickers):
-    data = {}
-    if not tickers:
-        return data
-    try:
-        downloaded_data = yf.download(tickers, period="1d")
-        if 'Adj Close' in downloaded_data.columns:
-            if isinstance(downloaded_data['Adj Close'], pd.DataFrame):
-                data = downloaded_data['Adj Close'].iloc[-1].to_dict()
-            else:
-                data = downloaded_data['Adj Close'].to_dict()
-        elif 'Close' in downloaded_data.columns:
-            if isinstance(downloaded_data['Close'], pd.DataFrame):
-                data = downloaded_data['Close'].iloc[-1].to_dict()
-            else:
-                data = downloaded_data['Close'].to_dict()
-    except Exception:
-        for ticker in tickers:
-            try:
-                ticker_obj = yf.Ticker(ticker)
-                hist = ticker_obj.history(period="1d")
-                if not hist.empty:
-                    if 'Adj Close' in hist.columns:
-                        data[ticker] = hist['Adj Close'][0]
-                    elif 'Close' in hist.columns:
-                        data[ticker] = hist['Close'][0]
-                else:
-                    st.warning(f"Tyhjä historiallinen data symbolille: {ticker}")
-            except Exception:
-                pass
-    return data
-
-def calculate_portfolio_metrics(assets, current_prices):
-    portfolio_data = []
-    total_current_value = 0
-    total_original_cost = 0
-
-    for asset in assets:
-        name = asset.get("name", "Nimetön")
-        ticker = asset.get("ticker", "Tuntematon")
-        buy_price = asset.get("buy_price")
-        shares = asset.get("shares")
-        currency = asset.get("currency", "EUR")
-        buy_currency_rate = asset.get("buy_currency_rate", 1.0)
-        current_currency_rate = asset.get("current_currency_rate", 1.0)
-        target_percentage = asset.get("target_percentage", 0.0)
-        
-        current_price = None
-        if asset.get('is_manual'):
-            current_price = asset.get('manual_price')
-        elif ticker in current_prices:
-            current_price = current_prices[ticker]
-        
-        if current_price is None:
-            continue
-            
-        original_cost_eur = (buy_price * shares) / buy_currency_rate
-        current_value_eur = (current_price * shares) / current_currency_rate
-        
-        profit_eur = current_value_eur - original_cost_eur
-        profit_percent = (profit_eur / original_cost_eur) * 100 if original_cost_eur != 0 else 0
-        
-        total_original_cost += original_cost_eur
-        total_current_value += current_value_eur
-        
-        unique_id = f"{name} ({ticker})"
-        
-        portfolio_data.append({
-            "Kohde": unique_id,
-            "Alkuperäinen Nimi": name,
-            "Ticker": ticker,
-            "Ostohinta": f"{buy_price:.2f} {currency}",
-            "Nykyinen hinta": f"{current_price:.2f} {currency}",
-            "Osuudet": shares,
-            "Alkuperäinen arvo": original_cost_eur,
-            "Nykyinen arvo": current_value_eur,
-            "Tuotto (€)": profit_eur,
-            "Tuotto (%)": profit_percent,
-            "Tavoite (%)": target_percentage
-        })
-    
-    df = pd.DataFrame(portfolio_data)
-    
-    total_profit = total_current_value - total_original_cost
-    total_profit_percent = (total_profit / total_original_cost) * 100 if total_original_cost != 0 else 0
-    total_row = pd.DataFrame([{
-        "Kohde": "Kokonaisalkku",
-        "Tuotto (€)": total_profit,
-        "Tuotto (%)": total_profit_percent,
-        "Alkuperäinen arvo": total_original_cost,
-        "Nykyinen arvo": total_current_value,
-        "Tavoite (%)": 100.0
-    }])
-    
-    if total_current_value > 0:
-        df['Osuus salkusta (%)'] = (df['Nykyinen arvo'] / total_current_value) * 100
-        df['Poikkeama (%)'] = df.apply(lambda row: row['Osuus salkusta (%)'] - row['Tavoite (%)'] if row['Tavoite (%)'] > 0 else 0.0, axis=1)
-        df['Poikkeama (€)'] = df.apply(lambda row: row['Nykyinen arvo'] - (row['Tavoite (%)'] / 100 * total_current_value) if row['Tavoite (%)'] > 0 else 0.0, axis=1)
-    else:
-        df['Osuus salkusta (%)'] = 0
-        df['Poikkeama (%)'] = 0
-        df['Poikkeama (€)'] = 0
-
-    return df, total_row
-
-def display_portfolio_summary(df, total_row, portfolio_name):
+@dataclass(frozen=True)
+class ValuationSnapshot:
+    key: tuple
+    prices: PriceQuotes
+    fx_rates: dict
+    priced_at: float
+    df: pd.DataFrame
+    total_row: pd.DataFrame
+
+def get_valuation_snapshot(assets, refresh=False):
+    snapshots = st.session_state.setdefault("valuation_snapshots", {})
+    content_hash = portfolio_content_hash(assets)
+    snapshot = snapshots.get(content_hash)
+    if snapshot is not None and not refresh:
+        return snapshot
+
+    tickers = list({asset['ticker'] for asset in assets if not asset.get('is_manual') and asset.get('ticker')})
+    prices = get_stock_data(tickers)
+    fx_rates, buy_fx_rates = get_portfolio_fx(assets)
+    key = (content_hash, prices.as_of, tuple(sorted(fx_rates.items())), tuple(sorted(buy_fx_rates.items())))
+    if snapshot is not None and snapshot.key == key:
+        return snapshot
+
+    df, total_row = calculate_portfolio_metrics(assets, prices, fx_rates, buy_fx_rates)
+    snapshot = ValuationSnapshot(key, prices, fx_rates, prices.as_of, df, total_row)
+    snapshots.pop(content_hash, None)
+    snapshots[content_hash] = snapshot
+    while len(snapshots) > VALUATION_SNAPSHOT_LIMIT:
+        snapshots.pop(next(iter(snapshots)))
+    return snapshot
+
+def warn_price_failures(prices):
+    if prices.failed:
+        st.warning(f"Hintaa ei saatu haettua symboleille: {', '.join(prices.failed)}")
+    if prices.stale:
+        st.info(f"Käytetään viimeisintä tallennettua hintaa symboleille: {', '.join(prices.stale)}")
+
+@timed()
+def display_portfolio_summary(df, total_row, portfolio_name, assets=None):
     if df.empty:
         st.info("Salkku on tyhjä. Lisää sijoituskohteita muokataksesi.")
         return
         
     st.subheader(f"Yhteenveto: {portfolio_name}")
-    
+    display_valuation(df, total_row)
+    st.markdown("---")
+    display_portfolio_history(portfolio_name, assets)
+
+def display_valuation(df, total_row):
+    import altair as alt
+
     total_current_value = total_row["Nykyinen arvo"].iloc[0]
     total_profit = total_row["Tuotto (€)"].iloc[0]
     total_profit_percent = total_row["Tuotto (%)"].iloc[0]
@@ -287,7 +117,7 @@ def display_portfolio_summary(df, total_row, portfolio_name):
     
     display_df = df.rename(columns={"Alkuperäinen Nimi": "Nimi"})
     display_df = display_df[["Nimi", "Alkuperäinen arvo", "Nykyinen arvo", "Tuotto (€)", "Tuotto (%)", "Osuus salkusta (%)", "Tavoite (%)", "Poikkeama (%)", "Poikkeama (€)"]]
-    st.dataframe(display_df.style.applymap(color_profit, subset=['Tuotto (€)', 'Tuotto (%)']).applymap(color_deviation, subset=['Poikkeama (%)']).format(
+    st.dataframe(display_df.style.map(color_profit, subset=['Tuotto (€)', 'Tuotto (%)']).map(color_deviation, subset=['Poikkeama (%)']).format(
         {
             "Alkuperäinen arvo": "€ {:.2f}", 
             "Nykyinen arvo": "€ {:.2f}",
@@ -317,157 +147,324 @@ def display_portfolio_summary(df, total_row, portfolio_name):
         title="Salkun tuotto kohteittain ja kokonaisuutena"
     )
     st.altair_chart(bar_chart, use_container_width=True)
-    st.markdown("---")
-    
+
+@timed()
+def display_portfolio_history(portfolio_name, assets=None):
+    import altair as alt
+
     st.subheader("Salkun kehitys")
-    with sqlite3.connect(DB_FILE) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM portfolios WHERE name = ? AND user_id = ?", (portfolio_name, st.session_state.user_id))
-        portfolio_id = cursor.fetchone()[0]
-    
-    history_df = load_portfolio_history(portfolio_id)
+    portfolio_id = get_portfolio_id(portfolio_name, st.session_state.user_id)
+    range_col, aggregation_col = st.columns(2)
+    with range_col:
+        range_label = st.selectbox("Aikaväli", list(HISTORY_RANGES), index=list(HISTORY_RANGES).index("1 v"), key="history_range")
+    with aggregation_col:
+        aggregation_label = st.radio("Tarkkuus", list(HISTORY_AGGREGATIONS), horizontal=True, key="history_aggregation")
+    range_days = HISTORY_RANGES[range_label]
+    rule = HISTORY_AGGREGATIONS[aggregation_label]
+    start = (date.today() - timedelta(days=range_days)).isoformat() if range_days else None
+    series = []
+    saved_df = load_portfolio_history(portfolio_id, start=start)
+    if not saved_df.empty:
+        series.append(downsample_history(saved_df, rule).assign(Lähde="Tallennettu"))
+    if assets:
+        currencies = {asset.get('currency') for asset in assets} - {BASE_CURRENCY, None}
+        update_price_history([asset['ticker'] for asset in assets if not asset.get('is_manual') and asset.get('ticker')] + [fx_symbol(currency) for currency in currencies])
+        fx_rates = get_fx_rates(currencies)
+        reconstructed_df = reconstruct_portfolio_history(assets, start=start or (date.today() - timedelta(days=365 * PRICE_HISTORY_YEARS)).isoformat(), fx_rates=fx_rates)
+        if not reconstructed_df.empty:
+            series.append(downsample_history(reconstructed_df, rule).assign(Lähde="Laskettu nykyisistä omistuksista"))
+    history_df = pd.concat(series, ignore_index=True) if series else pd.DataFrame()
     if not history_df.empty:
-        history_df['Päivämäärä'] = pd.to_datetime(history_df['Päivämäärä'])
-        line_chart = alt.Chart(history_df).mark_line().encode(
-            x=alt.X('Päivämäärä', title='Päivämäärä'),
-            y=alt.Y('Arvo', title='Salkun arvo (€)'),
-            tooltip=[alt.Tooltip('Päivämäärä', format='%Y-%m-%d'), alt.Tooltip('Arvo', format='.2f')]
-        ).properties(
-            title="Salkun arvon kehitys"
+        base = alt.Chart(history_df).encode(
+            x=alt.X('Päivämäärä:T', title='Päivämäärä'),
+            color=alt.Color('Lähde:N', title='Lähde')
+        )
+        line_chart = base.mark_line().encode(
+            y=alt.Y('Arvo:Q', title='Salkun arvo (€)'),
+            tooltip=['Lähde', alt.Tooltip('Päivämäärä:T', format='%Y-%m-%d'), alt.Tooltip('Arvo:Q', format='.2f')]
         )
-        st.altair_chart(line_chart, use_container_width=True)
+        if rule:
+            # Aggregated views carry the period's high and low as a band behind the closing value.
+            band = base.mark_area(opacity=0.2).encode(y='Matalin:Q', y2='Korkein:Q')
+            line_chart = band + line_chart
+        st.altair_chart(line_chart.properties(title="Salkun arvon kehitys"), use_container_width=True)
     else:
         st.info("Ei tallennettuja historiatietoja. Tallenna salkun arvo aloittaaksesi seurannan.")
 
+LIVE_FIRST_QUOTE_TIMEOUT = 10.0
 
-def create_pdf_report(df, total_row, portfolio_name):
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter)
-    elements = []
-    
-    today = date.today().strftime("%d.%m.%Y")
-    
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle(
-        'TitleStyle',
-        parent=styles['Title'],
-        fontSize=16,
-        leading=20
-    )
-    heading2_style = ParagraphStyle(
-        'Heading2Style',
-        parent=styles['h2'],
-        fontSize=12,
-        leading=15
-    )
-    normal_style = ParagraphStyle(
-        'NormalStyle',
-        parent=styles['Normal'],
-        fontSize=10,
-        leading=12
+def _live_valuation(holdings, buy_fx_rates, poller):
+    # Each fragment run is a heartbeat; when the browser stops running them the poller pauses.
+    poller.heartbeat()
+    if not poller.wait_ready(timeout=LIVE_FIRST_QUOTE_TIMEOUT):
+        st.info("Haetaan hintoja...")
+        return
+    prices, fx_rates, _, updated_at = poller.latest()
+    if poller.error is not None:
+        st.warning(f"Hintojen päivitys epäonnistui, näytetään edelliset hinnat: {poller.error}")
+    warn_price_failures(prices)
+    st.caption(f"Live: hinnat päivitetty {datetime.fromtimestamp(updated_at).strftime('%H:%M:%S')}, päivitys {poller.interval} s välein.")
+    df, total_row = calculate_portfolio_metrics(holdings, prices, fx_rates, buy_fx_rates)
+    display_valuation(df, total_row)
+
+def display_live_valuation(holdings, interval):
+    """Renders the price-dependent part of the summary as a fragment that reruns on its own every `interval` seconds."""
+    tickers = [asset['ticker'] for asset in holdings if not asset.get('is_manual') and asset.get('ticker')]
+    poller = get_price_poller(tickers, {asset.get('currency') for asset in holdings}, interval)
+    # Purchase-date rates do not move, so they are looked up once per full run rather than on every refresh.
+    _, buy_fx_rates = get_portfolio_fx(holdings)
+    st.fragment(run_every=interval)(_live_valuation)(holdings, buy_fx_rates, poller)
+
+ANALYTICS_HEATMAP_LIMIT = 40
+
+def get_portfolio_analytics(portfolio_id, assets, holdings, years):
+    update_price_history([asset['ticker'] for asset in holdings if not asset.get('is_manual') and asset.get('ticker')])
+    fx_rates, _ = get_portfolio_fx(holdings)
+    return portfolio_analytics(portfolio_id, assets, years, fx_rates=fx_rates)
+
+@timed()
+def display_portfolio_analytics(analytics):
+    import altair as alt
+
+    if analytics.summary.empty:
+        st.info("Hintahistoriaa ei löytynyt. Analytiikka lasketaan markkinahintaisille kohteille tallennetusta hintahistoriasta.")
+        return
+    st.caption(f"Jakso {analytics.start.strftime('%d.%m.%Y')}–{analytics.as_of.strftime('%d.%m.%Y')}, päivittäiset päätöskurssit. Salkun tuotto on aikapainotettu, joten ostot ja myynnit eivät vaikuta siihen.")
+    portfolio = analytics.summary.iloc[0]
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Aikapainotettu tuotto", f"{portfolio['Tuotto (%)']:.2f} %", delta=f"{portfolio['Vuosituotto (%)']:.2f} % / v")
+    col2.metric("Volatiliteetti", f"{portfolio['Volatiliteetti (%)']:.2f} %")
+    col3.metric("Suurin pudotus", f"{portfolio['Suurin pudotus (%)']:.2f} %")
+    col4.metric("Sharpen luku", f"{portfolio['Sharpe']:.2f}")
+
+    index_chart = alt.Chart(analytics.values).mark_line().encode(
+        x=alt.X('Päivämäärä:T', title='Päivämäärä'),
+        y=alt.Y('Tuottoindeksi:Q', title='Tuottoindeksi (alku = 100)', scale=alt.Scale(zero=False)),
+        tooltip=[alt.Tooltip('Päivämäärä:T', format='%Y-%m-%d'), alt.Tooltip('Tuottoindeksi:Q', format='.2f')]
+    ).properties(title="Aikapainotettu tuottoindeksi")
+    st.altair_chart(index_chart, use_container_width=True)
+
+    st.subheader("Kohteittain")
+    st.dataframe(analytics.summary.drop(columns="Ticker").style.format({column: "{:.2f}" if column == "Sharpe" else "{:.2f} %" for column in ANALYTICS_COLUMNS}, na_rep="-"),
+                 hide_index=True, use_container_width=True)
+
+    if len(analytics.correlation) > 1:
+        st.subheader("Tuottojen korrelaatiot")
+        correlation = analytics.correlation.iloc[:ANALYTICS_HEATMAP_LIMIT, :ANALYTICS_HEATMAP_LIMIT]
+        if len(analytics.correlation) > ANALYTICS_HEATMAP_LIMIT:
+            st.caption(f"Näytetään {ANALYTICS_HEATMAP_LIMIT} ensimmäistä symbolia {len(analytics.correlation)}:stä.")
+        cells = correlation.rename_axis("Symboli").reset_index().melt(id_vars="Symboli", var_name="Verrokki", value_name="Korrelaatio")
+        heatmap = alt.Chart(cells).mark_rect().encode(
+            x=alt.X('Verrokki:N', title=None),
+            y=alt.Y('Symboli:N', title=None),
+            color=alt.Color('Korrelaatio:Q', scale=alt.Scale(scheme='redblue', domain=[-1, 1], reverse=True)),
+            tooltip=['Symboli', 'Verrokki', alt.Tooltip('Korrelaatio:Q', format='.2f')]
+        )
+        st.altair_chart(heatmap, use_container_width=True)
+
+def get_rebalance_plan(holdings):
+    snapshot = get_valuation_snapshot(holdings)
+    return rebalance_portfolio(
+        holdings, snapshot.prices, snapshot.fx_rates,
+        cash=st.session_state.get("rebalance_cash", 0.0),
+        whole_shares=st.session_state.get("rebalance_whole_shares", True),
+        min_trade=st.session_state.get("rebalance_min_trade", 0.0),
+        allow_sell=st.session_state.get("rebalance_allow_sell", True),
     )
 
-    elements.append(Paragraph(f"Salkun '{portfolio_name}' raportti - {today}", title_style))
-    elements.append(Spacer(1, 0.2 * inch))
-    elements.append(Paragraph("Sijoituskohteiden erittely", heading2_style))
-    
-    raportti_df = df.rename(columns={"Alkuperäinen Nimi": "Nimi"})
-    raportti_df = raportti_df[["Nimi", "Alkuperäinen arvo", "Nykyinen arvo", "Tuotto (€)", "Tuotto (%)", "Osuus salkusta (%)", "Tavoite (%)", "Poikkeama (%)", "Poikkeama (€)"]]
-    
-    table_data = [[Paragraph(col, normal_style) for col in raportti_df.columns.tolist()]]
-    for _, row in raportti_df.iterrows():
-        row_list = []
-        for col in raportti_df.columns.tolist():
-            val = row[col]
-            if col == 'Nimi':
-                 row_list.append(Paragraph(str(val), normal_style))
-            elif col in ['Alkuperäinen arvo', 'Nykyinen arvo']:
-                row_list.append(Paragraph(f"{val:.2f}", normal_style))
-            elif col == 'Osuus salkusta (%)':
-                row_list.append(Paragraph(f"{val:.2f} %", normal_style))
-            elif col == 'Tavoite (%)':
-                row_list.append(Paragraph(f"{val:.2f} %", normal_style) if not pd.isna(val) else Paragraph("-", normal_style))
-            elif col in ['Tuotto (€)', 'Tuotto (%)']:
-                color = 'green' if val >= 0 else 'red'
-                if col == 'Tuotto (%)':
-                    text = f"{val:.2f} %"
-                else:
-                    text = f"{val:.2f}"
-                row_list.append(Paragraph(f'<font color="{color}">{text}</font>', normal_style))
-            elif col == 'Poikkeama (%)':
-                if isinstance(val, (int, float)):
-                    color = 'red' if abs(val) > 5.0 else 'black'
-                    text = f"{val:.2f} %"
-                    row_list.append(Paragraph(f'<font color="{color}">{text}</font>', normal_style))
-                else:
-                    row_list.append(Paragraph("-", normal_style))
-            elif col == 'Poikkeama (€)':
-                if isinstance(val, (int, float)):
-                    text = f"{val:.2f}"
-                    row_list.append(Paragraph(f'{text}', normal_style))
-                else:
-                    row_list.append(Paragraph("-", normal_style))
-        table_data.append(row_list)
-        
-    total_original_cost = total_row["Alkuperäinen arvo"].iloc[0]
-    total_current_value = total_row["Nykyinen arvo"].iloc[0]
-    total_profit = total_row["Tuotto (€)"].iloc[0]
-    total_profit_percent = total_row["Tuotto (%)"].iloc[0]
+def display_rebalance_plan(plan, portfolio_name):
+    totals = plan.summary.iloc[0]
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Ostot", f"{totals['Ostot (€)']:.2f} €")
+    col2.metric("Myynnit", f"{totals['Myynnit (€)']:.2f} €")
+    col3.metric("Käteistä jäljellä", f"{totals['Käteistä jäljellä (€)']:.2f} €")
+    st.caption(f"Poikkeama tavoitteista {totals['Poikkeama ennen (%)']:.2f} → {totals['Poikkeama jälkeen (%)']:.2f} prosenttiyksikköä (tavoitteellisten kohteiden itseisarvojen summa).")
+    if plan.orders.empty:
+        st.info("Ei toimeksiantoja näillä asetuksilla.")
+        return
+    st.dataframe(plan.orders.style.format({
+        "Kpl": "{:.2f}",
+        "Hinta": "{:.2f}",
+        "Arvo (€)": "€ {:.2f}",
+        "Osuus ennen (%)": "{:.2f} %",
+        "Osuus jälkeen (%)": "{:.2f} %",
+        "Tavoite (%)": "{:.2f} %",
+    }, na_rep="-"), hide_index=True, use_container_width=True)
+    export_col1, export_col2 = st.columns(2)
+    with export_col1:
+        st.download_button("Lataa toimeksiannot (CSV)", data=lambda: export_orders(plan.orders, "csv"), file_name=f"{portfolio_name}_toimeksiannot.csv", mime="text/csv")
+    with export_col2:
+        st.download_button("Lataa toimeksiannot (Parquet)", data=lambda: export_orders(plan.orders, "parquet"), file_name=f"{portfolio_name}_toimeksiannot.parquet", mime="application/vnd.apache.parquet")
+
+ALL_PORTFOLIOS = "Kaikki salkut"
+
+@dataclass(frozen=True)
+class ConsolidatedSnapshot:
+    key: tuple
+    prices: PriceQuotes
+    priced_at: float
+    valuation: ConsolidatedValuation
+
+def get_consolidated_snapshot(portfolios, refresh=False):
+    content_key = tuple((name, portfolio_content_hash(assets)) for name, assets in portfolios.items())
+    snapshot = st.session_state.get("consolidated_snapshot")
+    if snapshot is not None and snapshot.key[0] == content_key and not refresh:
+        return snapshot
+
+    # One quote and FX round-trip for the union of all portfolios' tickers and currencies.
+    prices = get_stock_data(priced_tickers(portfolios))
+    fx_rates, buy_fx_rates = get_portfolio_fx([asset for assets in portfolios.values() for asset in assets])
+    key = (content_key, prices.as_of, tuple(sorted(fx_rates.items())), tuple(sorted(buy_fx_rates.items())))
+    if snapshot is not None and snapshot.key == key:
+        return snapshot
+
+    snapshot = ConsolidatedSnapshot(key, prices, prices.as_of, value_consolidated(portfolios, prices, fx_rates, buy_fx_rates))
+    st.session_state.consolidated_snapshot = snapshot
+    return snapshot
+
+@timed()
+def display_consolidated_dashboard(user_id, cost_method):
+    import altair as alt
+
+    st.subheader("Kaikki salkut")
+    portfolios, portfolio_ids = user_holdings(user_id, cost_method)
+    if not any(portfolios.values()):
+        st.info("Salkuissa ei ole vielä sijoituskohteita.")
+        return
 
-    total_row_data = [
-        Paragraph("Kokonaisalkku", normal_style),
-        Paragraph(f"{total_original_cost:.2f}", normal_style),
-        Paragraph(f"{total_current_value:.2f}", normal_style),
-        Paragraph(f'<font color="{("green" if total_profit >= 0 else "red")}">{total_profit:.2f}</font>', normal_style),
-        Paragraph(f'<font color="{("green" if total_profit_percent >= 0 else "red")}">{total_profit_percent:.2f} %</font>', normal_style),
-        Paragraph("100.00 %", normal_style),
-        Paragraph("-", normal_style),
-        Paragraph("-", normal_style),
-        Paragraph("-", normal_style)
-    ]
-    table_data.append(total_row_data)
-    
-    table_style = TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('BOX', (0, 0), (-1, -1), 1, colors.black),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('LEFTPADDING', (0, 0), (-1, -1), 2),
-        ('RIGHTPADDING', (0, 0), (-1, -1), 2),
-        ('BACKGROUND', (0, -1), (-1, -1), colors.lightgrey),
-        ('FONT', (0, -1), (-1, -1), 'Helvetica-Bold'),
-    ])
-
-    table = Table(table_data)
-    table.setStyle(table_style)
-    elements.append(table)
-    elements.append(Spacer(1, 0.2 * inch))
-    
-    doc.build(elements)
-    buffer.seek(0)
-    return buffer
-
-def save_portfolio_value(portfolio_id, total_value):
-    with sqlite3.connect(DB_FILE) as conn:
-        cursor = conn.cursor()
-        today = date.today().isoformat()
-        try:
-            cursor.execute("""
-                INSERT INTO portfolio_history (portfolio_id, record_date, total_value)
-                VALUES (?, ?, ?)
-            """, (portfolio_id, today, total_value))
-            conn.commit()
-            return True
-        except sqlite3.IntegrityError:
-            return False
-
-def load_portfolio_history(portfolio_id):
-    with sqlite3.connect(DB_FILE) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT record_date, total_value FROM portfolio_history WHERE portfolio_id = ? ORDER BY record_date ASC", (portfolio_id,))
-        history = cursor.fetchall()
-        return pd.DataFrame(history, columns=['Päivämäärä', 'Arvo'])
+    snapshot = get_consolidated_snapshot(portfolios, refresh=st.button("Päivitä hinnat"))
+    valuation = snapshot.valuation
+    warn_price_failures(snapshot.prices)
+    st.caption(f"Hinnat haettu {datetime.fromtimestamp(snapshot.priced_at).strftime('%d.%m.%Y %H:%M')}")
+    total = valuation.total_row.iloc[0]
+    st.metric(label="Salkkujen yhteisarvo", value=f"{total['Nykyinen arvo']:.2f} €", delta=f"{total['Tuotto (€)']:.2f} € ({total['Tuotto (%)']:.2f} %)")
+
+    value_format = {
+        "Alkuperäinen arvo": "€ {:.2f}",
+        "Nykyinen arvo": "€ {:.2f}",
+        "Tuotto (€)": "€ {:.2f}",
+        "Tuotto (%)": "{:.2f} %",
+        "Osuus (%)": "{:.2f} %",
+    }
+    tab_portfolios, tab_tickers, tab_currencies, tab_history = st.tabs(["Salkut", "Kohteet", "Valuutat", "Kehitys"])
+    with tab_portfolios:
+        st.dataframe(valuation.portfolios.style.format(value_format, na_rep="-"), hide_index=True, use_container_width=True)
+    with tab_tickers:
+        st.caption("Saman symbolin omistukset kaikista salkuista yhdistettynä.")
+        st.dataframe(valuation.by_ticker.style.format(dict(value_format, Osuudet="{:.2f}"), na_rep="-"), hide_index=True, use_container_width=True)
+    with tab_currencies:
+        pie_chart = alt.Chart(valuation.by_currency).mark_arc(outerRadius=120).encode(
+            theta=alt.Theta("Nykyinen arvo", stack=True),
+            color=alt.Color("Valuutta"),
+            tooltip=["Valuutta", alt.Tooltip("Nykyinen arvo", format=".2f", title="Nykyinen arvo €"), alt.Tooltip("Osuus (%)", format=".1f")]
+        )
+        st.altair_chart(pie_chart, use_container_width=True)
+        st.dataframe(valuation.by_currency.style.format(value_format, na_rep="-"), hide_index=True, use_container_width=True)
+    with tab_history:
+        range_col, aggregation_col = st.columns(2)
+        with range_col:
+            range_label = st.selectbox("Aikaväli", list(HISTORY_RANGES), index=list(HISTORY_RANGES).index("1 v"), key="consolidated_history_range")
+        with aggregation_col:
+            aggregation_label = st.radio("Tarkkuus", list(HISTORY_AGGREGATIONS), horizontal=True, key="consolidated_history_aggregation")
+        range_days = HISTORY_RANGES[range_label]
+        rule = HISTORY_AGGREGATIONS[aggregation_label]
+        start = (date.today() - timedelta(days=range_days)).isoformat() if range_days else None
+        history_df = load_combined_history(portfolio_ids.values(), start=start)
+        if history_df.empty:
+            st.info("Ei tallennettuja historiatietoja. Tallenna salkkujen arvo aloittaaksesi seurannan.")
+        else:
+            history_df = downsample_history(history_df, rule)
+            base = alt.Chart(history_df).encode(x=alt.X('Päivämäärä:T', title='Päivämäärä'))
+            line_chart = base.mark_line().encode(
+                y=alt.Y('Arvo:Q', title='Salkkujen arvo (€)'),
+                tooltip=[alt.Tooltip('Päivämäärä:T', format='%Y-%m-%d'), alt.Tooltip('Arvo:Q', format='.2f')]
+            )
+            if rule:
+                line_chart = base.mark_area(opacity=0.2).encode(y='Matalin:Q', y2='Korkein:Q') + line_chart
+            st.altair_chart(line_chart.properties(title="Salkkujen yhteisarvon kehitys"), use_container_width=True)
+            st.caption("Kunkin salkun viimeisin tallennettu arvo on mukana summassa, kunnes salkulle tallennetaan uusi arvo.")
+
+def display_metrics_panel():
+    with st.sidebar.expander("Suorituskyky"):
+        registry = get_metrics()
+        snapshot = registry.snapshot()
+        calls = pd.DataFrame([
+            {
+                "Mittari": histogram["name"].removeprefix("salkku_"),
+                "Kohde": ", ".join(str(value) for value in histogram["labels"].values()),
+                "Kutsut": histogram["count"],
+                "Ka. (ms)": 1000 * histogram["sum"] / histogram["count"],
+                "Maks. (ms)": 1000 * histogram["max"],
+            }
+            for histogram in snapshot["histograms"]
+        ])
+        if calls.empty:
+            st.caption("Ei mittauksia vielä.")
+        else:
+            st.dataframe(calls.sort_values("Ka. (ms)", ascending=False), hide_index=True, use_container_width=True)
+        counters = pd.DataFrame([
+            {"Laskuri": counter["name"].removeprefix("salkku_"), "Kohde": ", ".join(str(value) for value in counter["labels"].values()), "Arvo": counter["value"]}
+            for counter in snapshot["counters"]
+        ])
+        if not counters.empty:
+            st.dataframe(counters, hide_index=True, use_container_width=True)
+        st.download_button("Prometheus", data=registry.to_prometheus, file_name="salkku_metrics.prom", mime="text/plain")
+        st.download_button("JSON", data=lambda: json.dumps(registry.snapshot()), file_name="salkku_metrics.json", mime="application/json")
+        if st.button("Nollaa mittarit"):
+            registry.reset()
+            st.rerun()
+
+ASSET_EDITOR_PAGE_SIZE = 50
+ASSET_CURRENCIES = ["EUR", "USD", "SEK", "GBP"]
+ASSET_EDITOR_COLUMNS = {
+    "name": st.column_config.TextColumn("Nimi", required=True),
+    "ticker": st.column_config.TextColumn("Symboli"),
+    "is_manual": st.column_config.CheckboxColumn("Manuaalinen", default=False, help="Hinta syötetään itse eikä sitä haeta."),
+    "manual_price": st.column_config.NumberColumn("Nykyinen hinta", min_value=0.01, format="%.2f", help="Käytetään vain manuaalisille kohteille."),
+    "currency": st.column_config.SelectboxColumn("Valuutta", options=ASSET_CURRENCIES, default="EUR", required=True),
+    "buy_price": st.column_config.NumberColumn("Ostohinta", min_value=0.01, default=0.01, format="%.2f", required=True),
+    "shares": st.column_config.NumberColumn("Osuudet", min_value=0.01, default=1.0, format="%.2f", required=True),
+    "buy_date": st.column_config.DateColumn("Ostopäivä", format="DD.MM.YYYY", help="Kun ostopäivä on annettu, ostokurssina käytetään kyseisen päivän valuuttakurssia."),
+    "buy_currency_rate": st.column_config.NumberColumn("Ostokurssi", min_value=0.01, default=1.0, format="%.4f", help="1 EUR = X valuuttaa ostohetkellä. Käytetään, jos ostopäivän kurssia ei löydy."),
+    "current_currency_rate": st.column_config.NumberColumn("Nykykurssi", min_value=0.01, default=1.0, format="%.4f", help="Nykykurssi haetaan automaattisesti. Syötetty kurssi on varalla, jos haku epäonnistuu."),
+    "target_percentage": st.column_config.NumberColumn("Tavoite (%)", min_value=0.0, max_value=100.0, default=0.0, format="%.1f"),
+}
+
+def asset_editor_frame(assets):
+    frame = pd.DataFrame([{field: asset.get(field) for field in ASSET_EDITOR_COLUMNS} for asset in assets], columns=list(ASSET_EDITOR_COLUMNS))
+    frame.index = pd.Index([asset.get('id') for asset in assets], name="id")
+    numeric = ["manual_price", "buy_price", "shares", "buy_currency_rate", "current_currency_rate", "target_percentage"]
+    frame[numeric] = frame[numeric].astype(float)
+    frame["is_manual"] = frame["is_manual"].fillna(False).astype(bool)
+    frame["buy_date"] = pd.Series([date.fromisoformat(asset['buy_date']) if asset.get('buy_date') else None for asset in assets], index=frame.index, dtype=object)
+    return frame
+
+def _editor_asset(values, asset_id=None):
+    asset = dict(ASSET_NEW_ROW, id=asset_id)
+    for field, value in values.items():
+        if field in asset and not (value is None or (isinstance(value, float) and math.isnan(value))):
+            asset[field] = value
+    asset["ticker"] = (asset["ticker"] or "").upper()
+    asset["is_manual"] = bool(asset["is_manual"])
+    asset["manual_price"] = asset["manual_price"] if asset["is_manual"] else None
+    if isinstance(asset["buy_date"], (date, datetime)):
+        asset["buy_date"] = asset["buy_date"].isoformat()[:10]
+    elif asset["buy_date"]:
+        asset["buy_date"] = str(asset["buy_date"])[:10]
+    return asset
+
+def asset_editor_changes(page_frame, editor_state):
+    """Turns st.data_editor's edit log into (changed assets, deleted asset ids) for the rows of one page."""
+    # The log addresses rows by position in the displayed frame, so positions are mapped back to asset ids here.
+    changed = []
+    for position, patch in editor_state.get("edited_rows", {}).items():
+        position = int(position)
+        values = page_frame.iloc[position].to_dict()
+        values.update(patch)
+        changed.append(_editor_asset(values, asset_id=int(page_frame.index[position])))
+    changed.extend(_editor_asset(values) for values in editor_state.get("added_rows", []))
+    deleted = [int(page_frame.index[position]) for position in editor_state.get("deleted_rows", [])]
+    return changed, deleted
 
 def main():
     st.title("Sijoitussalkun seuranta 📊")
@@ -480,22 +477,38 @@ def main():
     if st.session_state.logged_in:
         if st.sidebar.button("Kirjaudu ulos"):
             logout()
+
+        with st.sidebar.expander("Hintavälimuisti"):
+            cache_stats = get_quote_cache_stats().snapshot()
+            st.write(f"Osumat: {cache_stats['hits']}, ohitukset: {cache_stats['misses']} ({cache_stats['hit_ratio']:.0%})")
+            st.caption(f"Hintojen voimassaoloaika {cache_stats['ttl_seconds']} s (SALKKU_QUOTE_TTL).")
+
+        if METRICS_ENABLED:
+            display_metrics_panel()
         
         portfolios = load_portfolios(st.session_state.user_id)
         
         st.sidebar.header("Hallitse salkkuja")
         portfolio_names = sorted(list(portfolios.keys()))
         
+        portfolio_options = ["Uusi salkku"] + ([ALL_PORTFOLIOS] if len(portfolio_names) > 1 and ALL_PORTFOLIOS not in portfolios else []) + portfolio_names
+        
         current_index = 0
-        if st.session_state.selected_portfolio in portfolio_names:
-            current_index = portfolio_names.index(st.session_state.selected_portfolio) + 1
+        if st.session_state.selected_portfolio in portfolio_options:
+            current_index = portfolio_options.index(st.session_state.selected_portfolio)
             
-        selected_portfolio_name = st.sidebar.selectbox("Valitse salkku", ["Uusi salkku"] + portfolio_names, index=current_index)
+        selected_portfolio_name = st.sidebar.selectbox("Valitse salkku", portfolio_options, index=current_index)
         
         if selected_portfolio_name != st.session_state.selected_portfolio:
             st.session_state.selected_portfolio = selected_portfolio_name
             st.rerun() 
         
+        cost_method = COST_METHODS[st.sidebar.radio("Hankintamenon laskenta", list(COST_METHODS), key="cost_method", help="Tapahtumista kirjattujen positioiden hankintameno FIFO- tai keskihintamenetelmällä.")]
+
+        if selected_portfolio_name == ALL_PORTFOLIOS:
+            display_consolidated_dashboard(st.session_state.user_id, cost_method)
+            return
+
         current_assets = []
         if selected_portfolio_name == "Uusi salkku":
             st.subheader("Uusi salkku")
@@ -512,56 +525,40 @@ def main():
             return
         else:
             current_assets = portfolios[selected_portfolio_name]
+            # The editor writes by id, so its saves land in this portfolio only.
+            portfolio_id = get_portfolio_id(selected_portfolio_name, st.session_state.user_id)
             st.subheader(f"Muokkaa salkkua: {selected_portfolio_name}")
             st.markdown("---")
         
-        num_assets = st.number_input("Kuinka monta sijoituskohdetta sinulla on?", min_value=0, value=len(current_assets), step=1)
-        
-        assets = []
-        for i in range(1, int(num_assets) + 1):
-            st.subheader(f"Sijoituskohde {i}")
-            asset_data = current_assets[i-1] if (i-1) < len(current_assets) else {}
-            
-            name = st.text_input(f"Syötä kohteen nimi:", value=asset_data.get('name', ''), key=f"name_{i}")
-            ticker = st.text_input(f"Syötä osakkeen symboli:", value=asset_data.get('ticker', ''), key=f"ticker_{i}").upper()
-            
-            col1, col2 = st.columns(2)
-            with col1:
-                manual_input = st.checkbox("Manuaalinen syöttö", key=f"manual_{i}", value=asset_data.get('is_manual', False))
-                if manual_input:
-                    manual_price = st.number_input(f"Syötä nykyinen hinta:", min_value=0.01, value=asset_data.get('manual_price', 0.01), key=f"manual_price_{i}")
-                    currency = st.selectbox("Valuutta:", ["EUR", "USD", "SEK", "GBP"], key=f"manual_currency_{i}", index=["EUR", "USD", "SEK", "GBP"].index(asset_data.get('currency', 'EUR')))
-                else:
-                    manual_price = None
-                    currency = st.selectbox("Valuutta:", ["EUR", "USD", "SEK", "GBP"], key=f"currency_{i}", index=["EUR", "USD", "SEK", "GBP"].index(asset_data.get('currency', 'EUR')))
-
-            with col2:
-                buy_price = st.number_input(f"Syötä ostohinta:", min_value=0.01, value=asset_data.get('buy_price', 0.01), step=0.01, format="%.2f", key=f"buy_price_{i}")
-                shares = st.number_input(f"Syötä omistettujen osuuksien määrä:", min_value=0.01, value=asset_data.get('shares', 1.0), step=0.01, format="%.2f", key=f"shares_{i}")
-                buy_currency_rate = st.number_input(f"Ostokurssi (1 EUR = X {currency}):", min_value=0.01, value=asset_data.get('buy_currency_rate', 1.0), step=0.01, format="%.2f", key=f"buy_currency_rate_{i}", help="Syötä valuutan kurssi ostohetkellä suhteessa euroon.")
-                current_currency_rate = st.number_input(f"Nykykurssi (1 EUR = X {currency}):", min_value=0.01, value=asset_data.get('current_currency_rate', 1.0), step=0.01, format="%.2f", key=f"current_currency_rate_{i}", help="Syötä valuutan kurssi tällä hetkellä suhteessa euroon.")
-                
-            target_percentage = st.number_input(f"Tavoiteosuus salkusta (%):", min_value=0.0, max_value=100.0, value=asset_data.get('target_percentage', 0.0), step=0.1, key=f"target_percentage_{i}")
-                
-            assets.append({
-                "name": name, 
-                "ticker": ticker, 
-                "buy_price": buy_price, 
-                "shares": shares, 
-                "manual_price": manual_price, 
-                "is_manual": manual_input, 
-                "currency": currency, 
-                "buy_currency_rate": buy_currency_rate, 
-                "current_currency_rate": current_currency_rate, 
-                "target_percentage": target_percentage
-            })
+        editor_frame = asset_editor_frame(current_assets)
+        page_count = max(1, math.ceil(len(editor_frame) / ASSET_EDITOR_PAGE_SIZE))
+        page = 1
+        if page_count > 1:
+            page = st.number_input(f"Sivu (1–{page_count})", min_value=1, max_value=page_count, value=1, step=1, key=f"asset_page_{selected_portfolio_name}")
+        page_frame = editor_frame.iloc[(page - 1) * ASSET_EDITOR_PAGE_SIZE:page * ASSET_EDITOR_PAGE_SIZE]
+        # Bumping the version after a save gives the editor a fresh key, which discards its already-applied edit log.
+        editor_version = st.session_state.setdefault("asset_editor_version", 0)
+        editor_key = f"asset_editor_{selected_portfolio_name}_{page}_{editor_version}"
+        st.data_editor(
+            page_frame,
+            key=editor_key,
+            hide_index=True,
+            num_rows="dynamic",
+            column_config=ASSET_EDITOR_COLUMNS,
+            column_order=list(ASSET_EDITOR_COLUMNS),
+            use_container_width=True,
+        )
+        changed_assets, deleted_ids = asset_editor_changes(page_frame, st.session_state.get(editor_key, {}))
+        if changed_assets or deleted_ids:
+            st.caption(f"Tallentamattomia muutoksia: {len(changed_assets)} riviä muutettu tai lisätty, {len(deleted_ids)} poistettu. Tallenna ennen sivun vaihtamista.")
         
         col1, col2 = st.columns(2)
         with col1:
             if st.button(f"Tallenna muutokset salkkuun '{selected_portfolio_name}'"):
-                portfolios[selected_portfolio_name] = assets
-                save_portfolios(st.session_state.user_id, portfolios)
+                save_asset_changes(st.session_state.user_id, portfolio_id, changed_assets, deleted_ids)
+                st.session_state.asset_editor_version = editor_version + 1
                 st.success(f"Muutokset salkkuun '{selected_portfolio_name}' tallennettu!")
+                st.rerun()
         with col2:
             if st.button(f"Poista salkku '{selected_portfolio_name}'"):
                 if delete_portfolio(selected_portfolio_name, st.session_state.user_id):
@@ -571,27 +568,60 @@ def main():
                 else:
                     st.error("Salkun poistaminen epäonnistui.")
 
+        with st.expander("Tuo tai vie omistukset (CSV / Parquet)"):
+            st.caption(f"Sarakkeet: {', '.join(ASSET_FIELDS)}. Pakollisia ovat {', '.join(IMPORT_REQUIRED_COLUMNS)}; tuodut rivit lisätään salkkuun.")
+            upload = st.file_uploader("Tuotava tiedosto", type=["csv", "parquet"], key="asset_import_file")
+            if upload is not None and st.button("Tuo omistukset"):
+                file_format = "parquet" if upload.name.lower().endswith(".parquet") else "csv"
+                try:
+                    result = import_assets(st.session_state.user_id, selected_portfolio_name, upload, file_format)
+                except ValueError as error:
+                    st.error(f"Tuonti epäonnistui: {error}")
+                else:
+                    st.success(f"Tuotiin {result['imported']} kohdetta.")
+                    if result["rejected"]:
+                        st.warning(f"{result['rejected']} riviä hylättiin.")
+                        st.dataframe(pd.DataFrame(result["errors"], columns=["Rivi", "Syy"]), hide_index=True)
+                    st.session_state.asset_editor_version = editor_version + 1
+            export_col1, export_col2 = st.columns(2)
+            with export_col1:
+                st.download_button("Lataa CSV", data=lambda: export_assets(st.session_state.user_id, selected_portfolio_name, "csv"), file_name=f"{selected_portfolio_name}_omistukset.csv", mime="text/csv")
+            with export_col2:
+                st.download_button("Lataa Parquet", data=lambda: export_assets(st.session_state.user_id, selected_portfolio_name, "parquet"), file_name=f"{selected_portfolio_name}_omistukset.parquet", mime="application/vnd.apache.parquet")
+
         st.markdown("---")
 
-        tab1, tab2 = st.tabs(["Salkun tarkastelu", "PDF-raportti"])
+        holdings = portfolio_holdings(portfolio_id, portfolios[selected_portfolio_name], cost_method)
+
+        tab1, tab_analytics, tab_rebalance, tab2, tab3 = st.tabs(["Salkun tarkastelu", "Analytiikka", "Tasapainotus", "PDF-raportti", "Tapahtumat"])
 
         with tab1:
             st.header("Salkun tarkastelu")
             if selected_portfolio_name != "Uusi salkku":
                 if st.button(f"Tarkastele salkkua '{selected_portfolio_name}'"):
                     st.write("Haetaan hintatiedot...")
-                    all_tickers = [asset['ticker'] for asset in portfolios[selected_portfolio_name] if not asset.get('is_manual') and asset.get('ticker')]
-                    current_prices = get_stock_data(list(set(all_tickers)))
-                    
-                    df, total_row = calculate_portfolio_metrics(portfolios[selected_portfolio_name], current_prices)
-                    total_current_value = total_row["Nykyinen arvo"].iloc[0]
-                    
-                    with sqlite3.connect(DB_FILE) as conn:
-                        cursor = conn.cursor()
-                        cursor.execute("SELECT id FROM portfolios WHERE name = ? AND user_id = ?", (selected_portfolio_name, st.session_state.user_id))
-                        portfolio_id = cursor.fetchone()[0]
-
-                    display_portfolio_summary(df, total_row, selected_portfolio_name)
+                    get_valuation_snapshot(holdings, refresh=True)
+                    st.session_state.viewed_portfolio = selected_portfolio_name
+
+                # The view stays open across reruns, e.g. the one triggered by the save button below.
+                if st.session_state.get("viewed_portfolio") == selected_portfolio_name:
+                    snapshot = get_valuation_snapshot(holdings)
+                    total_current_value = snapshot.total_row["Nykyinen arvo"].iloc[0]
+                    live_col, interval_col = st.columns(2)
+                    with live_col:
+                        live_mode = st.toggle("Live-seuranta", key="live_mode", help="Päivittää arvon, erittelyn ja kaaviot taustalla haetuilla hinnoilla lataamatta muuta sivua uudelleen.")
+                    with interval_col:
+                        interval = LIVE_REFRESH_INTERVALS[st.selectbox("Päivitysväli", list(LIVE_REFRESH_INTERVALS), key="live_interval", disabled=not live_mode)]
+
+                    if live_mode and not snapshot.df.empty:
+                        st.subheader(f"Yhteenveto: {selected_portfolio_name}")
+                        display_live_valuation(holdings, interval)
+                        st.markdown("---")
+                        display_portfolio_history(selected_portfolio_name, holdings)
+                    else:
+                        warn_price_failures(snapshot.prices)
+                        st.caption(f"Hinnat haettu {datetime.fromtimestamp(snapshot.priced_at).strftime('%d.%m.%Y %H:%M')}")
+                        display_portfolio_summary(snapshot.df, snapshot.total_row, selected_portfolio_name, holdings)
                     
                     st.markdown("---")
                     st.subheader("Salkun kehityksen tallennus")
@@ -601,22 +631,99 @@ def main():
                         else:
                             st.warning("Salkun arvo on jo tallennettu tälle päivälle.")
 
+        with tab_analytics:
+            st.header("Analytiikka")
+            analytics_years = ANALYTICS_RANGES[st.selectbox("Tarkastelujakso", list(ANALYTICS_RANGES), key="analytics_range")]
+            if st.button("Laske tuotto- ja riskiluvut"):
+                st.session_state.analytics_portfolio = selected_portfolio_name
+            # Results are cached per holdings and day, so keeping the view open across reruns costs a cache lookup.
+            if st.session_state.get("analytics_portfolio") == selected_portfolio_name:
+                display_portfolio_analytics(get_portfolio_analytics(portfolio_id, portfolios[selected_portfolio_name], holdings, analytics_years))
+
+        with tab_rebalance:
+            st.header("Tasapainotus")
+            st.write("Toimeksiannot, joilla kohteet, joille on asetettu tavoiteosuus, siirtyvät kohti tavoitetta. Manuaalisia kohteita ei käydä kauppaa.")
+            col1, col2 = st.columns(2)
+            with col1:
+                st.number_input("Sijoitettava käteinen (€)", min_value=0.0, value=0.0, step=100.0, key="rebalance_cash")
+                st.number_input("Pienin toimeksianto (€)", min_value=0.0, value=0.0, step=10.0, key="rebalance_min_trade")
+            with col2:
+                st.checkbox("Vain kokonaiset osakkeet", value=True, key="rebalance_whole_shares")
+                st.checkbox("Salli myynnit", value=True, key="rebalance_allow_sell", help="Ilman myyntejä ylipainot korjataan vain ostamalla alipainoja käteisellä.")
+            if st.button("Laske toimeksiannot"):
+                st.session_state.rebalance_portfolio = selected_portfolio_name
+            if st.session_state.get("rebalance_portfolio") == selected_portfolio_name:
+                plan = get_rebalance_plan(holdings)
+                warn_price_failures(get_valuation_snapshot(holdings).prices)
+                display_rebalance_plan(plan, selected_portfolio_name)
+
         with tab2:
             st.header("Luo PDF-raportti")
             st.write("Valitse salkku ja luo raportti ladattavaksi.")
             if selected_portfolio_name != "Uusi salkku" and st.button("Luo PDF-raportti", key="pdf_button"):
-                all_tickers = [asset['ticker'] for asset in portfolios[selected_portfolio_name] if not asset.get('is_manual') and asset.get('ticker')]
-                current_prices = get_stock_data(list(set(all_tickers)))
-                
-                df, total_row = calculate_portfolio_metrics(portfolios[selected_portfolio_name], current_prices)
+                snapshot = get_valuation_snapshot(holdings)
+                warn_price_failures(snapshot.prices)
+                analytics = get_portfolio_analytics(portfolio_id, portfolios[selected_portfolio_name], holdings, analytics_years)
+                # The rebalancing proposal is included once it has been calculated on its tab.
+                rebalance = get_rebalance_plan(holdings) if st.session_state.get("rebalance_portfolio") == selected_portfolio_name else None
                 
-                pdf_data = create_pdf_report(df, total_row, selected_portfolio_name)
+                pdf_data = get_pdf_report(snapshot.df, snapshot.total_row, selected_portfolio_name, analytics=analytics, rebalance=rebalance)
                 st.download_button(
                     label="Lataa PDF-raportti",
                     data=pdf_data,
                     file_name=f"{selected_portfolio_name}_raportti.pdf",
                     mime="application/pdf"
                 )
+
+        with tab3:
+            st.header("Tapahtumat")
+            with st.form("transaction_form", clear_on_submit=True):
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    transaction_kind = st.selectbox("Tyyppi", TRANSACTION_KINDS, format_func={"buy": "Osto", "sell": "Myynti", "dividend": "Osinko"}.get)
+                    transaction_ticker = st.text_input("Symboli")
+                    transaction_name = st.text_input("Nimi (valinnainen)")
+                with col2:
+                    trade_date = st.date_input("Kauppapäivä", value=date.today())
+                    transaction_shares = st.number_input("Määrä", min_value=0.0, value=1.0, step=1.0, help="Osingolle osinkoon oikeuttavien osakkeiden määrä.")
+                    transaction_price = st.number_input("Hinta / kpl", min_value=0.0, value=0.0, step=0.01, format="%.4f", help="Osingolle osinko osaketta kohden.")
+                with col3:
+                    transaction_fees = st.number_input("Kulut", min_value=0.0, value=0.0, step=0.01, format="%.2f")
+                    transaction_currency = st.selectbox("Valuutta", ASSET_CURRENCIES)
+                    transaction_fx_rate = st.number_input(f"Kurssi (1 {BASE_CURRENCY} = X)", min_value=0.0, value=0.0, step=0.0001, format="%.4f", help="Jätä nollaksi, niin kauppapäivän kurssi haetaan automaattisesti.")
+                if st.form_submit_button("Kirjaa tapahtuma"):
+                    try:
+                        record_transaction(portfolio_id, transaction_ticker, transaction_kind, transaction_shares, transaction_price, trade_date.isoformat(),
+                                           transaction_fees, transaction_currency, transaction_fx_rate or None, transaction_name)
+                    except ValueError as error:
+                        st.error(str(error))
+                    else:
+                        st.success("Tapahtuma kirjattu.")
+                        # Holdings were read at the top of this run; rerun so the valuation includes the new position.
+                        st.rerun()
+
+            st.subheader("Positiot")
+            position_summary = load_position_summary(portfolio_id)
+            if position_summary.empty:
+                st.info("Ei kirjattuja tapahtumia. Tapahtumista muodostetut positiot näkyvät salkun arvostuksessa.")
+            else:
+                st.dataframe(position_summary, hide_index=True, use_container_width=True)
+
+            st.subheader("Viimeisimmät tapahtumat")
+            transactions = load_transactions(portfolio_id)
+            if not transactions.empty:
+                st.dataframe(transactions, hide_index=True, use_container_width=True)
+                removed_id = st.selectbox("Poistettava tapahtuma", transactions["id"], format_func=lambda transaction_id: f"#{transaction_id}")
+                if st.button("Poista tapahtuma"):
+                    try:
+                        deleted = delete_transaction(int(removed_id), st.session_state.user_id)
+                    except ValueError as error:
+                        st.error(f"Tapahtumaa ei voi poistaa: {error}")
+                    else:
+                        if deleted:
+                            st.rerun()
+                        else:
+                            st.error("Tapahtumaa ei löytynyt. Se on ehkä jo poistettu.")
     else:
         st.sidebar.subheader("Kirjaudu sisään tai rekisteröidy")
         login_form = st.sidebar.form("login_form")
@@ -644,4 +751,6 @@ def main():
 
 if __name__ == "__main__":
     init_db()
+    if len(sys.argv) > 1:
+        sys.exit(run_cli(sys.argv[1:]))
     main()
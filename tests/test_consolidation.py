@@ -0,0 +1,23 @@
+from salkku.consolidation import value_consolidated
+
+def _asset(name, ticker, buy_price, shares, currency="EUR"):
+    return {"name": name, "ticker": ticker, "buy_price": buy_price, "shares": shares, "manual_price": None, "is_manual": False,
+            "currency": currency, "buy_currency_rate": 1.0, "current_currency_rate": 1.0, "target_percentage": 0.0, "buy_date": None}
+
+def test_value_consolidated_without_any_quotes():
+    portfolios = {"KK": [_asset("Nokia", "NOKIA.HE", 4.0, 100)], "OS": [_asset("Apple", "AAPL", 150.0, 2, "USD")]}
+    consolidated = value_consolidated(portfolios, {})
+
+    assert consolidated.holdings.empty
+    assert consolidated.portfolios["Salkku"].tolist() == ["KK", "OS"]
+    assert consolidated.portfolios["Nykyinen arvo"].tolist() == [0.0, 0.0]
+    assert consolidated.total_row.loc[0, "Tuotto (%)"] == 0.0
+    assert consolidated.by_ticker.empty and consolidated.by_currency.empty
+
+def test_value_consolidated_profit_percent():
+    portfolios = {"KK": [_asset("Nokia", "NOKIA.HE", 4.0, 100)], "OS": [_asset("Apple", "AAPL", 150.0, 2, "USD")]}
+    consolidated = value_consolidated(portfolios, {"NOKIA.HE": 5.0})
+
+    assert consolidated.total_row.loc[0, "Nykyinen arvo"] == 500.0
+    assert consolidated.total_row.loc[0, "Tuotto (%)"] == 25.0
+    assert consolidated.by_ticker["Ticker"].tolist() == ["NOKIA.HE"]
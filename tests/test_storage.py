@@ -0,0 +1,111 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from salkku import db, storage
+
+def _asset(name, shares):
+    return (name, name.upper(), 10.0, shares, None, 0, "EUR", 1.0, 1.0, 0.0, None)
+
+@pytest.fixture
+def duplicate_names_db(tmp_path, monkeypatch):
+    """A database at schema version 6 where user 1 owns two portfolios named 'KK', each with its own assets and history."""
+    path = str(tmp_path / "seuranta.db")
+    conn = sqlite3.connect(path)
+    monkeypatch.setattr(db, "MIGRATIONS", db.MIGRATIONS[:6])
+    db.migrate_db(conn)
+    monkeypatch.undo()
+    conn.execute("INSERT INTO users (id, username, password_hash) VALUES (1, 'u', 'x')")
+    for portfolio_id, shares in ((1, 1.0), (2, 2.0)):
+        conn.execute("INSERT INTO portfolios (id, name, user_id) VALUES (?, 'KK', 1)", (portfolio_id,))
+        conn.execute(f"INSERT INTO assets ({', '.join(db.ASSET_FIELDS)}, portfolio_id) VALUES ({', '.join('?' * 12)})",
+                     _asset(f"a{portfolio_id}", shares) + (portfolio_id,))
+        conn.execute("INSERT INTO portfolio_history (portfolio_id, record_date, total_value) VALUES (?, '2024-01-02', ?)", (portfolio_id, 10.0 * shares))
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(db, "DB_FILE", path)
+    storage.get_portfolio_cache().clear()
+    yield path
+    storage.get_portfolio_cache().clear()
+    db._pools.pop(path).close()
+
+def test_migration_keeps_same_named_portfolios_apart(duplicate_names_db):
+    portfolios = storage.load_portfolios(1)
+    assert {name: [asset.shares for asset in assets] for name, assets in portfolios.items()} == {"KK (1)": [1.0], "KK": [2.0]}
+    assert storage.get_portfolio_id("KK", 1) == 2
+
+def test_save_portfolios_with_formerly_same_named_portfolios(duplicate_names_db):
+    portfolios = {name: [asset.to_dict() for asset in assets] for name, assets in storage.load_portfolios(1).items()}
+    portfolios["KK"][0]["shares"] = 5.0
+    storage.save_portfolios(1, portfolios)
+
+    conn = sqlite3.connect(duplicate_names_db)
+    assets = conn.execute("SELECT portfolio_id, shares FROM assets ORDER BY portfolio_id").fetchall()
+    history = conn.execute("SELECT portfolio_id, total_value FROM portfolio_history ORDER BY portfolio_id").fetchall()
+    conn.close()
+    assert assets == [(1, 1.0), (2, 5.0)]
+    assert history == [(1, 10.0), (2, 20.0)]
+
+def test_portfolio_names_are_unique_per_user(duplicate_names_db):
+    storage.load_portfolios(1)
+    conn = sqlite3.connect(duplicate_names_db)
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute("INSERT INTO portfolios (name, user_id) VALUES ('KK', 1)")
+    conn.close()
+
+def test_save_portfolios_leaves_unshown_duplicate_alone(duplicate_names_db, monkeypatch):
+    monkeypatch.setattr(db, "MIGRATIONS", db.MIGRATIONS[:6])
+    portfolios = {name: [asset.to_dict() for asset in assets] for name, assets in storage.load_portfolios(1).items()}
+    assert {name: [asset["shares"] for asset in assets] for name, assets in portfolios.items()} == {"KK": [2.0]}
+    storage.save_portfolios(1, portfolios)
+
+    conn = sqlite3.connect(duplicate_names_db)
+    assets = conn.execute("SELECT portfolio_id, shares FROM assets ORDER BY portfolio_id").fetchall()
+    conn.close()
+    assert assets == [(1, 1.0), (2, 2.0)]
+
+def _combined(portfolio_ids, **kwargs):
+    return storage.load_combined_history(portfolio_ids, **kwargs).to_dict("list")
+
+@pytest.fixture
+def empty_db(tmp_path, monkeypatch):
+    path = str(tmp_path / "seuranta.db")
+    monkeypatch.setattr(db, "DB_FILE", path)
+    yield path
+    storage.get_portfolio_cache().clear()
+    db._pools.pop(path).close()
+
+def test_load_combined_history_reads_exported_dates_from_columnar(empty_db, tmp_path, monkeypatch):
+    from salkku import columnar
+    path = empty_db
+    storage.register_user("u", "p")
+    user_id = storage.login_user("u", "p")
+    storage.save_portfolios(user_id, {"A": [], "B": []})
+    ids = storage.load_portfolio_ids(user_id)
+    rows = [(ids["A"], "2024-01-01", 100.0), (ids["A"], "2024-01-03", 110.0), (ids["B"], "2024-01-02", 50.0),
+            (ids["A"], "2024-02-01", 120.0), (ids["B"], "2024-02-02", 60.0)]
+    conn = sqlite3.connect(path)
+    conn.executemany("INSERT INTO portfolio_history (portfolio_id, record_date, total_value) VALUES (?, ?, ?)", rows)
+    conn.commit()
+    root = str(tmp_path / "columnar")
+    expected = {window: _combined(ids.values(), start=window[0], end=window[1], columnar_root=root)
+                for window in ((None, None), ("2024-01-02", None), ("2024-01-03", "2024-02-01"))}
+
+    columnar.export_history_columnar(root, until="2024-02-01")
+    assert columnar.columnar_watermark("portfolio_history", root) == "2024-01-03"
+    reads = []
+    monkeypatch.setattr(storage, "read_columnar", lambda *args, **kwargs: reads.append(args) or columnar.read_columnar(*args, **kwargs))
+    for (start, end), frame in expected.items():
+        assert _combined(ids.values(), start=start, end=end, columnar_root=root) == frame
+    assert [args[1:3] for args in reads] == [(None, "2024-01-03"), ("2024-01-02", "2024-01-03"), ("2024-01-03", "2024-01-03")]
+    assert _combined(ids.values(), start="2024-01-04", columnar_root=root) == {"Päivämäärä": list(pd.to_datetime(["2024-02-01", "2024-02-02"])), "Arvo": [170.0, 180.0]}
+    assert len(reads) == 3
+    assert storage.load_combined_history(ids.values(), end="2024-01-03", columnar_root=root)["Arvo"].dtype == "float64"
+
+    # A portfolio reusing the id of a deleted one does not pick up the deleted portfolio's exported history.
+    conn.execute("DELETE FROM portfolio_history WHERE portfolio_id = ?", (ids["A"],))
+    conn.execute("INSERT INTO portfolio_history (portfolio_id, record_date, total_value) VALUES (?, '2024-02-05', 1.0)", (ids["A"],))
+    conn.commit()
+    conn.close()
+    assert _combined([ids["A"]], columnar_root=root) == {"Päivämäärä": [pd.Timestamp("2024-02-05")], "Arvo": [1.0]}